@@ -0,0 +1,176 @@
+# -*- coding: utf-8-*-
+"""
+Continuous audio capture for the Mic class.
+
+A single AudioCapture thread keeps one PyAudio input stream open for the
+whole lifetime of Jasper and writes every chunk into a RingBuffer. Listen
+methods read from that buffer through CaptureReader objects instead of
+opening and closing their own streams, so no audio is lost between two
+listen calls. The capture thread also keeps the background noise estimate
+up to date, so listen methods don't have to calibrate before listening.
+"""
+import logging
+import threading
+import vad
+
+
+class RingBuffer(object):
+    """
+    Thread-safe, fixed-size buffer of audio chunks. Every chunk gets an
+    absolute, monotonically increasing position, so that readers can keep
+    track of what they have already consumed.
+    """
+
+    def __init__(self, size):
+        """
+        Arguments:
+            size -- the maximum number of chunks kept in the buffer
+        """
+        self._size = size
+        self._chunks = [None] * size
+        self._end = 0
+        self._cond = threading.Condition()
+
+    @property
+    def position(self):
+        """
+        Returns:
+            The position of the next chunk that will be written
+        """
+        with self._cond:
+            return self._end
+
+    @property
+    def start(self):
+        """
+        Returns:
+            The position of the oldest chunk that is still in the buffer
+        """
+        with self._cond:
+            return max(0, self._end - self._size)
+
+    def append(self, chunk):
+        with self._cond:
+            self._chunks[self._end % self._size] = chunk
+            self._end += 1
+            self._cond.notify_all()
+
+    def read(self, position, timeout=None):
+        """
+        Reads the chunk at the given position. Blocks until the chunk has
+        been captured. If the chunk has already been overwritten, the oldest
+        chunk still available is returned instead.
+
+        Arguments:
+            position -- the absolute position of the chunk
+            timeout -- (optional) seconds to wait for new data
+
+        Returns:
+            A tuple (chunk, next_position). chunk is None if the timeout
+            expired before any data arrived.
+        """
+        with self._cond:
+            if position >= self._end:
+                self._cond.wait(timeout)
+                if position >= self._end:
+                    return (None, position)
+            position = max(position, self._end - self._size)
+            return (self._chunks[position % self._size], position + 1)
+
+
+class CaptureReader(object):
+    """
+    A cursor into the AudioCapture ring buffer. Mimics the read() method of
+    a PyAudio input stream.
+    """
+
+    def __init__(self, capture, position):
+        self._capture = capture
+        self.position = position
+
+    def read(self):
+        """
+        Returns the next captured chunk, blocking until it is available.
+
+        Raises:
+            IOError if the capture thread does not deliver any audio
+        """
+        chunk, self.position = self._capture.buffer.read(
+            self.position, timeout=self._capture.timeout)
+        if chunk is None:
+            raise IOError("No audio data captured within %s seconds" %
+                          self._capture.timeout)
+        return chunk
+
+
+class AudioCapture(threading.Thread):
+    """
+    Daemon thread that continuously reads from a single PyAudio input
+    stream and stores the audio data in a RingBuffer.
+    """
+
+    def __init__(self, audio, rate=16000, chunk=1024, buffer_time=30,
+                 timeout=5, noise_floor=None):
+        """
+        Arguments:
+            audio -- an initialized pyaudio.PyAudio instance
+            rate -- (optional) the sample rate (Default: 16000)
+            chunk -- (optional) frames per chunk (Default: 1024)
+            buffer_time -- (optional) seconds of audio kept in the ring
+                           buffer (Default: 30)
+            timeout -- (optional) seconds a reader waits for new data before
+                       giving up (Default: 5)
+            noise_floor -- (optional) the vad.NoiseFloor instance to update
+                           with every captured chunk
+        """
+        super(AudioCapture, self).__init__(name='AudioCapture')
+        self.daemon = True
+        self._logger = logging.getLogger(__name__)
+        self._stop_event = threading.Event()
+        self.audio = audio
+        self.rate = rate
+        self.chunk = chunk
+        self.timeout = timeout
+        self.buffer = RingBuffer(rate / chunk * buffer_time)
+        self.noise_floor = (noise_floor if noise_floor is not None
+                            else vad.NoiseFloor())
+
+    @property
+    def position(self):
+        return self.buffer.position
+
+    def reader(self, position=None):
+        """
+        Returns a CaptureReader starting at the given position. If position
+        is None, the reader starts with the next captured chunk.
+        """
+        if position is None:
+            position = self.buffer.position
+        return CaptureReader(self, max(position, self.buffer.start))
+
+    def run(self):
+        self._logger.debug("Opening capture stream")
+        stream = self.audio.open(
+            format=self.audio.get_format_from_width(2),
+            channels=1,
+            rate=self.rate,
+            input=True,
+            frames_per_buffer=self.chunk)
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    data = stream.read(self.chunk)
+                except IOError:
+                    # Input overflows are harmless, we just lost a chunk
+                    self._logger.debug("Error while reading from capture " +
+                                       "stream", exc_info=True)
+                    continue
+                self.buffer.append(data)
+                self.noise_floor.update(vad.score(data))
+        finally:
+            stream.stop_stream()
+            stream.close()
+            self._logger.debug("Capture stream closed")
+
+    def stop(self):
+        self._stop_event.set()
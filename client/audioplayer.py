@@ -0,0 +1,241 @@
+# -*- coding: utf-8-*-
+"""
+In-process audio playback through PyAudio.
+
+The PyAudioPlayer reuses the PyAudio instance of the Mic and keeps its
+output streams open between playbacks, so playing a short sound doesn't
+fork a process and open the sound device every time. Streams are closed
+after a few idle seconds, so that other programs (e.g. MPD or aplay) can use
+sound cards without software mixing. Sounds that are played often (like the
+beeps around every command) can be preloaded, so that their PCM data is kept
+in memory.
+
+The output device can be set in profile.yml, either by its PyAudio index, by
+(a part of) its name or as 'default' for the system's default device:
+
+    audio:
+      output_device: 'USB Audio'
+
+Without this setting, the device of ALSA card 1 (hw:1,0) is used, which
+aplay used to play to.
+"""
+import os
+import logging
+import threading
+
+import yaml
+
+import jasperpath
+from audiosegment import AudioSegment
+
+# Part of the name of the device used if the profile doesn't set one
+DEFAULT_OUTPUT_DEVICE = 'hw:1,0'
+
+
+class PyAudioPlayer(object):
+    """
+    Plays WAV files and AudioSegments on a PyAudio output stream.
+    """
+
+    def __init__(self, audio, output_device_index=None, chunk=1024,
+                 idle_timeout=5):
+        """
+        Arguments:
+            audio -- an initialized pyaudio.PyAudio instance
+            output_device_index -- (optional) the PyAudio index of the
+                                   output device (Default: the system's
+                                   default output device)
+            chunk -- (optional) frames written to the stream at once
+                     (Default: 1024)
+            idle_timeout -- (optional) seconds after the last playback
+                            after which the streams are closed (Default: 5)
+        """
+        self._logger = logging.getLogger(__name__)
+        self.audio = audio
+        self.output_device_index = output_device_index
+        self.chunk = chunk
+        self.idle_timeout = idle_timeout
+        self._idle_timer = None
+        self._lock = threading.RLock()
+        # Open output streams, keyed by (width, channels, rate)
+        self._streams = {}
+        # Preloaded sounds, keyed by filename
+        self._segments = {}
+
+    @classmethod
+    def get_config(cls):
+        config = {}
+        profile_path = jasperpath.config('profile.yml')
+        if os.path.exists(profile_path):
+            with open(profile_path, 'r') as f:
+                profile = yaml.safe_load(f)
+                if ('audio' in profile and
+                        'output_device' in profile['audio']):
+                    config['output_device'] = \
+                        profile['audio']['output_device']
+        return config
+
+    @classmethod
+    def get_instance(cls, audio):
+        """
+        Arguments:
+            audio -- an initialized pyaudio.PyAudio instance
+
+        Returns:
+            A player for the output device configured in the profile, or
+            None if the device can't be found
+        """
+        config = cls.get_config()
+        device = config.pop('output_device', DEFAULT_OUTPUT_DEVICE)
+        try:
+            index = find_output_device(audio, device)
+        except LookupError as e:
+            logging.getLogger(__name__).warning(
+                "%s, playing audio with aplay instead", e)
+            return None
+        return cls(audio, output_device_index=index, **config)
+
+    def preload(self, filename):
+        """
+        Decodes a WAV file and keeps its PCM data in memory for all further
+        playbacks.
+        """
+        with open(filename, 'rb') as f:
+            self._segments[filename] = AudioSegment.from_wav(f)
+
+    def play(self, filename):
+        """
+        Plays a WAV file, using its preloaded PCM data if available.
+        """
+        segment = self._segments.get(filename)
+        if segment is None:
+            with open(filename, 'rb') as f:
+                segment = AudioSegment.from_wav(f)
+        self.play_segment(segment)
+
+    def play_segment(self, segment):
+        """
+        Plays an AudioSegment and blocks until playback has finished.
+        """
+        data = segment.raw_data
+        size = self.chunk * segment.width * segment.channels
+        self.play_chunks((data[offset:offset + size]
+                          for offset in xrange(0, len(data), size)),
+                         segment.width, segment.channels, segment.rate)
+
+    def play_chunks(self, chunks, width, channels, rate):
+        """
+        Plays raw PCM chunks as they are produced and blocks until playback
+        has finished.
+
+        Arguments:
+            chunks -- an iterable of raw PCM chunks, e.g. a generator that
+                      decodes them
+            width -- the sample width in bytes
+            channels -- the number of channels
+            rate -- the sample rate
+        """
+        with self._lock:
+            if self._idle_timer is not None:
+                self._idle_timer.cancel()
+            try:
+                stream = self.open_stream(width, channels, rate)
+                for chunk in chunks:
+                    stream.write(chunk)
+            except IOError:
+                # Start over with a new stream next time
+                self.close()
+                raise
+            finally:
+                self._idle_timer = threading.Timer(self.idle_timeout,
+                                                   self._close_idle)
+                self._idle_timer.daemon = True
+                self._idle_timer.start()
+
+    def _close_idle(self):
+        with self._lock:
+            if self._streams:
+                self._logger.debug("Closing idle output streams")
+                self.close()
+
+    def open_stream(self, width, channels, rate):
+        """
+        Returns:
+            An output stream for the given format. Streams are kept open
+            and reused for all further playbacks in the same format.
+        """
+        key = (width, channels, rate)
+        with self._lock:
+            if key not in self._streams:
+                self._logger.debug("Opening output stream (width: %d, " +
+                                   "channels: %d, rate: %d)", *key)
+                try:
+                    self._streams[key] = self._open(*key)
+                except IOError:
+                    # Devices without software mixing can only be opened
+                    # once, so close the streams for other formats first
+                    self._logger.debug("Opening output stream failed, " +
+                                       "retrying after closing the other " +
+                                       "streams", exc_info=True)
+                    self.close()
+                    self._streams[key] = self._open(*key)
+            return self._streams[key]
+
+    def _open(self, width, channels, rate):
+        return self.audio.open(format=self.audio.get_format_from_width(width),
+                               channels=channels,
+                               rate=rate,
+                               output=True,
+                               output_device_index=self.output_device_index,
+                               frames_per_buffer=self.chunk)
+
+    def close(self):
+        """
+        Closes all output streams.
+        """
+        with self._lock:
+            for stream in self._streams.values():
+                try:
+                    stream.stop_stream()
+                    stream.close()
+                except IOError:
+                    self._logger.debug("Closing output stream failed",
+                                       exc_info=True)
+            self._streams.clear()
+
+
+def find_output_device(audio, device):
+    """
+    Looks up a PyAudio output device.
+
+    Arguments:
+        audio -- an initialized pyaudio.PyAudio instance
+        device -- the index of the device, a part of its name (case
+                  insensitive) or 'default'
+
+    Returns:
+        The index of the device, or None for the system's default output
+        device
+
+    Raises:
+        LookupError -- if there is no such output device
+    """
+    logger = logging.getLogger(__name__)
+    if device is None or device == 'default':
+        return None
+    try:
+        return int(device)
+    except ValueError:
+        pass
+    names = []
+    for index in xrange(audio.get_device_count()):
+        info = audio.get_device_info_by_index(index)
+        if info.get('maxOutputChannels', 0) <= 0:
+            continue
+        if device.lower() in info['name'].lower():
+            logger.debug("Using output device %d ('%s')", index,
+                         info['name'])
+            return index
+        names.append(info['name'])
+    raise LookupError("Output device '%s' not found, available devices: %s"
+                      % (device, ', '.join("'%s'" % name for name in names)))
@@ -0,0 +1,126 @@
+# -*- coding: utf-8-*-
+"""
+In-memory audio container that is handed from the Mic to the STT engines.
+"""
+import io
+import tempfile
+import wave
+
+
+class AudioSegment(object):
+    """
+    Raw PCM audio data together with its sample rate, sample width and
+    number of channels. Engines that work on raw PCM can use raw_data
+    directly, engines that need a WAV container can ask for one.
+    """
+
+    def __init__(self, data, rate=16000, width=2, channels=1):
+        """
+        Arguments:
+            data -- the raw PCM audio data as byte string
+            rate -- (optional) the sample rate (Default: 16000)
+            width -- (optional) the sample width in bytes (Default: 2)
+            channels -- (optional) the number of channels (Default: 1)
+        """
+        self._data = data
+        self.rate = rate
+        self.width = width
+        self.channels = channels
+
+    @classmethod
+    def from_frames(cls, frames, **kwargs):
+        """
+        Creates a new AudioSegment from a list of captured chunks.
+
+        Arguments:
+            frames -- a list of raw PCM chunks
+            kwargs -- passed to AudioSegment.__init__()
+        """
+        return cls(''.join(frames), **kwargs)
+
+    @classmethod
+    def from_wav(cls, fp):
+        """
+        Creates a new AudioSegment from a WAV file.
+
+        Arguments:
+            fp -- a file object containing WAV data
+        """
+        fp.seek(0)
+        wav = wave.open(fp, 'rb')
+        try:
+            return cls(wav.readframes(wav.getnframes()),
+                       rate=wav.getframerate(),
+                       width=wav.getsampwidth(),
+                       channels=wav.getnchannels())
+        finally:
+            wav.close()
+
+    @property
+    def raw_data(self):
+        """
+        Returns:
+            The raw PCM audio data (without any copying)
+        """
+        return self._data
+
+    @property
+    def duration(self):
+        """
+        Returns:
+            The length of this segment in seconds
+        """
+        return float(len(self)) / (self.rate * self.width * self.channels)
+
+    def __len__(self):
+        return len(self._data)
+
+    def write_wav(self, fp):
+        """
+        Writes this segment to a file object as WAV.
+
+        Arguments:
+            fp -- a writable file object
+        """
+        wav = wave.open(fp, 'wb')
+        wav.setnchannels(self.channels)
+        wav.setsampwidth(self.width)
+        wav.setframerate(self.rate)
+        wav.writeframes(self._data)
+        wav.close()
+
+    def wav_data(self):
+        """
+        Returns:
+            This segment encoded as WAV byte string
+        """
+        f = io.BytesIO()
+        self.write_wav(f)
+        return f.getvalue()
+
+    def wav_file(self):
+        """
+        Returns:
+            A temporary file object that contains this segment as WAV and is
+            positioned at its beginning
+        """
+        f = tempfile.SpooledTemporaryFile()
+        self.write_wav(f)
+        f.seek(0)
+        return f
+
+
+def get_segment(audio):
+    """
+    Convenience function for STT engines that accept both AudioSegments and
+    file objects containing WAV data.
+
+    Arguments:
+        audio -- an AudioSegment or a file object
+
+    Returns:
+        An AudioSegment
+    """
+    if isinstance(audio, AudioSegment):
+        return audio
+    return AudioSegment.from_wav(audio)
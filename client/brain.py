@@ -1,11 +1,35 @@
 # -*- coding: utf-8-*-
+import os
+import re
 import logging
 import pkgutil
 import jasperpath
+from pluginmanifest import PluginManifest, LazyModule
+from dispatcher import Dispatcher, ModuleTask, TaskCancelled
+
+BARGE_IN_POLICIES = ('cancel', 'keep')
+
+TOKEN_PATTERN = re.compile(r"[\w']+", re.UNICODE)
+
+
+def tokenize(text):
+    """
+    Splits a phrase into upper case words, as used in the WORDS of modules.
+
+    Arguments:
+    text -- the phrase
+
+    Returns:
+    A list of words
+    """
+    return TOKEN_PATTERN.findall(text.upper())
 
 
 class Brain(object):
 
+    # The loaded modules, so that they are only imported once per process
+    _modules = None
+
     def __init__(self, mic, profile):
         """
         Instantiates a new Brain object, which cross-references user
@@ -23,6 +47,46 @@ class Brain(object):
         self.profile = profile
         self.modules = self.get_modules()
         self._logger = logging.getLogger(__name__)
+        self.keyword_index, self.unindexed_modules = \
+            self.get_keyword_index(self.modules)
+
+        config = self.profile.get('brain', {})
+        # Default timeout for modules without a TIMEOUT constant
+        self.timeout = config.get('timeout', 120)
+        # What happens to running modules if the user speaks again
+        self.barge_in = config.get('barge_in', 'cancel')
+        if self.barge_in not in BARGE_IN_POLICIES:
+            self._logger.warning("Unknown barge-in policy '%s', using " +
+                                 "'cancel'", self.barge_in)
+            self.barge_in = 'cancel'
+        self.dispatcher = Dispatcher(max_workers=config.get('workers', 2))
+
+        self.setup_modules()
+
+    def setup_modules(self):
+        """
+        Calls the optional setup(mic, profile) function of every module, so
+        that modules can start background work (e.g. precompiling
+        vocabularies) before they are first used.
+        """
+        for module in self.modules:
+            setup = getattr(module, 'setup', None)
+            if not callable(setup):
+                continue
+            try:
+                setup(self.mic, self.profile)
+            except Exception:
+                self._logger.warning("Setup of module '%s' failed",
+                                     module.__name__, exc_info=True)
+
+    @classmethod
+    def get_manifest(cls):
+        """
+        Returns:
+            The PluginManifest of the modules folder
+        """
+        return PluginManifest(jasperpath.config('plugins.json'),
+                              [jasperpath.PLUGIN_PATH])
 
     @classmethod
     def get_modules(cls):
@@ -30,13 +94,47 @@ class Brain(object):
         Dynamically loads all the modules in the modules folder and sorts
         them by the PRIORITY key. If no PRIORITY is defined for a given
         module, a priority of 0 is assumed.
+
+        The modules are only loaded once, further calls return the same
+        modules. If the plugin manifest is up to date, LazyModules are
+        returned that only import their module when it's first used.
+        Otherwise, all modules are imported and the manifest is updated.
+        The manifest isn't updated if any module failed to import (e.g.
+        because of a missing dependency), so that the module is retried on
+        the next start.
+        """
+        if cls._modules is None:
+            manifest = cls.get_manifest()
+            descriptions = manifest.load()
+            if descriptions is not None:
+                cls._modules = [LazyModule(description)
+                                for description in descriptions]
+            else:
+                files = manifest.get_plugin_files(manifest.locations)
+                cls._modules, failed = cls._load_modules(manifest.locations)
+                if failed:
+                    logging.getLogger(__name__).info(
+                        "Not updating plugin manifest, because these " +
+                        "modules failed to import: %s", ', '.join(failed))
+                elif os.path.isdir(os.path.dirname(manifest.filename)):
+                    manifest.save(cls._modules, files)
+        return list(cls._modules)
+
+    @classmethod
+    def _load_modules(cls, locations):
         """
+        Imports all modules in the given plugin directories.
 
+        Returns:
+            A tuple (modules, failed), where modules is a list of the
+            imported modules sorted by priority and failed is a list of the
+            names of the modules that failed to import
+        """
         logger = logging.getLogger(__name__)
-        locations = [jasperpath.PLUGIN_PATH]
         logger.debug("Looking for modules in: %s",
                      ', '.join(["'%s'" % location for location in locations]))
         modules = []
+        failed = []
         for finder, name, ispkg in pkgutil.walk_packages(locations):
             try:
                 loader = finder.find_module(name)
@@ -44,6 +142,7 @@ class Brain(object):
             except:
                 logger.warning("Skipped module '%s' due to an error.", name,
                                exc_info=True)
+                failed.append(name)
             else:
                 if hasattr(mod, 'WORDS'):
                     logger.debug("Found module '%s' with words: %r", name,
@@ -54,33 +153,155 @@ class Brain(object):
                                    "the WORDS constant.", name)
         modules.sort(key=lambda mod: mod.PRIORITY if hasattr(mod, 'PRIORITY')
                      else 0, reverse=True)
-        return modules
+        return (modules, failed)
 
-    def query(self, texts):
+    @classmethod
+    def get_module_descriptions(cls):
         """
-        Passes user input to the appropriate module, testing it against
-        each candidate module's isValid function.
+        Gets the name, WORDS and PRIORITY of all modules. They are read from
+        the plugin manifest if it is up to date, so that no module has to be
+        imported.
+
+        Returns:
+            A list of dicts as returned by PluginManifest.describe(), sorted
+            by priority
+        """
+        descriptions = cls.get_manifest().load()
+        if descriptions is None:
+            descriptions = [PluginManifest.describe(module)
+                            for module in cls.get_modules()]
+        return descriptions
+
+    @staticmethod
+    def get_keyword_index(modules):
+        """
+        Builds an inverted index from the words in the WORDS of every module
+        to the positions of the modules in the given list.
+
+        Modules whose isValid() function accepts phrases that don't contain
+        any of their WORDS can opt out of the index by setting
+        KEYWORD_INDEX = False. These modules, as well as modules without
+        any WORDS, are checked for every phrase.
 
         Arguments:
-        text -- user input, typically speech, to be parsed by a module
+        modules -- a list of modules, sorted by priority
+
+        Returns:
+        A tuple of the index (a dict mapping words to sets of module
+        positions) and a set of the positions of all unindexed modules
         """
-        for module in self.modules:
+        index = {}
+        unindexed = set()
+        for position, module in enumerate(modules):
+            words = [word for phrase in module.WORDS
+                     for word in tokenize(phrase)]
+            if not words or not getattr(module, 'KEYWORD_INDEX', True):
+                unindexed.add(position)
+                continue
+            for word in words:
+                index.setdefault(word, set()).add(position)
+        return index, unindexed
+
+    def get_candidates(self, texts):
+        """
+        Looks up the modules that might accept any of the given phrases.
+
+        Arguments:
+        texts -- a list of phrases
+
+        Returns:
+        A list of candidate modules, in the order of brain.modules
+        """
+        positions = set(self.unindexed_modules)
+        for text in texts:
+            for word in tokenize(text):
+                positions.update(self.keyword_index.get(word, ()))
+        return [self.modules[position] for position in sorted(positions)]
+
+    def _route(self, texts):
+        """
+        Finds the module that handles the user input.
+
+        Arguments:
+        texts -- a list of possible transcriptions of the user input
+
+        Returns:
+        A tuple of the module and the transcription it accepted, or
+        (None, None) if no module accepts any of them
+        """
+        for module in self.get_candidates(texts):
             for text in texts:
                 if module.isValid(text):
                     self._logger.debug("'%s' is a valid phrase for module " +
                                        "'%s'", text, module.__name__)
-                    try:
-                        module.handle(text, self.mic, self.profile)
-                    except Exception:
-                        self._logger.error('Failed to execute module',
-                                           exc_info=True)
-                        self.mic.say("I'm sorry. I had some trouble with " +
-                                     "that operation. Please try again later.")
-                    else:
-                        self._logger.debug("Handling of phrase '%s' by " +
-                                           "module '%s' completed", text,
-                                           module.__name__)
-                    finally:
-                        return
+                    return module, text
         self._logger.debug("No module was able to handle any of these " +
                            "phrases: %r", texts)
+        return None, None
+
+    def _handle(self, module, text, mic):
+        try:
+            module.handle(text, mic, self.profile)
+        except TaskCancelled:
+            self._logger.debug("Handling of phrase '%s' by module '%s' " +
+                               "was cancelled", text, module.__name__)
+        except Exception:
+            self._logger.error('Failed to execute module',
+                               exc_info=True)
+            mic.say("I'm sorry. I had some trouble with " +
+                    "that operation. Please try again later.")
+        else:
+            self._logger.debug("Handling of phrase '%s' by " +
+                               "module '%s' completed", text,
+                               module.__name__)
+
+    def query(self, texts):
+        """
+        Passes user input to the appropriate module, testing it against
+        each candidate module's isValid function. Only modules that have one
+        of the words of the input in their WORDS (or opted out of the
+        keyword index) are candidates.
+
+        Arguments:
+        text -- user input, typically speech, to be parsed by a module
+        """
+        module, text = self._route(texts)
+        if module is not None:
+            self._handle(module, text, self.mic)
+
+    def dispatch(self, texts):
+        """
+        Like query(), but runs the module on the thread pool of the
+        dispatcher and returns immediately. The module is cancelled if it
+        doesn't finish within its TIMEOUT (or the timeout configured in the
+        profile). The profile's timeout doesn't apply to modules with
+        EXCLUSIVE_MIC = True, because they run as long as the user keeps
+        talking to them.
+
+        Arguments:
+        texts -- user input, typically speech, to be parsed by a module
+
+        Returns:
+        The dispatcher.ModuleTask, or None if no module accepted the input
+        """
+        module, text = self._route(texts)
+        if module is None:
+            return None
+        exclusive = bool(getattr(module, 'EXCLUSIVE_MIC', False))
+        timeout = getattr(module, 'TIMEOUT', None)
+        if timeout is None and not exclusive:
+            timeout = self.timeout
+        task = ModuleTask(module, text, timeout=timeout, exclusive=exclusive)
+        return self.dispatcher.submit(
+            lambda mic: self._handle(module, text, mic), task, self.mic)
+
+    def interrupt(self):
+        """
+        Applies the barge-in policy when the user starts to speak again:
+        'cancel' stops all running modules, 'keep' lets them finish.
+        """
+        if self.barge_in == 'cancel':
+            for task in self.dispatcher.tasks:
+                self._logger.info("Cancelling module '%s'",
+                                  task.module.__name__)
+                task.cancel()
@@ -26,24 +26,44 @@ class Conversation(object):
             for notif in notifications:
                 self._logger.info("Received notification: '%s'", str(notif))
 
-            self._logger.debug("Started listening for keyword '%s'",
-                               self.persona)
-            threshold, transcribed = self.mic.passiveListen(self.persona)
-            self._logger.debug("Stopped listening for keyword '%s'",
-                               self.persona)
-
-            if not transcribed or not threshold:
-                self._logger.info("Nothing has been said or transcribed.")
-                continue
-            self._logger.info("Keyword '%s' has been said!", self.persona)
-
-            self._logger.debug("Started to listen actively with threshold: %r",
-                               threshold)
-            input = self.mic.activeListenToAllOptions(threshold)
-            self._logger.debug("Stopped to listen actively with threshold: %r",
-                               threshold)
+            # Take turns with modules that are waiting for an answer
+            arbiter = self.brain.dispatcher.arbiter
+            arbiter.acquire_input()
+            try:
+                self._logger.debug("Started listening for keyword '%s'",
+                                   self.persona)
+                # Stop right away when a module asks a question, so that
+                # the answer isn't taken for an attempt to say the keyword
+                threshold, transcribed = self.mic.passiveListen(
+                    self.persona,
+                    interrupt=lambda: arbiter.input_requested)
+                self._logger.debug("Stopped listening for keyword '%s'",
+                                   self.persona)
+
+                if not transcribed or not threshold:
+                    self._logger.info("Nothing has been said or transcribed.")
+                    continue
+                self._logger.info("Keyword '%s' has been said!", self.persona)
+
+                # The user is speaking again, so apply the barge-in policy
+                # to modules that are still running
+                self.brain.interrupt()
+
+                self._logger.debug("Started to listen actively with " +
+                                   "threshold: %r", threshold)
+                input = self.mic.activeListenToAllOptions(threshold)
+                self._logger.debug("Stopped to listen actively with " +
+                                   "threshold: %r", threshold)
+            finally:
+                arbiter.release_input()
 
             if input:
-                self.brain.query(input)
+                # Run the module in the background, so that we can go back
+                # to listening for the keyword right away
+                task = self.brain.dispatch(input)
+                if task is not None and task.exclusive:
+                    # The module listens for the keyword itself
+                    task.wait()
             else:
-                self.mic.say("Pardon?")
+                with arbiter.output_lock:
+                    self.mic.say("Pardon?")
@@ -0,0 +1,287 @@
+# -*- coding: utf-8-*-
+"""
+Runs the handle() functions of modules on a thread pool, so that a slow
+module doesn't keep Jasper from listening for the keyword.
+
+Modules keep their handle(text, mic, profile) interface, but get a TaskMic
+instead of the real Mic. The TaskMic makes sure that tasks and the listen
+loop of the Conversation take turns at the microphone and don't talk over
+each other. It also implements cancellation: threads can't be killed, so a
+cancelled or timed out task is stopped the next time it tries to talk or
+listen.
+
+Modules that listen for the keyword themselves, like the music mode, set
+EXCLUSIVE_MIC = True. The Conversation waits for such a module to finish
+instead of running a second keyword loop on the same microphone.
+"""
+import time
+import logging
+import threading
+
+from concurrent import futures
+
+
+class TaskCancelled(Exception):
+    """
+    Raised inside of a task that has been cancelled when it tries to use
+    the microphone or speaker.
+    """
+    pass
+
+
+class MicArbiter(object):
+    """
+    Serializes access to the microphone and the speaker. Tasks that want to
+    listen are preferred over the passive listening of the Conversation, so
+    that a module asking a question gets the answer.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._owner = None
+        self._waiting = 0
+        self.output_lock = threading.RLock()
+
+    def acquire_input(self, task=None):
+        """
+        Blocks until nobody else uses the microphone.
+
+        Arguments:
+            task -- (optional) the ModuleTask that wants to listen. If None,
+                    the caller is the listen loop, which waits as long as
+                    any task is waiting.
+
+        Raises:
+            TaskCancelled -- if the task is cancelled while waiting
+        """
+        owner = task if task is not None else self
+        with self._cond:
+            if task is not None:
+                self._waiting += 1
+            try:
+                while (self._owner is not None or
+                       (task is None and self._waiting)):
+                    if task is not None and task.cancelled:
+                        raise TaskCancelled()
+                    self._cond.wait()
+                self._owner = owner
+            finally:
+                if task is not None:
+                    self._waiting -= 1
+
+    def release_input(self):
+        with self._cond:
+            self._owner = None
+            self._cond.notify_all()
+
+    def wake(self):
+        """
+        Wakes up all waiting callers, e.g. after a task has been cancelled.
+        """
+        with self._cond:
+            self._cond.notify_all()
+
+    @property
+    def input_requested(self):
+        """
+        Returns:
+            True if a task is waiting to listen
+        """
+        with self._cond:
+            return self._waiting > 0
+
+
+class TaskMic(object):
+    """
+    Mic that is handed to the handle() function of a module running in a
+    ModuleTask. All attributes that aren't overridden here are taken from
+    the real Mic.
+    """
+
+    def __init__(self, mic, arbiter, task):
+        self._mic = mic
+        self._arbiter = arbiter
+        self._task = task
+
+    def _check(self):
+        if self._task.cancelled:
+            raise TaskCancelled()
+
+    def say(self, phrase, *args, **kwargs):
+        self._check()
+        with self._arbiter.output_lock:
+            self._check()
+            return self._mic.say(phrase, *args, **kwargs)
+
+    def passiveListen(self, *args, **kwargs):
+        # Give way to other tasks waiting for an answer and stop listening
+        # as soon as this task is cancelled
+        kwargs.setdefault('interrupt', lambda: (self._task.cancelled or
+                                                self._arbiter.input_requested))
+        return self._listen(self._mic.passiveListen, *args, **kwargs)
+
+    def activeListen(self, *args, **kwargs):
+        return self._listen(self._mic.activeListen, *args, **kwargs)
+
+    def activeListenToAllOptions(self, *args, **kwargs):
+        return self._listen(self._mic.activeListenToAllOptions,
+                            *args, **kwargs)
+
+    def _listen(self, func, *args, **kwargs):
+        self._check()
+        self._arbiter.acquire_input(self._task)
+        try:
+            self._check()
+            return func(*args, **kwargs)
+        finally:
+            self._arbiter.release_input()
+
+    def wrap(self, mic):
+        """
+        Arguments:
+            mic -- another Mic used by the task, e.g. one with a different
+                   active STT engine
+
+        Returns:
+            A TaskMic for the other Mic that belongs to the same task
+        """
+        return TaskMic(mic, self._arbiter, self._task)
+
+    def __getattr__(self, name):
+        return getattr(self._mic, name)
+
+
+class ModuleTask(object):
+    """
+    A handle() call of a module that has been submitted to a Dispatcher.
+    """
+
+    def __init__(self, module, text, timeout=None, exclusive=False):
+        """
+        Arguments:
+            module -- the module
+            text -- the phrase the module handles
+            timeout -- (optional) seconds after which the task is cancelled
+                       (Default: None, i.e. no timeout)
+            exclusive -- (optional) whether the task uses the microphone
+                         until it finishes, so that the Conversation has to
+                         wait for it (Default: False)
+        """
+        self.module = module
+        self.text = text
+        self.timeout = timeout
+        self.exclusive = exclusive
+        self.future = None
+        self.started = time.time()
+        self._cancelled = threading.Event()
+        self._on_cancel = []
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """
+        Cancels the task. A task that hasn't been started yet won't run at
+        all, a running task is stopped the next time it uses the TaskMic.
+        """
+        if self.cancelled:
+            return
+        self._cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+        for callback in self._on_cancel:
+            callback()
+
+    def add_cancel_callback(self, callback):
+        self._on_cancel.append(callback)
+
+    def done(self):
+        return self.future is not None and self.future.done()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the task has finished.
+
+        Returns:
+            True if the task has finished
+        """
+        if self.future is None:
+            return False
+        done, not_done = futures.wait([self.future], timeout)
+        return bool(done)
+
+
+class Dispatcher(object):
+    """
+    Thread pool for ModuleTasks with per-task timeouts.
+    """
+
+    def __init__(self, arbiter=None, max_workers=2):
+        """
+        Arguments:
+            arbiter -- (optional) the MicArbiter shared with the listen
+                       loop (Default: a new MicArbiter)
+            max_workers -- (optional) the number of tasks that can run at
+                           the same time (Default: 2)
+        """
+        self._logger = logging.getLogger(__name__)
+        self.arbiter = arbiter if arbiter is not None else MicArbiter()
+        self._executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self._tasks = []
+
+    @property
+    def tasks(self):
+        """
+        Returns:
+            A list of all tasks that haven't finished yet
+        """
+        with self._lock:
+            self._tasks = [task for task in self._tasks if not task.done()]
+            return list(self._tasks)
+
+    def submit(self, func, task, mic):
+        """
+        Runs func(mic) on the thread pool.
+
+        Arguments:
+            func -- a callable that accepts the TaskMic of the task
+            task -- the ModuleTask
+            mic -- the real Mic
+
+        Returns:
+            The task
+        """
+        task_mic = TaskMic(mic, self.arbiter, task)
+        task.add_cancel_callback(self.arbiter.wake)
+        timer = None
+        if task.timeout:
+            timer = threading.Timer(task.timeout, self._on_timeout, [task])
+            timer.daemon = True
+        with self._lock:
+            task.future = self._executor.submit(func, task_mic)
+            self._tasks.append(task)
+        if timer is not None:
+            timer.start()
+            task.future.add_done_callback(lambda future: timer.cancel())
+        return task
+
+    def _on_timeout(self, task):
+        if not task.done():
+            self._logger.warning("Module '%s' didn't finish handling " +
+                                 "phrase '%s' within %d seconds, cancelling",
+                                 task.module.__name__, task.text,
+                                 task.timeout)
+            task.cancel()
+
+    def cancel_all(self):
+        """
+        Cancels all running tasks.
+        """
+        for task in self.tasks:
+            task.cancel()
+
+    def shutdown(self, wait=True):
+        self.cancel_all()
+        self._executor.shutdown(wait=wait)
@@ -1,12 +1,21 @@
 # -*- coding: utf-8-*-
 import os
 import re
+import errno
+import fcntl
+import hashlib
 import subprocess
 import tempfile
 import logging
+import threading
 
 import yaml
 
+try:
+    import Phonetisaurus
+except ImportError:
+    pass
+
 import diagnose
 import jasperpath
 
@@ -15,27 +24,71 @@ class PhonetisaurusG2P(object):
     PATTERN = re.compile(r'^(?P<word>.+)\t(?P<precision>\d+\.\d+)\t<s> ' +
                          r'(?P<pronounciation>.*) </s>', re.MULTILINE)
 
+    # Command line flavour of phonetisaurus-g2p, detected once per process
+    _flavour = None
+    # FST models loaded through the Python bindings, keyed by filename
+    _models = {}
+    _lock = threading.RLock()
+
     @classmethod
-    def execute(cls, fst_model, input, is_file=False, nbest=None):
-        logger = logging.getLogger(__name__)
+    def get_flavour(cls):
+        """
+        Runs phonetisaurus-g2p once to find out its arguments. The result
+        is cached for the lifetime of the process.
 
-        # run Phonetisaurus-g2p once to find out it's args...
-        cmd = 'phonetisaurus-g2p'
+        Returns:
+            'testset' for old versions that take a --testset argument,
+            'words' for versions that take --input and --words arguments
+        """
+        with cls._lock:
+            if cls._flavour is None:
+                logger = logging.getLogger(__name__)
+                cmd = 'phonetisaurus-g2p'
+                try:
+                    # FIXME: We can't just use subprocess.call and redirect
+                    # stdout and stderr, because it looks like Phonetisaurus
+                    # can't open an already opened file descriptor a second
+                    # time. This is why we have to use this somehow hacky
+                    # subprocess.Popen approach.
+                    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                            stderr=subprocess.PIPE)
+                    stdoutdata, stderrdata = proc.communicate()
+                except OSError:
+                    logger.error("Error occured while executing command " +
+                                 "'%s'", cmd, exc_info=True)
+                    raise
+                cls._flavour = ('testset' if "--testset" in stdoutdata
+                                else 'words')
+                logger.debug("Detected phonetisaurus-g2p flavour '%s'",
+                             cls._flavour)
+            return cls._flavour
 
-        try:
-            # FIXME: We can't just use subprocess.call and redirect stdout
-            # and stderr, because it looks like Phonetisaurus can't open
-            # an already opened file descriptor a second time. This is why
-            # we have to use this somehow hacky subprocess.Popen approach.
-            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE)
-            stdoutdata, stderrdata = proc.communicate()
-        except OSError:
-            logger.error("Error occured while executing command '%s'",
-                         ' '.join(cmd), exc_info=True)
-            raise
+    @classmethod
+    def get_model(cls, fst_model):
+        """
+        Loads an FST model through the Phonetisaurus Python bindings. Every
+        model is only loaded once per process.
+
+        Arguments:
+            fst_model -- the path of the FST model
 
-        if "--testset" in stdoutdata:
+        Returns:
+            A Phonetisaurus.PhonetisaurusScript instance
+        """
+        with cls._lock:
+            if fst_model not in cls._models:
+                logging.getLogger(__name__).debug(
+                    "Loading FST model '%s' through Python bindings",
+                    fst_model)
+                cls._models[fst_model] = Phonetisaurus.PhonetisaurusScript(
+                    fst_model)
+            return cls._models[fst_model]
+
+    @classmethod
+    def execute(cls, fst_model, input, is_file=False, nbest=None):
+        logger = logging.getLogger(__name__)
+
+        if cls.get_flavour() == 'testset':
             cmd = ['phonetisaurus-g2p',
                    '--model=%s' % fst_model,
                    '--testset=%s' % input]
@@ -47,7 +100,6 @@ class PhonetisaurusG2P(object):
             if is_file:
                 cmd.append('--isfile')
 
-
         if nbest is not None:
             cmd.extend(['--nbest=%d' % nbest])
 
@@ -102,20 +154,38 @@ class PhonetisaurusG2P(object):
                             profile['pocketsphinx']['fst_model']
                     if 'nbest' in profile['pocketsphinx']:
                         conf['nbest'] = int(profile['pocketsphinx']['nbest'])
+                    if 'g2p_bindings' in profile['pocketsphinx']:
+                        conf['use_bindings'] = \
+                            profile['pocketsphinx']['g2p_bindings']
         return conf
 
-    def __new__(cls, fst_model=None, *args, **kwargs):
-        if not diagnose.check_executable('phonetisaurus-g2p'):
+    @classmethod
+    def has_bindings(cls):
+        return diagnose.check_python_import('Phonetisaurus')
+
+    def __new__(cls, fst_model=None, nbest=None, use_bindings=False):
+        if (not (use_bindings and cls.has_bindings()) and
+                not diagnose.check_executable('phonetisaurus-g2p')):
             raise OSError("Can't find command 'phonetisaurus-g2p'! Please " +
                           "check if Phonetisaurus is installed and in your " +
                           "$PATH.")
         if fst_model is None or not os.access(fst_model, os.R_OK):
             raise OSError(("FST model '%r' does not exist! Can't create " +
                            "instance.") % fst_model)
-        inst = object.__new__(cls, fst_model, *args, **kwargs)
+        inst = object.__new__(cls)
         return inst
 
-    def __init__(self, fst_model=None, nbest=None):
+    def __init__(self, fst_model=None, nbest=None, use_bindings=False):
+        """
+        Arguments:
+            fst_model -- the path of the FST model
+            nbest -- (optional) the number of pronunciations per word
+            use_bindings -- (optional) load the FST model once through the
+                            Phonetisaurus Python bindings instead of running
+                            phonetisaurus-g2p for every translation. Falls
+                            back to phonetisaurus-g2p if the model can't be
+                            loaded. (Default: False)
+        """
         self._logger = logging.getLogger(__name__)
 
         self.fst_model = os.path.abspath(fst_model)
@@ -125,6 +195,30 @@ class PhonetisaurusG2P(object):
         if self.nbest is not None:
             self._logger.debug("Will use the %d best results.", self.nbest)
 
+        self.use_bindings = use_bindings and self.has_bindings()
+        if use_bindings and not self.use_bindings:
+            self._logger.warning("Phonetisaurus Python bindings are not " +
+                                 "installed, using phonetisaurus-g2p")
+        if self.use_bindings:
+            self._logger.debug("Will use the Phonetisaurus Python bindings.")
+        self._model_checksum = None
+
+    @property
+    def model_checksum(self):
+        """
+        Returns:
+            A checksum of the FST model and the G2P settings. Pronunciations
+            generated with the same checksum are identical.
+        """
+        if self._model_checksum is None:
+            sha1 = hashlib.sha1()
+            with open(self.fst_model, 'rb') as f:
+                for block in iter(lambda: f.read(65536), ''):
+                    sha1.update(block)
+            sha1.update('\0nbest=%r' % self.nbest)
+            self._model_checksum = sha1.hexdigest()
+        return self._model_checksum
+
     def _translate_word(self, word):
         return self.execute(self.fst_model, word, nbest=self.nbest)
 
@@ -141,7 +235,35 @@ class PhonetisaurusG2P(object):
         os.remove(tmp_fname)
         return output
 
+    def _translate_with_bindings(self, words):
+        model = self.get_model(self.fst_model)
+        result = {}
+        with self._lock:
+            for word in words:
+                # Arguments: word, nbest, beam, threshold, write_fsts,
+                # accumulate, pmass
+                paths = model.Phoneticize(word, self.nbest or 1, 500, 99.0,
+                                          False, False, 0.0)
+                for path in paths:
+                    phonemes = [model.FindOsym(u) for u in path.Uniques]
+                    result.setdefault(word, []).append(' '.join(phonemes))
+        return result
+
     def translate(self, words):
+        if self.use_bindings:
+            try:
+                self.get_model(self.fst_model)
+            except Exception:
+                self._logger.warning("Can't load FST model '%s' through " +
+                                     "Python bindings, using " +
+                                     "phonetisaurus-g2p", self.fst_model,
+                                     exc_info=True)
+                self.use_bindings = False
+        if self.use_bindings:
+            self._logger.debug('Converting words to phonemes through ' +
+                               'Python bindings')
+            return self._translate_with_bindings([words] if type(words) is str
+                                                 else words)
         if type(words) is str or len(words) == 1:
             self._logger.debug('Converting single word to phonemes')
             output = self._translate_word(words if type(words) is str
@@ -172,6 +294,112 @@ class PhonetisaurusG2P(object):
 
         return output
 
+
+class PronunciationCache(object):
+    """
+    Persistent store of pronunciations that have been generated by G2P.
+
+    Pronunciations are stored in one file per model checksum, so changing
+    the FST model or the G2P settings starts a new cache. Each line of the
+    file contains a word and one of its pronunciations, separated by a tab.
+    New pronunciations are appended to the file.
+    """
+
+    def __init__(self, directory, model_checksum):
+        """
+        Arguments:
+            directory -- the directory the cache files are stored in
+            model_checksum -- the model_checksum of the G2P converter
+        """
+        self._logger = logging.getLogger(__name__)
+        self.filename = os.path.join(directory, '%s.dict' % model_checksum)
+        self._pronunciations = {}
+        if os.path.exists(self.filename):
+            with open(self.filename, 'r') as f:
+                self._read(f)
+            self._logger.debug("Loaded pronunciations for %d words from " +
+                               "'%s'", len(self._pronunciations),
+                               self.filename)
+
+    def _read(self, f):
+        """
+        Adds the pronunciations in a cache file that aren't known yet.
+        Duplicate lines, e.g. from older versions that didn't lock the
+        file, are skipped.
+        """
+        for line in f:
+            line = line.rstrip('\n')
+            if '\t' not in line:
+                continue
+            word, pronunciation = line.split('\t', 1)
+            values = self._pronunciations.setdefault(word, [])
+            if pronunciation not in values:
+                values.append(pronunciation)
+
+    def __len__(self):
+        return len(self._pronunciations)
+
+    def lookup(self, words):
+        """
+        Looks up the pronunciations of words.
+
+        Arguments:
+            words -- a list of words
+
+        Returns:
+            A tuple (pronunciations, missing), where pronunciations is a
+            dict mapping the cached words to their pronunciations and
+            missing is a list of the words that are not in the cache.
+        """
+        pronunciations = {}
+        missing = []
+        for word in words:
+            if word in self._pronunciations:
+                pronunciations[word] = self._pronunciations[word]
+            else:
+                missing.append(word)
+        return (pronunciations, missing)
+
+    def update(self, pronunciations):
+        """
+        Adds new pronunciations to the cache. The cache file is locked
+        while it is updated, because the vocabularies are compiled
+        concurrently and share the cache file.
+
+        Arguments:
+            pronunciations -- a dict mapping words to lists of
+                              pronunciations, as returned by
+                              PhonetisaurusG2P.translate()
+        """
+        if all(word in self._pronunciations for word in pronunciations):
+            return
+        directory = os.path.dirname(self.filename)
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            # Another process may have created it in the meantime
+            if e.errno != errno.EEXIST:
+                raise
+        with open(self.filename, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                # Pick up the words that have been added by others since
+                # the cache was loaded
+                f.seek(0)
+                self._read(f)
+                new = dict((word, list(values))
+                           for word, values in pronunciations.items()
+                           if word not in self._pronunciations)
+                f.seek(0, os.SEEK_END)
+                for word, values in new.items():
+                    for pronunciation in values:
+                        f.write("%s\t%s\n" % (word, pronunciation))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        self._pronunciations.update(new)
+
+
 if __name__ == "__main__":
     import pprint
     import argparse
@@ -0,0 +1,295 @@
+# -*- coding: utf-8-*-
+"""
+IMAP access shared by the Gmail module and the Gmail notifier.
+"""
+import imaplib
+import email
+import re
+import time
+import select
+import socket
+import logging
+import threading
+
+# Only the headers needed to announce an email, without marking it as read
+HEADERS = 'BODY.PEEK[HEADER.FIELDS (FROM DATE)]'
+
+# Untagged responses that indicate a change of the mailbox during IDLE
+MAILBOX_CHANGE = re.compile(r'^\* \d+ (EXISTS|RECENT|EXPUNGE|FETCH)\b')
+
+
+class IMAPSession(object):
+    """
+    Long-lived IMAP connection that reconnects automatically when the
+    connection has been dropped.
+    """
+
+    # Servers may drop clients that have been idling for 30 minutes
+    IDLE_TIMEOUT = 29 * 60
+
+    def __init__(self, address, password, host='imap.gmail.com', port=None,
+                 mailbox='INBOX', imap_class=imaplib.IMAP4_SSL, timeout=60):
+        """
+        Arguments:
+            address -- the email address to log in with
+            password -- the password
+            host -- (optional) the IMAP server (Default: imap.gmail.com)
+            port -- (optional) the port of the IMAP server
+                    (Default: the default port of imap_class)
+            mailbox -- (optional) the mailbox to watch (Default: INBOX)
+            imap_class -- (optional) imaplib.IMAP4_SSL or imaplib.IMAP4
+                          (Default: imaplib.IMAP4_SSL)
+            timeout -- (optional) socket timeout in seconds (Default: 60)
+        """
+        self._logger = logging.getLogger(__name__)
+        self.address = address
+        self.password = password
+        self.host = host
+        self.port = port
+        self.mailbox = mailbox
+        self.imap_class = imap_class
+        self.timeout = timeout
+        self.uidvalidity = None
+        self._conn = None
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_profile(cls, profile):
+        return cls(profile['gmail_address'], profile['gmail_password'])
+
+    def _connect(self):
+        self._logger.debug("Connecting to IMAP server '%s'", self.host)
+        if self.port is None:
+            conn = self.imap_class(self.host)
+        else:
+            conn = self.imap_class(self.host, self.port)
+        conn.socket().settimeout(self.timeout)
+        try:
+            conn.login(self.address, self.password)
+            retcode, data = conn.select(self.mailbox)
+            if retcode != 'OK':
+                raise imaplib.IMAP4.error("Can't select mailbox '%s'" %
+                                          self.mailbox)
+            uidvalidity = conn.response('UIDVALIDITY')[1][0]
+        except Exception:
+            conn.shutdown()
+            raise
+        self.uidvalidity = int(uidvalidity) if uidvalidity else None
+        self._conn = conn
+
+    def close(self):
+        """
+        Logs out and closes the connection.
+        """
+        with self._lock:
+            if self._conn is None:
+                return
+            try:
+                self._conn.logout()
+            except (imaplib.IMAP4.error, socket.error):
+                self._conn.shutdown()
+            self._conn = None
+
+    def _run(self, func, *args):
+        """
+        Calls func(conn, *args) and reconnects once if the connection is
+        broken.
+        """
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._conn is None:
+                        self._connect()
+                    return func(self._conn, *args)
+                except (imaplib.IMAP4.abort, socket.error):
+                    if self._conn is not None:
+                        try:
+                            self._conn.shutdown()
+                        except (imaplib.IMAP4.error, socket.error):
+                            pass
+                        self._conn = None
+                    if attempt:
+                        raise
+                    self._logger.info("IMAP connection broken, reconnecting",
+                                      exc_info=True)
+
+    @staticmethod
+    def _uid_search(conn, *criteria):
+        retcode, data = conn.uid('SEARCH', *criteria)
+        if retcode != 'OK':
+            raise imaplib.IMAP4.error("UID SEARCH failed: %r" % data)
+        return [int(uid) for uid in ' '.join(d for d in data if d).split()]
+
+    @staticmethod
+    def _uid_fetch_headers(conn, uids):
+        if not uids:
+            return []
+        retcode, data = conn.uid('FETCH', ','.join(str(uid) for uid in uids),
+                                 '(%s)' % HEADERS)
+        if retcode != 'OK':
+            raise imaplib.IMAP4.error("UID FETCH failed: %r" % data)
+        msgs = []
+        for item in data:
+            if not isinstance(item, tuple):
+                continue
+            m = re.search(r'\bUID (\d+)', item[0])
+            if m:
+                msgs.append((int(m.group(1)),
+                             email.message_from_string(item[1])))
+        msgs.sort(key=lambda item: item[0])
+        return msgs
+
+    def search_unseen(self):
+        """
+        Returns:
+            The UIDs of all unread emails
+        """
+        return self._run(self._uid_search, 'UNSEEN')
+
+    def fetch_headers(self, uids):
+        """
+        Fetches the From and Date headers of emails without marking them as
+        read.
+
+        Arguments:
+            uids -- a list of UIDs
+
+        Returns:
+            A list of (UID, email.message.Message) tuples sorted by UID
+        """
+        return self._run(self._uid_fetch_headers, uids)
+
+    def fetch_unseen(self, after=0):
+        """
+        Fetches the headers of the unread emails whose UID is higher than
+        a given UID. Only these emails are transferred, so this is cheap to
+        call periodically.
+
+        Arguments:
+            after -- (optional) the highest UID that is already known
+                     (Default: 0, i.e. fetch all unread emails)
+
+        Returns:
+            A list of (UID, email.message.Message) tuples sorted by UID
+        """
+        def fetch(conn):
+            # n:* always matches the last email, even if its UID is lower
+            uids = [uid for uid in self._uid_search(conn, 'UNSEEN', 'UID',
+                                                    '%d:*' % (after + 1))
+                    if uid > after]
+            return self._uid_fetch_headers(conn, uids)
+        return self._run(fetch)
+
+    def mark_read(self, uids):
+        if uids:
+            self._run(lambda conn: conn.uid(
+                'STORE', ','.join(str(uid) for uid in uids), '+FLAGS',
+                '(\\Seen)'))
+
+    @staticmethod
+    def _has_buffered_data(conn):
+        """
+        Returns:
+            True if data has already been received that conn.readline()
+            returns without reading from the socket, False if not and None
+            if the buffer of conn.file can't be inspected. select() doesn't
+            see data that sits in the buffer of the socket file or, for
+            IMAP4_SSL, has been decrypted by the SSL object.
+        """
+        sslobj = getattr(conn, 'sslobj', None)
+        if sslobj is not None and sslobj.pending() > 0:
+            return True
+        # socket._fileobject keeps the data it has read ahead in _rbuf
+        rbuf = getattr(getattr(conn, 'file', None), '_rbuf', None)
+        if rbuf is None:
+            return None
+        return bool(rbuf.getvalue())
+
+    def _readline(self, conn, timeout):
+        """
+        Returns:
+            The next line from conn, or None if there is none within timeout
+            seconds
+        """
+        conn.socket().settimeout(timeout)
+        try:
+            return conn.readline()
+        except socket.timeout:
+            return None
+        finally:
+            conn.socket().settimeout(self.timeout)
+
+    def _idle(self, conn, timeout):
+        if 'IDLE' not in conn.capabilities:
+            return None
+        tag = conn._new_tag()
+        conn.send('%s IDLE\r\n' % tag)
+        line = conn.readline()
+        if not line.startswith('+'):
+            raise imaplib.IMAP4.abort("IDLE rejected: %r" % line)
+        changed = False
+        deadline = time.time() + timeout
+        while not changed:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            buffered = self._has_buffered_data(conn)
+            if buffered is None:
+                # Data may be buffered where select() can't see it, so let
+                # readline() time out instead
+                line = self._readline(conn, remaining)
+                if line is None:
+                    break
+            else:
+                if not buffered and not select.select([conn.socket()], [],
+                                                      [], remaining)[0]:
+                    break
+                line = conn.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("Connection closed during IDLE")
+            changed = bool(MAILBOX_CHANGE.match(line))
+        conn.send('DONE\r\n')
+        while True:
+            line = conn.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("Connection closed during IDLE")
+            if line.startswith(tag):
+                if not line[len(tag):].strip().startswith('OK'):
+                    raise imaplib.IMAP4.error("IDLE failed: %r" % line)
+                return changed
+            changed = changed or bool(MAILBOX_CHANGE.match(line))
+
+    def idle(self, timeout=None):
+        """
+        Waits for the server to report changes of the mailbox, using the
+        IMAP IDLE command. The session can't be used by other threads while
+        idling, so use a separate session for this.
+
+        Arguments:
+            timeout -- (optional) the maximum time to wait in seconds
+                       (Default: IDLE_TIMEOUT)
+
+        Returns:
+            True if the mailbox has changed, False on timeout and None if
+            the server doesn't support IDLE
+        """
+        if timeout is None:
+            timeout = self.IDLE_TIMEOUT
+        return self._run(self._idle, timeout)
+
+
+def getSender(email):
+    """
+        Returns the best-guess sender of an email.
+
+        Arguments:
+        email -- the email whose sender is desired
+
+        Returns:
+        Sender of the email.
+    """
+    sender = email['From']
+    m = re.match(r'(.*)\s<.*>', sender)
+    if m:
+        return m.group(1)
+    return sender
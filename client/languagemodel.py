@@ -0,0 +1,182 @@
+# -*- coding: utf-8-*-
+"""
+In-process n-gram language model builder that writes ARPA files for
+Pocketsphinx.
+
+Jasper's corpora are tiny (mostly the WORDS of all modules), so counting
+n-grams in Python is much faster than running the CMU-Cambridge Language
+Modeling Toolkit. Probabilities are estimated with absolute discounting and
+Katz-style backoff to the next lower order.
+"""
+import math
+import collections
+
+SENTENCE_START = '<s>'
+SENTENCE_END = '</s>'
+
+# log10 probability used for impossible events, as written by the CMU tools
+LOG10_ZERO = -99.0
+
+
+class NgramLanguageModel(object):
+    """
+    Backoff n-gram language model with a closed vocabulary.
+    """
+
+    def __init__(self, order=3, discount=None):
+        """
+        Arguments:
+            order -- (optional) the highest n-gram order (Default: 3)
+            discount -- (optional) the absolute discount subtracted from the
+                        count of every seen n-gram. If None, it is estimated
+                        per order from the number of n-grams that occur
+                        once and twice (Default: None)
+        """
+        if order < 1:
+            raise ValueError("Order must be at least 1")
+        self.order = order
+        self.discount = discount
+        # self._counts[n - 1] maps n-gram tuples to their counts
+        self._counts = [collections.Counter() for n in range(order)]
+        self._probs = None
+        self._backoffs = None
+
+    def add_sentence(self, words):
+        """
+        Counts all n-grams of a sentence. Sentence start and end markers are
+        added automatically.
+
+        Arguments:
+            words -- a list of words
+        """
+        tokens = [SENTENCE_START] + list(words) + [SENTENCE_END]
+        for n in range(1, self.order + 1):
+            counts = self._counts[n - 1]
+            for i in range(len(tokens) - n + 1):
+                counts[tuple(tokens[i:i + n])] += 1
+        self._probs = None
+
+    @property
+    def vocabulary(self):
+        """
+        Returns:
+            A sorted list of all words, without sentence markers
+        """
+        return sorted(ngram[0] for ngram in self._counts[0]
+                      if ngram[0] not in (SENTENCE_START, SENTENCE_END))
+
+    def _get_discount(self, n):
+        if self.discount is not None:
+            return self.discount
+        counts_of_counts = collections.Counter(self._counts[n - 1].values())
+        n1 = counts_of_counts[1]
+        n2 = counts_of_counts[2]
+        if n1 == 0:
+            return 0.5
+        # Estimate by Ney, Essen and Kneser, kept in a sane range
+        return min(max(float(n1) / (n1 + 2 * n2), 0.1), 0.9)
+
+    def _estimate(self):
+        """
+        Calculates the probabilities and backoff weights of all n-grams.
+        """
+        self._probs = [dict() for n in range(self.order)]
+        self._backoffs = [dict() for n in range(self.order)]
+
+        # Unigrams: maximum likelihood over all tokens but the sentence
+        # start, which is never predicted
+        unigrams = self._counts[0]
+        total = sum(count for ngram, count in unigrams.items()
+                    if ngram != (SENTENCE_START,))
+        for ngram, count in unigrams.items():
+            self._probs[0][ngram] = (0.0 if ngram == (SENTENCE_START,)
+                                     else float(count) / total)
+
+        for n in range(2, self.order + 1):
+            discount = self._get_discount(n)
+            successors = collections.defaultdict(list)
+            for ngram, count in self._counts[n - 1].items():
+                successors[ngram[:-1]].append((ngram[-1], count))
+            for context, words in successors.items():
+                context_count = float(sum(count for word, count in words))
+                lower_mass = sum(self.prob(word, context[1:])
+                                 for word, count in words)
+                if 1.0 - lower_mass < 1e-9:
+                    # The lower order distribution has no mass left for
+                    # unseen words, so there is nothing to back off to
+                    d = 0.0
+                else:
+                    d = discount
+                for word, count in words:
+                    self._probs[n - 1][context + (word,)] = \
+                        (count - d) / context_count
+                left_over = d * len(words) / context_count
+                self._backoffs[n - 2][context] = (
+                    left_over / (1.0 - lower_mass) if d else 0.0)
+
+    def prob(self, word, context=()):
+        """
+        Arguments:
+            word -- the predicted word
+            context -- (optional) a tuple of preceding words
+
+        Returns:
+            The probability of word following context
+        """
+        if self._probs is None:
+            self._estimate()
+        context = tuple(context)[-(self.order - 1):] if self.order > 1 else ()
+        ngram = context + (word,)
+        if ngram in self._probs[len(ngram) - 1]:
+            return self._probs[len(ngram) - 1][ngram]
+        if not context:
+            return 0.0
+        backoff = self._backoffs[len(context) - 1].get(context, 1.0)
+        return backoff * self.prob(word, context[1:])
+
+    def write_arpa(self, f):
+        """
+        Writes the language model in ARPA format.
+
+        Arguments:
+            f -- a writable file object
+        """
+        if self._probs is None:
+            self._estimate()
+
+        def log10(value):
+            return math.log10(value) if value > 0 else LOG10_ZERO
+
+        f.write("\\data\\\n")
+        for n in range(1, self.order + 1):
+            f.write("ngram %d=%d\n" % (n, len(self._probs[n - 1])))
+        for n in range(1, self.order + 1):
+            f.write("\n\\%d-grams:\n" % n)
+            for ngram in sorted(self._probs[n - 1]):
+                line = "%.4f %s" % (log10(self._probs[n - 1][ngram]),
+                                    ' '.join(ngram))
+                if n < self.order and ngram[-1] != SENTENCE_END:
+                    line += " %.4f" % log10(
+                        self._backoffs[n - 1].get(ngram, 1.0))
+                f.write(line + "\n")
+        f.write("\n\\end\\\n")
+
+
+def compile_languagemodel(phrases, output_file, order=3):
+    """
+    Builds a language model from phrases and writes it to an ARPA file.
+
+    Arguments:
+        phrases -- a list of phrases
+        output_file -- the path of the ARPA file
+        order -- (optional) the highest n-gram order (Default: 3)
+
+    Returns:
+        A list of all unique words in the phrases
+    """
+    lm = NgramLanguageModel(order=order)
+    for phrase in phrases:
+        lm.add_sentence(phrase.split())
+    with open(output_file, 'w') as f:
+        lm.write_arpa(f)
+    return lm.vocabulary
@@ -3,12 +3,13 @@
     The Mic class handles all interactions with the microphone and speaker.
 """
 import logging
-import tempfile
-import wave
-import audioop
 import pyaudio
 import alteration
 import jasperpath
+import audiocapture
+import audioplayer
+import vad
+from audiosegment import AudioSegment
 
 
 class Mic:
@@ -16,7 +17,8 @@ class Mic:
     speechRec = None
     speechRec_persona = None
 
-    def __init__(self, speaker, passive_stt_engine, active_stt_engine):
+    def __init__(self, speaker, passive_stt_engine, active_stt_engine,
+                 capture=None):
         """
         Initiates the pocketsphinx instance.
 
@@ -25,166 +27,188 @@ class Mic:
         passive_stt_engine -- performs STT while Jasper is in passive listen
                               mode
         acive_stt_engine -- performs STT while Jasper is in active listen mode
+        capture -- (optional) a running AudioCapture instance to share with
+                   another Mic. If omitted, a new one will be started.
         """
         self._logger = logging.getLogger(__name__)
         self.speaker = speaker
         self.passive_stt_engine = passive_stt_engine
         self.active_stt_engine = active_stt_engine
-        self._logger.info("Initializing PyAudio. ALSA/Jack error messages " +
-                          "that pop up during this process are normal and " +
-                          "can usually be safely ignored.")
-        self._audio = pyaudio.PyAudio()
-        self._logger.info("Initialization of PyAudio completed.")
+        self._owns_capture = capture is None
+        if capture is None:
+            self._logger.info("Initializing PyAudio. ALSA/Jack error " +
+                              "messages that pop up during this process are " +
+                              "normal and can usually be safely ignored.")
+            audio = pyaudio.PyAudio()
+            self._logger.info("Initialization of PyAudio completed.")
+            capture = audiocapture.AudioCapture(audio)
+            capture.start()
+        self.capture = capture
+        self._audio = capture.audio
+        # position in the capture buffer where the last listen call stopped
+        self._position = None
+        self._owns_player = False
+        if self.speaker.player is None:
+            # play through the already initialized PyAudio instance instead
+            # of spawning aplay for every sound
+            self.speaker.player = audioplayer.PyAudioPlayer.get_instance(
+                self._audio)
+            self._owns_player = self.speaker.player is not None
+        if self._owns_player:
+            self.speaker.player.preload(jasperpath.data('audio',
+                                                        'beep_hi.wav'))
+            self.speaker.player.preload(jasperpath.data('audio',
+                                                        'beep_lo.wav'))
 
     def __del__(self):
-        self._audio.terminate()
+        if self._owns_player:
+            self.speaker.player.close()
+        if self._owns_capture:
+            self.capture.stop()
+            self.capture.join(self.capture.timeout)
+            self._audio.terminate()
 
     def getScore(self, data):
-        rms = audioop.rms(data, 2)
-        score = rms / 3
-        return score
+        return vad.score(data)
 
     def fetchThreshold(self):
-
-        # TODO: Consolidate variables from the next three functions
-        THRESHOLD_MULTIPLIER = 1.8
-        RATE = 16000
-        CHUNK = 1024
-
-        # number of seconds to allow to establish threshold
-        THRESHOLD_TIME = 1
-
-        # prepare recording stream
-        stream = self._audio.open(format=pyaudio.paInt16,
-                                  channels=1,
-                                  rate=RATE,
-                                  input=True,
-                                  frames_per_buffer=CHUNK)
-
-        # stores the audio data
-        frames = []
-
-        # stores the lastN score values
-        lastN = [i for i in range(20)]
-
-        # calculate the long run average, and thereby the proper threshold
-        for i in range(0, RATE / CHUNK * THRESHOLD_TIME):
-
-            data = stream.read(CHUNK)
-            frames.append(data)
-
-            # save this data point as a score
-            lastN.pop(0)
-            lastN.append(self.getScore(data))
-            average = sum(lastN) / len(lastN)
-
-        stream.stop_stream()
-        stream.close()
+        """
+        Returns the current disturbance threshold from the background noise
+        estimate that the capture thread keeps up to date. Only blocks right
+        after startup, until the estimate has seen enough audio.
+        """
+        noise_floor = self.capture.noise_floor
+        if not noise_floor.ready:
+            stream = self.capture.reader()
+            while not noise_floor.ready:
+                stream.read()
 
         # this will be the benchmark to cause a disturbance over!
-        THRESHOLD = average * THRESHOLD_MULTIPLIER
+        THRESHOLD = noise_floor.threshold
 
         return THRESHOLD
 
-    def passiveListen(self, PERSONA):
+    def passiveListen(self, PERSONA, interrupt=None):
         """
         Listens for PERSONA in everyday sound. Times out after LISTEN_TIME, so
         needs to be restarted.
+
+        Arguments:
+        PERSONA -- the keyword
+        interrupt -- (optional) a callable that is polled while listening.
+                     If it returns True (e.g. because a module is waiting
+                     for an answer), (None, None) is returned right away and
+                     a subsequent active listen starts at the disturbance
+                     that has been heard so far, if any.
         """
 
-        THRESHOLD_MULTIPLIER = 1.8
         RATE = 16000
         CHUNK = 1024
 
-        # number of seconds to allow to establish threshold
-        THRESHOLD_TIME = 1
-
         # number of seconds to listen before forcing restart
         LISTEN_TIME = 10
 
-        # prepare recording stream
-        stream = self._audio.open(format=pyaudio.paInt16,
-                                  channels=1,
-                                  rate=RATE,
-                                  input=True,
-                                  frames_per_buffer=CHUNK)
-
-        # stores the audio data
-        frames = []
-
-        # stores the lastN score values
-        lastN = [i for i in range(30)]
-
-        # calculate the long run average, and thereby the proper threshold
-        for i in range(0, RATE / CHUNK * THRESHOLD_TIME):
-
-            data = stream.read(CHUNK)
-            frames.append(data)
-
-            # save this data point as a score
-            lastN.pop(0)
-            lastN.append(self.getScore(data))
-            average = sum(lastN) / len(lastN)
-
         # this will be the benchmark to cause a disturbance over!
-        THRESHOLD = average * THRESHOLD_MULTIPLIER
+        THRESHOLD = self.fetchThreshold()
+
+        # read from the shared capture stream
+        stream = self.capture.reader()
 
-        # save some memory for sound data
+        # stores the audio data
         frames = []
 
         # flag raised when sound disturbance detected
         didDetect = False
 
+        detector = vad.VoiceActivityDetector(THRESHOLD)
+
         # start passively listening for disturbance above threshold
         for i in range(0, RATE / CHUNK * LISTEN_TIME):
 
-            data = stream.read(CHUNK)
+            if interrupt is not None and interrupt():
+                self._position = None
+                return (None, None)
+
+            data = stream.read()
             frames.append(data)
-            score = self.getScore(data)
 
-            if score > THRESHOLD:
+            # the background noise estimate keeps adapting while we listen
+            THRESHOLD = detector.threshold = self.capture.noise_floor.threshold
+            if detector.is_speech(data):
                 didDetect = True
                 break
 
         # no use continuing if no flag raised
         if not didDetect:
             print "No disturbance detected"
-            stream.stop_stream()
-            stream.close()
+            self._position = None
             return (None, None)
 
         # cutoff any recording before this disturbance was detected
         frames = frames[-20:]
 
-        # otherwise, let's keep recording for few seconds and save the file
+        if interrupt is not None and interrupt():
+            # the disturbance is probably the answer the module is waiting
+            # for, so let its active listen start there
+            self._position = stream.position - len(frames)
+            return (None, None)
+
+        # number of seconds to keep recording after the disturbance
         DELAY_MULTIPLIER = 1
-        for i in range(0, RATE / CHUNK * DELAY_MULTIPLIER):
 
-            data = stream.read(CHUNK)
-            frames.append(data)
+        if self.passive_stt_engine.supports_streaming:
+            # feed the decoder while recording and stop as soon as PERSONA
+            # shows up in the hypothesis
+            self._logger.debug("Starting streaming Passive STT transcription")
+            transcribed = self._streamKeyword(
+                stream, frames, PERSONA, RATE / CHUNK * DELAY_MULTIPLIER)
+            self._logger.debug("Finished streaming Passive STT transcription")
+            self._position = stream.position
+        else:
+            # otherwise, let's keep recording for few seconds and save the
+            # file
+            for i in range(0, RATE / CHUNK * DELAY_MULTIPLIER):
+
+                data = stream.read()
+                frames.append(data)
+
+            # remember where we stopped, a subsequent active listen will
+            # continue from here
+            self._position = stream.position
 
-        # save the audio data
-        stream.stop_stream()
-        stream.close()
-
-        with tempfile.NamedTemporaryFile(mode='w+b') as f:
-            wav_fp = wave.open(f, 'wb')
-            wav_fp.setnchannels(1)
-            wav_fp.setsampwidth(pyaudio.get_sample_size(pyaudio.paInt16))
-            wav_fp.setframerate(RATE)
-            wav_fp.writeframes(''.join(frames))
-            wav_fp.close()
-            f.seek(0)
             # check if PERSONA was said
             self._logger.debug("Starting Passive STT transcription")
-            transcribed = self.passive_stt_engine.transcribe(f)
+            transcribed = self.passive_stt_engine.transcribe(
+                AudioSegment.from_frames(frames, rate=RATE))
             self._logger.debug("Finished Passive STT transcription")
 
         if any(PERSONA in phrase for phrase in transcribed):
             return (THRESHOLD, PERSONA)
 
+        # the keyword wasn't said, so a subsequent active listen must not
+        # replay this audio
+        self._position = None
         return (False, transcribed)
 
+    def _streamKeyword(self, stream, frames, PERSONA, max_chunks):
+        """
+        Pushes already recorded frames and up to max_chunks new chunks from
+        stream into the passive STT engine. Returns early as soon as PERSONA
+        appears in the partial hypothesis.
+        """
+        engine = self.passive_stt_engine
+        engine.start_stream()
+        try:
+            for data in frames:
+                transcribed = engine.process_stream(data)
+            for i in range(0, max_chunks):
+                if any(PERSONA in phrase for phrase in transcribed):
+                    return transcribed
+                transcribed = engine.process_stream(stream.read())
+        finally:
+            final = engine.end_stream()
+        return final
+
     def activeListen(self, THRESHOLD=None, LISTEN=True, MUSIC=False):
         """
             Records until a second of silence or times out after 12 seconds
@@ -212,50 +236,39 @@ class Mic:
         if THRESHOLD is None:
             THRESHOLD = self.fetchThreshold()
 
+        # the chunks recorded while the beep is playing are skipped, so
+        # that the beep neither gets transcribed nor keeps the silence
+        # detection from triggering
+        beep_start = self.capture.position
         self.speaker.play(jasperpath.data('audio', 'beep_hi.wav'))
+        beep_end = self.capture.position
 
-        # prepare recording stream
-        stream = self._audio.open(format=pyaudio.paInt16,
-                                  channels=1,
-                                  rate=RATE,
-                                  input=True,
-                                  frames_per_buffer=CHUNK)
+        # continue where passive listening stopped, so that nothing that
+        # has been said after the keyword gets lost
+        stream = self.capture.reader(self._position)
 
         frames = []
-        # increasing the range # results in longer pause after command
+        # increasing the window results in longer pause after command
         # generation
-        lastN = [THRESHOLD * 1.2 for i in range(30)]
+        detector = vad.VoiceActivityDetector(THRESHOLD, window=30)
 
         for i in range(0, RATE / CHUNK * LISTEN_TIME):
 
-            data = stream.read(CHUNK)
-            frames.append(data)
-            score = self.getScore(data)
-
-            lastN.pop(0)
-            lastN.append(score)
+            if beep_start <= stream.position < beep_end:
+                stream.position = beep_end
 
-            average = sum(lastN) / float(len(lastN))
+            data = stream.read()
+            frames.append(data)
 
-            # TODO: 0.8 should not be a MAGIC NUMBER!
-            if average < THRESHOLD * 0.8:
+            if detector.is_silence(data):
                 break
 
         self.speaker.play(jasperpath.data('audio', 'beep_lo.wav'))
 
-        # save the audio data
-        stream.stop_stream()
-        stream.close()
-
-        with tempfile.SpooledTemporaryFile(mode='w+b') as f:
-            wav_fp = wave.open(f, 'wb')
-            wav_fp.setnchannels(1)
-            wav_fp.setsampwidth(pyaudio.get_sample_size(pyaudio.paInt16))
-            wav_fp.setframerate(RATE)
-            wav_fp.writeframes(''.join(frames))
-            wav_fp.close()
-            f.seek(0)
-            return self.active_stt_engine.transcribe(f)
+        self._position = None
+
+        return self.active_stt_engine.transcribe(
+            AudioSegment.from_frames(frames, rate=RATE))
 
     def say(self, phrase,
             OPTIONS=" -vdefault+m3 -p 40 -s 160 --stdout > say.wav"):
@@ -6,6 +6,11 @@ from client.app_utils import getTimezone
 
 WORDS = ["BIRTHDAY"]
 
+VALID_PATTERN = r'birthday'
+
+# isValid() also accepts "birthdays"
+KEYWORD_INDEX = False
+
 
 def handle(text, mic, profile):
     """
@@ -64,4 +69,4 @@ def isValid(text):
         Arguments:
         text -- user-input, typically transcribed speech
     """
-    return bool(re.search(r'birthday', text, re.IGNORECASE))
+    return bool(re.search(VALID_PATTERN, text, re.IGNORECASE))
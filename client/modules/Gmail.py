@@ -1,27 +1,33 @@
 # -*- coding: utf-8-*-
 import imaplib
-import email
 import re
+import threading
 from dateutil import parser
+from client.imapsession import IMAPSession, getSender
 
 WORDS = ["EMAIL", "INBOX"]
 
+VALID_PATTERN = r'\bemail\b'
 
-def getSender(email):
+# Sessions used by handle(), keyed by address and password
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def getSession(profile):
     """
-        Returns the best-guess sender of an email.
+        Returns the shared IMAPSession for the Gmail account in the
+        profile, so that subsequent requests reuse the connection.
 
         Arguments:
-        email -- the email whose sender is desired
-
-        Returns:
-        Sender of the email.
+        profile -- contains information related to the user (e.g., Gmail
+                   address)
     """
-    sender = email['From']
-    m = re.match(r'(.*)\s<.*>', sender)
-    if m:
-        return m.group(1)
-    return sender
+    key = (profile['gmail_address'], profile['gmail_password'])
+    with _sessions_lock:
+        if key not in _sessions:
+            _sessions[key] = IMAPSession.from_profile(profile)
+        return _sessions[key]
 
 
 def getDate(email):
@@ -48,6 +54,7 @@ def getMostRecentDate(emails):
 def fetchUnreadEmails(profile, since=None, markRead=False, limit=None):
     """
         Fetches a list of unread email objects from a user's Gmail inbox.
+        Only the From and Date headers of the emails are fetched.
 
         Arguments:
         profile -- contains information related to the user (e.g., Gmail
@@ -58,28 +65,15 @@ def fetchUnreadEmails(profile, since=None, markRead=False, limit=None):
         Returns:
         A list of unread email objects.
     """
-    conn = imaplib.IMAP4_SSL('imap.gmail.com')
-    conn.debug = 0
-    conn.login(profile['gmail_address'], profile['gmail_password'])
-    conn.select(readonly=(not markRead))
-
-    msgs = []
-    (retcode, messages) = conn.search(None, '(UNSEEN)')
-
-    if retcode == 'OK' and messages != ['']:
-        numUnread = len(messages[0].split(' '))
-        if limit and numUnread > limit:
-            return numUnread
-
-        for num in messages[0].split(' '):
-            # parse email RFC822 format
-            ret, data = conn.fetch(num, '(RFC822)')
-            msg = email.message_from_string(data[0][1])
+    session = getSession(profile)
+    uids = session.search_unseen()
+    if limit and len(uids) > limit:
+        return len(uids)
 
-            if not since or getDate(msg) > since:
-                msgs.append(msg)
-    conn.close()
-    conn.logout()
+    msgs = [msg for uid, msg in session.fetch_headers(uids)
+            if not since or getDate(msg) > since]
+    if markRead:
+        session.mark_read(uids)
 
     return msgs
 
@@ -135,4 +129,4 @@ def isValid(text):
         Arguments:
         text -- user-input, typically transcribed speech
     """
-    return bool(re.search(r'\bemail\b', text, re.IGNORECASE))
+    return bool(re.search(VALID_PATTERN, text, re.IGNORECASE))
@@ -8,6 +8,11 @@ from semantic.numbers import NumberService
 
 WORDS = ["HACKER", "NEWS", "YES", "NO", "FIRST", "SECOND", "THIRD"]
 
+VALID_PATTERN = r'\b(hack(er)?|HN)\b'
+
+# isValid() also accepts "hack" and "HN"
+KEYWORD_INDEX = False
+
 PRIORITY = 4
 
 URL = 'http://news.ycombinator.com'
@@ -136,4 +141,4 @@ def isValid(text):
         Arguments:
         text -- user-input, typically transcribed speech
     """
-    return bool(re.search(r'\b(hack(er)?|HN)\b', text, re.IGNORECASE))
+    return bool(re.search(VALID_PATTERN, text, re.IGNORECASE))
@@ -5,6 +5,8 @@ from client import jasperpath
 
 WORDS = ["JOKE", "KNOCK KNOCK"]
 
+VALID_PATTERN = r'\bjoke\b'
+
 
 def getRandomJoke(filename=jasperpath.data('text', 'JOKES.txt')):
     jokeFile = open(filename, "r")
@@ -63,4 +65,4 @@ def isValid(text):
         Arguments:
         text -- user-input, typically transcribed speech
     """
-    return bool(re.search(r'\bjoke\b', text, re.IGNORECASE))
+    return bool(re.search(VALID_PATTERN, text, re.IGNORECASE))
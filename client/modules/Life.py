@@ -4,6 +4,8 @@ import re
 
 WORDS = ["MEANING", "OF", "LIFE"]
 
+VALID_PATTERN = r'\bmeaning of life\b'
+
 
 def handle(text, mic, profile):
     """
@@ -31,4 +33,4 @@ def isValid(text):
         Arguments:
         text -- user-input, typically transcribed speech
     """
-    return bool(re.search(r'\bmeaning of life\b', text, re.IGNORECASE))
+    return bool(re.search(VALID_PATTERN, text, re.IGNORECASE))
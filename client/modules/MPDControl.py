@@ -1,13 +1,65 @@
 # -*- coding: utf-8-*-
 import re
+import time
 import logging
 import difflib
 import mpd
 from client.mic import Mic
+from client.dispatcher import TaskMic
+from client import vocabularyservice
 
 # Standard module stuff
 WORDS = ["MUSIC", "SPOTIFY"]
 
+VALID_PATTERN = r'music|spotify'
+
+# isValid() matches WORDS anywhere in the text, e.g. "musical"
+KEYWORD_INDEX = False
+
+# Music mode listens for the keyword itself until it is closed
+EXCLUSIVE_MIC = True
+
+# setup() does nothing without these profile sections
+SETUP_REQUIRES = ['mpdclient']
+
+# Phrases understood in music mode besides playlist and song names
+COMMANDS = ["STOP", "CLOSE", "PLAY", "PAUSE", "NEXT", "PREVIOUS", "LOUDER",
+            "SOFTER", "LOWER", "HIGHER", "VOLUME", "PLAYLIST"]
+
+# Keeps the music vocabularies compiled in the background, see setup()
+_vocabulary_service = None
+
+
+def get_mpd_kwargs(profile):
+    kwargs = {}
+    if 'mpdclient' in profile:
+        if 'server' in profile['mpdclient']:
+            kwargs['server'] = profile['mpdclient']['server']
+        if 'port' in profile['mpdclient']:
+            kwargs['port'] = int(profile['mpdclient']['port'])
+    return kwargs
+
+
+def setup(mic, profile):
+    """
+    Starts compiling the music vocabularies in the background, so that
+    music mode starts without delay. The vocabularies are recompiled
+    whenever the MPD library or the stored playlists change. Only done if
+    the profile contains an mpdclient section.
+
+    Arguments:
+        mic -- used to interact with the user (for both input and output)
+        profile -- contains information related to the user (e.g., phone
+                   number)
+    """
+    global _vocabulary_service
+    if 'mpdclient' not in profile or _vocabulary_service is not None:
+        return
+    library = MPDLibrary(**get_mpd_kwargs(profile))
+    _vocabulary_service = vocabularyservice.VocabularyService(
+        mic.active_stt_engine.__class__, library)
+    _vocabulary_service.start()
+
 
 def handle(text, mic, profile):
     """
@@ -21,29 +73,36 @@ def handle(text, mic, profile):
     """
     logger = logging.getLogger(__name__)
 
-    kwargs = {}
-    if 'mpdclient' in profile:
-        if 'server' in profile['mpdclient']:
-            kwargs['server'] = profile['mpdclient']['server']
-        if 'port' in profile['mpdclient']:
-            kwargs['port'] = int(profile['mpdclient']['port'])
-
     logger.debug("Preparing to start music module")
     try:
-        mpdwrapper = MPDWrapper(**kwargs)
+        mpdwrapper = MPDWrapper(**get_mpd_kwargs(profile))
     except:
         logger.error("Couldn't connect to MPD server", exc_info=True)
         mic.say("I'm sorry. It seems that Spotify is not enabled. Please " +
                 "read the documentation to learn how to configure Spotify.")
         return
 
-    mic.say("Please give me a moment, I'm loading your Spotify playlists.")
+    # Use a precompiled vocabulary if one is ready, preferably the one that
+    # includes the songs
+    music_stt_engine = None
+    song_selection = False
+    if _vocabulary_service is not None:
+        music_stt_engine = _vocabulary_service.get_instance('music-songs')
+        song_selection = music_stt_engine is not None
+        if music_stt_engine is None:
+            music_stt_engine = _vocabulary_service.get_instance('music')
+
+    if music_stt_engine is None:
+        mic.say("Please give me a moment, I'm loading your Spotify " +
+                "playlists.")
 
     # FIXME: Make this configurable
     persona = 'JASPER'
 
     logger.debug("Starting music mode")
-    music_mode = MusicMode(persona, mic, mpdwrapper)
+    music_mode = MusicMode(persona, mic, mpdwrapper,
+                           music_stt_engine=music_stt_engine,
+                           song_selection=song_selection)
     music_mode.handleForever()
     logger.debug("Exiting music mode")
 
@@ -57,29 +116,36 @@ def isValid(text):
         Arguments:
         text -- user-input, typically transcribed speech
     """
-    return any(word in text.upper() for word in WORDS)
+    return bool(re.search(VALID_PATTERN, text, re.IGNORECASE))
 
 
 # The interesting part
 class MusicMode(object):
 
-    def __init__(self, PERSONA, mic, mpdwrapper):
+    def __init__(self, PERSONA, mic, mpdwrapper, music_stt_engine=None,
+                 song_selection=False):
         self._logger = logging.getLogger(__name__)
         self.persona = PERSONA
         # self.mic - we're actually going to ignore the mic they passed in
         self.music = mpdwrapper
+        # song selection needs a vocabulary that contains all songs
+        self.song_selection = song_selection
 
-        # index spotify playlists into new dictionary and language models
-        phrases = ["STOP", "CLOSE", "PLAY", "PAUSE", "NEXT", "PREVIOUS",
-                   "LOUDER", "SOFTER", "LOWER", "HIGHER", "VOLUME",
-                   "PLAYLIST"]
-        phrases.extend(self.music.get_soup_playlist())
-
-        music_stt_engine = mic.active_stt_engine.get_instance('music', phrases)
+        if music_stt_engine is None:
+            # index spotify playlists into new dictionary and language
+            # models
+            phrases = list(COMMANDS)
+            phrases.extend(self.music.get_soup_playlist())
+            music_stt_engine = mic.active_stt_engine.get_instance('music',
+                                                                  phrases)
 
         self.mic = Mic(mic.speaker,
                        mic.passive_stt_engine,
-                       music_stt_engine)
+                       music_stt_engine,
+                       capture=mic.capture)
+        if isinstance(mic, TaskMic):
+            # stop listening when the task is cancelled
+            self.mic = mic.wrap(self.mic)
 
     def delegateInput(self, input):
 
@@ -92,7 +158,8 @@ class MusicMode(object):
             self.mic.say("Stopping music")
             self.music.stop()
             return
-        elif "PLAY" in command:
+        elif ("PLAY" in command and
+              (not self.song_selection or command.strip() == "PLAY")):
             self.mic.say("Playing %s" % self.music.current_song())
             self.music.play()
             return
@@ -125,22 +192,18 @@ class MusicMode(object):
             self.mic.say("Playing %s" % self.music.current_song())
             return
 
-        # SONG SELECTION... requires long-loading dictionary and language model
-        # songs = self.music.fuzzy_songs(query = command.replace("PLAY", ""))
-        # if songs:
-        #     self.mic.say("Found songs")
-        #     self.music.play(songs = songs)
-
-        #     print("SONG RESULTS")
-        #     print("============")
-        #     for song in songs:
-        #         print("Song: %s Artist: %s" % (song.title, song.artist))
-
-        #     self.mic.say("Playing %s" % self.music.current_song())
-
-        # else:
-        #     self.mic.say("No songs found. Resuming current song.")
-        #     self.music.play()
+        # SONG SELECTION... requires the precompiled song vocabulary
+        if self.song_selection:
+            songs = self.music.fuzzy_songs(
+                query=command.replace("PLAY", "").strip())
+            if songs:
+                self.mic.say("Found songs")
+                self.music.play(songs=songs)
+                for song in songs:
+                    self._logger.debug("Song: %s Artist: %s", song.title,
+                                       song.artist)
+                self.mic.say("Playing %s" % self.music.current_song())
+                return
 
         # PLAYLIST SELECTION
         playlists = self.music.fuzzy_playlists(query=command)
@@ -206,6 +269,95 @@ def reconnect(func, *default_args, **default_kwargs):
     return wrap
 
 
+def normalize_names(names, separator):
+    """
+    Converts names to upper case ASCII phrases without punctuation.
+
+    Arguments:
+        names -- a list of UTF-8 encoded names
+        separator -- the replacement for all non-letter characters
+
+    Returns:
+        A list of the normalized names
+    """
+    title_trans = ''.join(chr(c) if chr(c).isupper() or chr(c).islower()
+                          else '_' for c in range(256))
+    return [x.decode('utf-8').encode("ascii", "ignore").upper().translate(
+            title_trans).replace("_", separator) for x in names]
+
+
+class MPDLibrary(vocabularyservice.VocabularySource):
+    """
+    Provides the phrases of the music vocabularies from the MPD library and
+    uses MPD's idle command to wait for changes.
+    """
+
+    def __init__(self, server="localhost", port=6600, poll_interval=300):
+        self._logger = logging.getLogger(__name__)
+        self.server = server
+        self.port = port
+        self.poll_interval = poll_interval
+
+    def _connect(self):
+        client = mpd.MPDClient()
+        client.timeout = None
+        client.idletimeout = None
+        client.connect(self.server, self.port)
+        return client
+
+    def get_phrases(self):
+        """
+        Returns:
+            A dict with the phrases of the 'music' vocabulary (commands and
+            playlist names) and of the 'music-songs' vocabulary (commands,
+            playlist names and song titles and artists)
+        """
+        client = self._connect()
+        try:
+            playlists = [x["playlist"] for x in client.listplaylists()]
+            songs = []
+            for playlist in playlists:
+                songs.extend(client.listplaylistinfo(playlist))
+        finally:
+            client.disconnect()
+
+        playlist_words = []
+        for name in playlists:
+            playlist_words.extend(name.split(" "))
+        playlist_phrases = set(normalize_names(playlist_words, ""))
+
+        song_names = set()
+        for song in songs:
+            for field in ('title', 'artist'):
+                value = song.get(field)
+                if isinstance(value, list):
+                    value = value[0]
+                if value:
+                    song_names.add(value.strip())
+        song_phrases = set(re.sub(' +', ' ', x).strip() for x in
+                           normalize_names(list(song_names), " "))
+
+        music = sorted(set(COMMANDS) | playlist_phrases)
+        music_songs = sorted(set(music) | song_phrases)
+        return {'music': [x for x in music if x],
+                'music-songs': [x for x in music_songs if x]}
+
+    def wait_for_change(self):
+        client = self._connect()
+        try:
+            changed = client.idle('database', 'stored_playlist')
+            self._logger.debug("MPD subsystems changed: %r", changed)
+        except mpd.CommandError:
+            self._logger.debug("MPD server doesn't support idle, polling " +
+                               "every %d seconds", self.poll_interval)
+            time.sleep(self.poll_interval)
+        finally:
+            try:
+                client.disconnect()
+            except Exception:
+                pass
+
+
 class Song(object):
     def __init__(self, id, title, artist, album):
 
@@ -327,10 +479,7 @@ class MPDWrapper(object):
             soup.extend(song_words)
             soup.extend(artist_words)
 
-        title_trans = ''.join(chr(c) if chr(c).isupper() or chr(c).islower()
-                              else '_' for c in range(256))
-        soup = [x.decode('utf-8').encode("ascii", "ignore").upper().translate(
-                title_trans).replace("_", "") for x in soup]
+        soup = normalize_names(soup, "")
         soup = [x for x in soup if x != ""]
 
         return list(set(soup))
@@ -345,10 +494,7 @@ class MPDWrapper(object):
         for name in self.playlists:
             soup.extend(name.split(" "))
 
-        title_trans = ''.join(chr(c) if chr(c).isupper() or chr(c).islower()
-                              else '_' for c in range(256))
-        soup = [x.decode('utf-8').encode("ascii", "ignore").upper().translate(
-                title_trans).replace("_", "") for x in soup]
+        soup = normalize_names(soup, "")
         soup = [x for x in soup if x != ""]
 
         return list(set(soup))
@@ -363,10 +509,7 @@ class MPDWrapper(object):
 
         soup = list(set(title_soup + artist_soup))
 
-        title_trans = ''.join(chr(c) if chr(c).isupper() or chr(c).islower()
-                              else '_' for c in range(256))
-        soup = [x.decode('utf-8').encode("ascii", "ignore").upper().translate(
-                title_trans).replace("_", " ") for x in soup]
+        soup = normalize_names(soup, " ")
         soup = [re.sub(' +', ' ', x) for x in soup if x != ""]
 
         return soup
@@ -6,6 +6,11 @@ from semantic.numbers import NumberService
 
 WORDS = ["NEWS", "YES", "NO", "FIRST", "SECOND", "THIRD"]
 
+VALID_PATTERN = r'\b(news|headline)\b'
+
+# isValid() also accepts "headline"
+KEYWORD_INDEX = False
+
 PRIORITY = 3
 
 URL = 'http://news.ycombinator.com'
@@ -128,4 +133,4 @@ def isValid(text):
         Arguments:
         text -- user-input, typically transcribed speech
     """
-    return bool(re.search(r'\b(news|headline)\b', text, re.IGNORECASE))
+    return bool(re.search(VALID_PATTERN, text, re.IGNORECASE))
@@ -5,6 +5,11 @@ import facebook
 
 WORDS = ["FACEBOOK", "NOTIFICATION"]
 
+VALID_PATTERN = r'\bnotification|Facebook\b'
+
+# isValid() also accepts "notifications"
+KEYWORD_INDEX = False
+
 
 def handle(text, mic, profile):
     """
@@ -55,4 +60,4 @@ def isValid(text):
         Arguments:
         text -- user-input, typically transcribed speech
     """
-    return bool(re.search(r'\bnotification|Facebook\b', text, re.IGNORECASE))
+    return bool(re.search(VALID_PATTERN, text, re.IGNORECASE))
@@ -6,6 +6,8 @@ from semantic.dates import DateService
 
 WORDS = ["TIME"]
 
+VALID_PATTERN = r'\btime\b'
+
 
 def handle(text, mic, profile):
     """
@@ -32,4 +34,4 @@ def isValid(text):
         Arguments:
         text -- user-input, typically transcribed speech
     """
-    return bool(re.search(r'\btime\b', text, re.IGNORECASE))
+    return bool(re.search(VALID_PATTERN, text, re.IGNORECASE))
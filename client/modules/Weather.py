@@ -11,6 +11,12 @@ from semantic.dates import DateService
 
 WORDS = ["WEATHER", "TODAY", "TOMORROW"]
 
+VALID_PATTERN = (r'\b(weathers?|temperature|forecast|outside|hot|cold|' +
+                 r'jacket|coat|rain)\b')
+
+# isValid() accepts many weather related words besides WORDS
+KEYWORD_INDEX = False
+
 
 def replaceAcronyms(text):
     """
@@ -168,5 +174,4 @@ def isValid(text):
         Arguments:
         text -- user-input, typically transcribed speech
     """
-    return bool(re.search(r'\b(weathers?|temperature|forecast|outside|hot|' +
-                          r'cold|jacket|coat|rain)\b', text, re.IGNORECASE))
+    return bool(re.search(VALID_PATTERN, text, re.IGNORECASE))
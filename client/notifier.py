@@ -1,56 +1,157 @@
 # -*- coding: utf-8-*-
 import Queue
 import atexit
-from modules import Gmail
-from apscheduler.schedulers.background import BackgroundScheduler
 import logging
+import pkgutil
+import threading
+from abc import ABCMeta, abstractmethod
+import jasperpath
 
 
-class Notifier(object):
+class NotificationSource(object):
+    """
+    Base class of notification source plugins. Sources are discovered in
+    the notifiers folder and each one runs in its own thread, so a slow
+    source doesn't delay the others.
 
-    class NotificationClient(object):
+    Sources are polled every INTERVAL seconds. Sources that get pushed
+    notifications (e.g. through IMAP IDLE) override wait() to block until
+    something has happened.
+    """
+    __metaclass__ = ABCMeta
 
-        def __init__(self, gather, timestamp):
-            self.gather = gather
-            self.timestamp = timestamp
+    SLUG = None
 
-        def run(self):
-            self.timestamp = self.gather(self.timestamp)
+    # Seconds between two polls
+    INTERVAL = 30
 
     def __init__(self, profile):
         self._logger = logging.getLogger(__name__)
-        self.q = Queue.Queue()
         self.profile = profile
-        self.notifiers = []
 
-        if 'gmail_address' in profile and 'gmail_password' in profile:
-            self.notifiers.append(self.NotificationClient(
-                self.handleEmailNotifications, None))
-        else:
-            self._logger.warning('gmail_address or gmail_password not set ' +
-                                 'in profile, Gmail notifier will not be used')
+    @classmethod
+    def is_available(cls, profile):
+        """
+        Returns:
+            True if the profile contains everything this source needs
+        """
+        return True
 
-        sched = BackgroundScheduler(timezone="UTC", daemon=True)
-        sched.start()
-        sched.add_job(self.gather, 'interval', seconds=30)
-        atexit.register(lambda: sched.shutdown(wait=False))
+    @abstractmethod
+    def get_notifications(self):
+        """
+        Returns:
+            A list of new notifications, in chronological order
+        """
+        pass
 
-    def gather(self):
-        [client.run() for client in self.notifiers]
+    def wait(self, stop_event):
+        """
+        Blocks until new notifications might be available.
 
-    def handleEmailNotifications(self, lastDate):
-        """Places new Gmail notifications in the Notifier's queue."""
-        emails = Gmail.fetchUnreadEmails(self.profile, since=lastDate)
-        if emails:
-            lastDate = Gmail.getMostRecentDate(emails)
+        Arguments:
+            stop_event -- a threading.Event that is set when the Notifier
+                          stops
+        """
+        stop_event.wait(self.INTERVAL)
 
-        def styleEmail(e):
-            return "New email from %s." % Gmail.getSender(e)
 
-        for e in emails:
-            self.q.put(styleEmail(e))
+class SourceRunner(threading.Thread):
+    """
+    Daemon thread that puts the notifications of a NotificationSource into
+    a queue. Failing sources are retried with exponential backoff.
+    """
 
-        return lastDate
+    def __init__(self, source, queue, max_backoff=600):
+        """
+        Arguments:
+            source -- the NotificationSource
+            queue -- the Queue.Queue the notifications are put into
+            max_backoff -- (optional) the maximum seconds to wait after
+                           repeated errors (Default: 600)
+        """
+        super(SourceRunner, self).__init__(
+            name='NotificationSource-%s' % source.SLUG)
+        self.daemon = True
+        self._logger = logging.getLogger(__name__)
+        self.source = source
+        self.queue = queue
+        self.max_backoff = max_backoff
+        self._stop_event = threading.Event()
+
+    def run(self):
+        backoff = self.source.INTERVAL
+        while not self._stop_event.is_set():
+            try:
+                for notification in self.source.get_notifications():
+                    self.queue.put(notification)
+                self.source.wait(self._stop_event)
+            except Exception:
+                self._logger.warning("Notification source '%s' failed, " +
+                                     "retrying in %d seconds",
+                                     self.source.SLUG, backoff,
+                                     exc_info=True)
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+            else:
+                backoff = self.source.INTERVAL
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class Notifier(object):
+
+    def __init__(self, profile):
+        self._logger = logging.getLogger(__name__)
+        self.q = Queue.Queue()
+        self.profile = profile
+        self.sources = []
+        for source_class in self.get_sources():
+            if source_class.is_available(profile):
+                self.sources.append(source_class(profile))
+            else:
+                self._logger.warning("Notification source '%s' is not " +
+                                     "configured in profile and will not " +
+                                     "be used", source_class.SLUG)
+
+        self.runners = [SourceRunner(source, self.q)
+                        for source in self.sources]
+        for runner in self.runners:
+            runner.start()
+        atexit.register(self.stop)
+
+    @classmethod
+    def get_sources(cls):
+        """
+        Dynamically loads all the modules in the notifiers folder and
+        returns the NotificationSource subclasses defined in them.
+        """
+        logger = logging.getLogger(__name__)
+        locations = [jasperpath.NOTIFIER_PATH]
+        logger.debug("Looking for notification sources in: %s",
+                     ', '.join(["'%s'" % location for location in locations]))
+        sources = []
+        for finder, name, ispkg in pkgutil.walk_packages(locations):
+            try:
+                loader = finder.find_module(name)
+                mod = loader.load_module(name)
+            except Exception:
+                logger.warning("Skipped notification source module '%s' " +
+                               "due to an error.", name, exc_info=True)
+                continue
+            for obj in vars(mod).values():
+                if (isinstance(obj, type) and
+                        issubclass(obj, NotificationSource) and
+                        obj.__module__ == mod.__name__ and obj.SLUG):
+                    logger.debug("Found notification source '%s'", obj.SLUG)
+                    sources.append(obj)
+        sources.sort(key=lambda source: source.SLUG)
+        return sources
+
+    def stop(self):
+        for runner in self.runners:
+            runner.stop()
 
     def getNotification(self):
         """Returns a notification. Note that this function is consuming."""
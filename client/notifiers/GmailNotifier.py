@@ -0,0 +1,102 @@
+# -*- coding: utf-8-*-
+import os
+import json
+from client import jasperpath
+from client.notifier import NotificationSource
+from client import imapsession
+
+
+class GmailNotifier(NotificationSource):
+    """
+    Announces new unread emails. The IMAP server pushes changes of the inbox
+    through IDLE, so new emails are announced right away. Only the headers
+    of emails past a (UIDVALIDITY, UID) high-water mark are fetched, and
+    the mark is saved so that emails aren't announced again after a
+    restart.
+    """
+
+    SLUG = 'gmail'
+
+    def __init__(self, profile, session=None, state_file=None):
+        """
+        Arguments:
+            profile -- contains information related to the user (e.g.,
+                       Gmail address)
+            session -- (optional) the imapsession.IMAPSession to use
+                       (Default: a new session for the account in the
+                       profile)
+            state_file -- (optional) where to save the high-water mark
+                          (Default: <config dir>/gmail-state.json)
+        """
+        super(GmailNotifier, self).__init__(profile)
+        self.session = (session if session is not None
+                        else imapsession.IMAPSession.from_profile(profile))
+        self.state_file = (state_file if state_file is not None
+                           else jasperpath.config('gmail-state.json'))
+        self.last_uid = self.load_state()
+
+    @classmethod
+    def is_available(cls, profile):
+        return 'gmail_address' in profile and 'gmail_password' in profile
+
+    def get_notifications(self):
+        uidvalidity, uid = self.last_uid if self.last_uid else (None, 0)
+        emails = self.session.fetch_unseen(after=uid)
+        if uid and self.session.uidvalidity != uidvalidity:
+            # The UIDs of the inbox have been reassigned, so our high-water
+            # mark is meaningless
+            emails = self.session.fetch_unseen()
+            uid = 0
+        uidvalidity = self.session.uidvalidity
+
+        notifications = []
+        for email_uid, e in emails:
+            notifications.append("New email from %s." %
+                                 imapsession.getSender(e))
+            uid = max(uid, email_uid)
+
+        if (uidvalidity, uid) != self.last_uid:
+            self.last_uid = (uidvalidity, uid)
+            self.save_state()
+        return notifications
+
+    def wait(self, stop_event):
+        if self.session.idle() is None:
+            # The server doesn't support IDLE, so poll
+            super(GmailNotifier, self).wait(stop_event)
+
+    def load_state(self):
+        """
+        Returns:
+            The (UIDVALIDITY, UID) tuple saved by save_state() for the Gmail
+            address in the profile, or None
+        """
+        try:
+            with open(self.state_file, 'r') as f:
+                state = json.load(f)
+            if state['address'] != self.profile.get('gmail_address'):
+                return None
+            return (state['uidvalidity'], state['uid'])
+        except IOError:
+            return None
+        except (ValueError, KeyError, TypeError):
+            self._logger.warning("Ignoring corrupt email state file '%s'",
+                                 self.state_file)
+            return None
+
+    def save_state(self):
+        """
+        Saves the UIDVALIDITY of the inbox and the highest announced UID.
+        """
+        if not os.path.isdir(os.path.dirname(self.state_file)):
+            return
+        uidvalidity, uid = self.last_uid
+        tmp_file = self.state_file + '.tmp'
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump({'address': self.profile.get('gmail_address'),
+                           'uidvalidity': uidvalidity, 'uid': uid}, f)
+            os.rename(tmp_file, self.state_file)
+        except (IOError, OSError):
+            self._logger.warning("Could not save email state to '%s'",
+                                 self.state_file, exc_info=True)
@@ -0,0 +1,234 @@
+# -*- coding: utf-8-*-
+"""
+On-disk manifest of the modules in the plugin directories.
+
+Importing all modules (and their dependencies like facebook, mpd or bs4) is
+expensive. The manifest records the name, WORDS and PRIORITY of every
+module together with the modification times of all plugin files, so that
+e.g. the vocabulary compiler can get the WORDS of all modules without
+importing anything as long as no plugin file has changed.
+
+Modules whose isValid() function just searches the text for a regular
+expression (case insensitive) can set VALID_PATTERN to that expression.
+The manifest records it, so that phrases can be routed without importing
+any module. Modules whose setup() function only does something if certain
+sections are in the profile can list them in SETUP_REQUIRES.
+"""
+import os
+import re
+import json
+import logging
+import pkgutil
+import threading
+
+
+class PluginManifest(object):
+    """
+    JSON file that describes the modules found in some plugin directories.
+    """
+
+    VERSION = 4
+
+    def __init__(self, filename, locations):
+        """
+        Arguments:
+            filename -- the path of the manifest file
+            locations -- a list of plugin directories
+        """
+        self._logger = logging.getLogger(__name__)
+        self.filename = filename
+        self.locations = locations
+
+    @staticmethod
+    def get_plugin_files(locations):
+        """
+        Lists the source files of all plugins without importing them.
+
+        Arguments:
+            locations -- a list of plugin directories
+
+        Returns:
+            A dict mapping the paths of the source files to lists of their
+            modification time and size
+        """
+        files = {}
+        for finder, name, ispkg in pkgutil.iter_modules(locations):
+            location = getattr(finder, 'path', None)
+            if location is None:
+                continue
+            if ispkg:
+                path = os.path.join(location, name, '__init__.py')
+            else:
+                path = os.path.join(location, name + '.py')
+            try:
+                st = os.stat(path)
+            except OSError:
+                # Byte-compiled only or removed in the meantime
+                continue
+            files[path] = [st.st_mtime, st.st_size]
+        return files
+
+    @staticmethod
+    def describe(module):
+        """
+        Arguments:
+            module -- a loaded module
+
+        Returns:
+            A dict with the name, source file and plugin directory of the
+            module, its WORDS, PRIORITY, KEYWORD_INDEX, TIMEOUT,
+            EXCLUSIVE_MIC, VALID_PATTERN and SETUP_REQUIRES constants and
+            whether it has a setup() function
+        """
+        filename = getattr(module, '__file__', None)
+        location = None
+        if filename is not None:
+            filename = os.path.splitext(filename)[0] + '.py'
+            location = os.path.dirname(filename)
+            if hasattr(module, '__path__'):
+                location = os.path.dirname(location)
+        return {'name': module.__name__,
+                'file': filename,
+                'location': location,
+                'words': list(module.WORDS),
+                'priority': getattr(module, 'PRIORITY', 0),
+                'keyword_index': bool(getattr(module, 'KEYWORD_INDEX',
+                                              True)),
+                'has_setup': callable(getattr(module, 'setup', None)),
+                'timeout': getattr(module, 'TIMEOUT', None),
+                'exclusive_mic': bool(getattr(module, 'EXCLUSIVE_MIC',
+                                              False)),
+                'valid_pattern': getattr(module, 'VALID_PATTERN', None),
+                'setup_requires': list(getattr(module, 'SETUP_REQUIRES', []))}
+
+    def load(self):
+        """
+        Reads the manifest, if it is still up to date.
+
+        Returns:
+            A list of module descriptions (see describe()) sorted by
+            priority, or None if the manifest doesn't exist or any plugin
+            file has been added, removed or modified since it was written
+        """
+        try:
+            with open(self.filename, 'r') as f:
+                manifest = json.load(f)
+        except IOError:
+            return None
+        except ValueError:
+            self._logger.warning("Plugin manifest '%s' is corrupt",
+                                 self.filename)
+            return None
+        if (not isinstance(manifest, dict) or
+                manifest.get('version') != self.VERSION or
+                manifest.get('locations') != self.locations):
+            return None
+        if manifest.get('files') != self.get_plugin_files(self.locations):
+            self._logger.debug("Plugin manifest '%s' is outdated",
+                               self.filename)
+            return None
+        return manifest['modules']
+
+    def save(self, modules, files):
+        """
+        Writes the manifest. Errors are only logged, because the manifest
+        is just a cache.
+
+        Arguments:
+            modules -- a list of loaded modules, sorted by priority
+            files -- the plugin files the modules were loaded from, as
+                     returned by get_plugin_files() before loading them
+        """
+        manifest = {'version': self.VERSION,
+                    'locations': self.locations,
+                    'files': files,
+                    'modules': [self.describe(module) for module in modules]}
+        tmp_filename = self.filename + '.tmp'
+        try:
+            with open(tmp_filename, 'w') as f:
+                json.dump(manifest, f, indent=2, sort_keys=True)
+            os.rename(tmp_filename, self.filename)
+        except (IOError, OSError):
+            self._logger.warning("Could not write plugin manifest '%s'",
+                                 self.filename, exc_info=True)
+
+
+class LazyModule(object):
+    """
+    Stand-in for a module that is described by the plugin manifest. The
+    module itself is only imported when it's needed, e.g. when its handle()
+    function is called for the first time. isValid() is answered from the
+    VALID_PATTERN of the module, and setup() is skipped if the profile
+    lacks a section in SETUP_REQUIRES. Modules without a VALID_PATTERN are
+    imported on their first isValid() call.
+    """
+
+    def __init__(self, description):
+        """
+        Arguments:
+            description -- a module description, see
+                           PluginManifest.describe()
+        """
+        self._logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._module = None
+        self._has_setup = description.get('has_setup', False)
+        self.location = description['location']
+        self.__name__ = description['name']
+        self.__file__ = description['file']
+        self.WORDS = description['words']
+        self.PRIORITY = description['priority']
+        self.KEYWORD_INDEX = description['keyword_index']
+        self.TIMEOUT = description.get('timeout')
+        self.EXCLUSIVE_MIC = description.get('exclusive_mic', False)
+        self.VALID_PATTERN = description.get('valid_pattern')
+        self.SETUP_REQUIRES = description.get('setup_requires', [])
+
+    @property
+    def is_loaded(self):
+        return self._module is not None
+
+    def load(self):
+        """
+        Imports the module, if it hasn't been imported yet.
+
+        Returns:
+            The module
+        """
+        with self._lock:
+            if self._module is None:
+                self._logger.debug("Loading module '%s'", self.__name__)
+                finder = pkgutil.ImpImporter(self.location)
+                self._module = finder.find_module(
+                    self.__name__).load_module(self.__name__)
+            return self._module
+
+    def isValid(self, text):
+        if self.VALID_PATTERN is None:
+            return self.load().isValid(text)
+        return bool(re.search(self.VALID_PATTERN, text, re.IGNORECASE))
+
+    @property
+    def setup(self):
+        if not self._has_setup:
+            raise AttributeError('setup')
+        return self._setup
+
+    def _setup(self, mic, profile):
+        missing = [key for key in self.SETUP_REQUIRES if key not in profile]
+        if missing:
+            self._logger.debug("Skipping setup of module '%s', profile " +
+                               "lacks: %s", self.__name__, ', '.join(missing))
+            return
+        return self.load().setup(mic, profile)
+
+    def __getattr__(self, name):
+        # Only called for attributes that aren't set on the proxy itself
+        if name.startswith('__') or (name == 'setup' and
+                                     not self._has_setup):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __repr__(self):
+        return "<lazy module '%s' from '%s'>" % (self.__name__,
+                                                 self.__file__)
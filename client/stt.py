@@ -1,7 +1,6 @@
 #!/usr/bin/env python2
 # -*- coding: utf-8-*-
 import os
-import wave
 import json
 import tempfile
 import logging
@@ -9,12 +8,19 @@ import urllib
 import urlparse
 import re
 import subprocess
+import threading
+import atexit
+import socket
+import struct
+import time
 from abc import ABCMeta, abstractmethod
+from concurrent import futures
 import requests
 import yaml
 import jasperpath
 import diagnose
 import vocabcompiler
+import audiosegment
 
 
 class AbstractSTTEngine(object):
@@ -42,6 +48,31 @@ class AbstractSTTEngine(object):
         instance = cls(**config)
         return instance
 
+    @classmethod
+    def compile_vocabularies(cls, passive_engine_class=None):
+        """
+        Compiles the vocabularies needed by get_active_instance() of this
+        class and get_passive_instance() of passive_engine_class
+        concurrently, so that creating the instances afterwards doesn't
+        have to compile anything.
+
+        Arguments:
+            passive_engine_class -- (optional) the passive STT engine class
+                                    (Default: this class)
+        """
+        if passive_engine_class is None:
+            passive_engine_class = cls
+        jobs = []
+        if passive_engine_class.VOCABULARY_TYPE:
+            jobs.append((passive_engine_class.VOCABULARY_TYPE, 'keyword',
+                         vocabcompiler.get_keyword_phrases()))
+        if cls.VOCABULARY_TYPE:
+            jobs.append((cls.VOCABULARY_TYPE, 'default',
+                         vocabcompiler.get_all_phrases()))
+        if jobs:
+            vocabcompiler.compile_vocabularies(
+                jobs, jasperpath.config('vocabularies'))
+
     @classmethod
     def get_passive_instance(cls):
         phrases = vocabcompiler.get_keyword_phrases()
@@ -59,17 +90,91 @@ class AbstractSTTEngine(object):
 
     @abstractmethod
     def transcribe(self, fp):
+        """
+        Transcribes audio data.
+
+        Arguments:
+            fp -- an audiosegment.AudioSegment, or a file object containing
+                  WAV data
+
+        Returns:
+            A list of transcriptions
+        """
         pass
 
+    @property
+    def supports_streaming(self):
+        """
+        Returns:
+            True if this engine transcribes streamed audio incrementally,
+            else False. By default, streamed audio is only buffered and
+            transcribed once the stream ends.
+        """
+        return False
+
+    def start_stream(self):
+        """
+        Starts a new utterance for incremental transcription.
+        """
+        self._stream_frames = []
+
+    def process_stream(self, data):
+        """
+        Feeds raw 16 bit mono PCM data at 16 kHz into the current
+        utterance.
+
+        Arguments:
+            data -- a chunk of raw audio data
+
+        Returns:
+            A list of the partial transcriptions so far
+        """
+        self._stream_frames.append(data)
+        return []
+
+    def end_stream(self):
+        """
+        Finishes the current utterance.
+
+        Returns:
+            A list of the final transcriptions
+        """
+        frames, self._stream_frames = self._stream_frames, []
+        return self.transcribe(audiosegment.AudioSegment.from_frames(frames))
+
+    @staticmethod
+    def _get_wav_data(fp):
+        if isinstance(fp, audiosegment.AudioSegment):
+            return fp.wav_data()
+        return fp.read()
+
 
 class PocketSphinxSTT(AbstractSTTEngine):
     """
     The default Speech-to-Text implementation which relies on PocketSphinx.
+
+    Loaded decoders are kept in a process-wide pool. Instances with the same
+    vocabulary share a decoder. On Pocketsphinx v5, instances with the same
+    hmm_dir but a different vocabulary share the decoder as well, with a
+    named search for each vocabulary, so that the acoustic model is only
+    loaded once.
     """
 
     SLUG = 'sphinx'
     VOCABULARY_TYPE = vocabcompiler.PocketsphinxVocabulary
 
+    class PooledDecoder(object):
+        def __init__(self, decoder, hmm_dir, logfile):
+            self.decoder = decoder
+            self.hmm_dir = hmm_dir
+            self.logfile = logfile
+            # Serializes utterances of all instances sharing this decoder
+            self.lock = threading.RLock()
+
+    # Maps (hmm_dir, lm, dict, revision) to (PooledDecoder, search name)
+    _decoders = {}
+    _decoders_lock = threading.Lock()
+
     def __init__(self, vocabulary, hmm_dir="/usr/local/share/" +
                  "pocketsphinx/model/hmm/en_US/hub4wsj_sc_8k"):
 
@@ -89,19 +194,94 @@ class PocketSphinxSTT(AbstractSTTEngine):
         except:
             import pocketsphinx as ps
 
+        self._pocketsphinx_v5 = hasattr(ps.Decoder, 'default_config')
+
+        pooled, self._search = self._get_decoder(ps, hmm_dir, vocabulary)
+        self._decoder = pooled.decoder
+        self._decoder_lock = pooled.lock
+        self._logfile = pooled.logfile
+
+    @classmethod
+    def _get_decoder(cls, ps, hmm_dir, vocabulary):
+        """
+        Returns a (PooledDecoder, search name) tuple for the vocabulary,
+        loading a new decoder only if no suitable one is in the pool yet.
+        """
+        logger = logging.getLogger(__name__)
+        lm_path = vocabulary.decoder_kwargs['lm']
+        dict_path = vocabulary.decoder_kwargs['dict']
+        revision = vocabulary.compiled_revision
+        key = (hmm_dir, lm_path, dict_path, revision)
+        with cls._decoders_lock:
+            if key in cls._decoders:
+                logger.debug("Reusing pooled PocketSphinx Decoder for " +
+                             "vocabulary '%s'", vocabulary.name)
+                return cls._decoders[key]
+
+            # Entries for older revisions of this vocabulary are stale now
+            stale = [cls._decoders.pop(k) for k in cls._decoders.keys()
+                     if k[:3] == key[:3]]
+
+            pooled = None
+            search = None
+            if hasattr(ps.Decoder, 'default_config'):
+                for other_pooled, other_search in (stale +
+                                                   cls._decoders.values()):
+                    if other_pooled.hmm_dir == hmm_dir:
+                        pooled = other_pooled
+                        break
+                # Replace the search of an older revision instead of adding
+                # one search per revision to the decoder
+                for stale_pooled, stale_search in stale:
+                    if stale_pooled is pooled:
+                        search = stale_search
+
+            if pooled is not None:
+                if search is None:
+                    search = vocabulary.name
+                logger.debug("Loading search '%s' into pooled PocketSphinx " +
+                             "Decoder with hmm_dir '%s'", search, hmm_dir)
+                with pooled.lock:
+                    cls._add_search(pooled.decoder, search, lm_path,
+                                    dict_path)
+            else:
+                pooled = cls._create_decoder(ps, hmm_dir, lm_path, dict_path)
+                search = (pooled.decoder.get_search()
+                          if hasattr(ps.Decoder, 'default_config') else None)
+            cls._decoders[key] = (pooled, search)
+            return cls._decoders[key]
+
+    @classmethod
+    def _add_search(cls, decoder, search, lm_path, dict_path):
+        """
+        Adds the words from dict_path that the decoder doesn't know yet to
+        its dictionary and registers the languagemodel as named search.
+        """
+        with open(dict_path, 'r') as f:
+            for line in f:
+                parts = line.strip().split(None, 1)
+                if len(parts) == 2 and decoder.lookup_word(parts[0]) is None:
+                    decoder.add_word(parts[0], parts[1], False)
+        decoder.set_lm_file(search, lm_path)
+
+    @classmethod
+    def _create_decoder(cls, ps, hmm_dir, lm_path, dict_path):
+        logger = logging.getLogger(__name__)
+
         with tempfile.NamedTemporaryFile(prefix='psdecoder_',
                                          suffix='.log', delete=False) as f:
-            self._logfile = f.name
+            logfile = f.name
+        atexit.register(os.remove, logfile)
 
-        self._logger.debug("Initializing PocketSphinx Decoder with hmm_dir " +
-                           "'%s'", hmm_dir)
+        logger.debug("Initializing PocketSphinx Decoder with hmm_dir '%s'",
+                     hmm_dir)
 
         # Perform some checks on the hmm_dir so that we can display more
         # meaningful error messages if neccessary
         if not os.path.exists(hmm_dir):
             msg = ("hmm_dir '%s' does not exist! Please make sure that you " +
                    "have set the correct hmm_dir in your profile.") % hmm_dir
-            self._logger.error(msg)
+            logger.error(msg)
             raise RuntimeError(msg)
         # Lets check if all required files are there. Refer to:
         # http://cmusphinx.sourceforge.net/wiki/acousticmodelformat
@@ -117,31 +297,24 @@ class PocketSphinxSTT(AbstractSTTEngine):
             # We only need mixture_weights OR sendump
             missing_hmm_files.append('mixture_weights or sendump')
         if missing_hmm_files:
-            self._logger.warning("hmm_dir '%s' is missing files: %s. Please " +
-                                 "make sure that you have set the correct " +
-                                 "hmm_dir in your profile.",
-                                 hmm_dir, ', '.join(missing_hmm_files))
+            logger.warning("hmm_dir '%s' is missing files: %s. Please " +
+                           "make sure that you have set the correct " +
+                           "hmm_dir in your profile.",
+                           hmm_dir, ', '.join(missing_hmm_files))
 
-        lm_path = vocabulary.decoder_kwargs['lm']
-        dict_path = vocabulary.decoder_kwargs['dict']
-
-        self._pocketsphinx_v5 = hasattr(ps.Decoder, 'default_config')
-
-        if self._pocketsphinx_v5:
+        if hasattr(ps.Decoder, 'default_config'):
             # Pocketsphinx v5
             config = ps.Decoder.default_config()
             config.set_string('-hmm', hmm_dir)
             config.set_string('-lm', lm_path)
             config.set_string('-dict', dict_path)
-            config.set_string('-logfn', self._logfile)
-            self._decoder = ps.Decoder(config)
+            config.set_string('-logfn', logfile)
+            decoder = ps.Decoder(config)
         else:
             # Pocketsphinx v4 or sooner
-            self._decoder = ps.Decoder(
-                hmm=hmm_dir, logfn=self._logfile, lm=lm_path, dict=dict_path)
-
-    def __del__(self):
-        os.remove(self._logfile)
+            decoder = ps.Decoder(
+                hmm=hmm_dir, logfn=logfile, lm=lm_path, dict=dict_path)
+        return cls.PooledDecoder(decoder, hmm_dir, logfile)
 
     @classmethod
     def get_config(cls):
@@ -166,34 +339,68 @@ class PocketSphinxSTT(AbstractSTTEngine):
         Performs STT, transcribing an audio file and returning the result.
 
         Arguments:
-            fp -- a file object containing audio data
+            fp -- an AudioSegment or a file object containing WAV data
         """
 
-        fp.seek(44)
+        data = audiosegment.get_segment(fp).raw_data
+        with self._decoder_lock:
+            self._select_search()
+            self._decoder.start_utt()
+            self._decoder.process_raw(data, False, True)
+            self._decoder.end_utt()
+
+            transcribed = self._get_hypothesis()
+            self._log_decoder_output()
+        self._logger.info('Transcribed: %r', transcribed)
+        return transcribed
+
+    @property
+    def supports_streaming(self):
+        return True
+
+    def start_stream(self):
+        # The lock is held until end_stream(), so that no other instance
+        # sharing the decoder can interfere with the utterance
+        self._decoder_lock.acquire()
+        try:
+            self._select_search()
+            self._decoder.start_utt()
+        except Exception:
+            self._decoder_lock.release()
+            raise
+
+    def process_stream(self, data):
+        self._decoder.process_raw(data, False, False)
+        return self._get_hypothesis()
+
+    def end_stream(self):
+        try:
+            self._decoder.end_utt()
+            transcribed = self._get_hypothesis()
+            self._log_decoder_output()
+        finally:
+            self._decoder_lock.release()
+        self._logger.info('Transcribed: %r', transcribed)
+        return transcribed
 
-        # FIXME: Can't use the Decoder.decode_raw() here, because
-        # pocketsphinx segfaults with tempfile.SpooledTemporaryFile()
-        data = fp.read()
-        self._decoder.start_utt()
-        self._decoder.process_raw(data, False, True)
-        self._decoder.end_utt()
+    def _select_search(self):
+        if self._search and self._decoder.get_search() != self._search:
+            self._decoder.set_search(self._search)
 
+    def _get_hypothesis(self):
         if self._pocketsphinx_v5:
             hyp = self._decoder.hyp()
             result = hyp.hypstr if hyp is not None else ''
         else:
             result = self._decoder.get_hyp()[0]
+        return [result] if result else []
 
-        #result = self._decoder.get_hyp()
+    def _log_decoder_output(self):
         with open(self._logfile, 'r+') as f:
             for line in f:
                 self._logger.debug(line.strip())
             f.truncate()
 
-        transcribed = [result] if result != '' else []
-        self._logger.info('Transcribed: %r', transcribed)
-        return transcribed
-
     @classmethod
     def is_available(cls):
         return diagnose.check_python_import('pocketsphinx')
@@ -202,44 +409,91 @@ class PocketSphinxSTT(AbstractSTTEngine):
 class JuliusSTT(AbstractSTTEngine):
     """
     A very basic Speech-to-Text engine using Julius.
+
+    Julius is started once in module mode with adinnet input and kept
+    running, so that the acoustic model is only loaded once. Utterances are
+    streamed to the adinnet port and the results are read from the module
+    port. If the process dies, it will be restarted on the next
+    transcription.
+
+    Every instance runs its own server with its own vocabulary. The
+    configured ports are only the first ones tried, each instance claims
+    the next ports that are neither used by another instance nor by any
+    other process.
     """
 
     SLUG = 'julius'
     VOCABULARY_TYPE = vocabcompiler.JuliusVocabulary
 
+    # Number of bytes sent per adinnet packet
+    ADINNET_CHUNK = 4096
+
+    SHYPO_PATTERN = re.compile(r'<SHYPO RANK="(\d+)"[^>]*>(.*?)</SHYPO>',
+                               re.DOTALL)
+    WHYPO_PATTERN = re.compile(r'<WHYPO WORD="([^"]*)"')
+
+    # Ports used by the Julius servers of all instances in this process
+    _claimed_ports = set()
+    _ports_lock = threading.Lock()
+
     def __init__(self, vocabulary=None, hmmdefs="/usr/share/voxforge/julius/" +
                  "acoustic_model_files/hmmdefs", tiedlist="/usr/share/" +
-                 "voxforge/julius/acoustic_model_files/tiedlist"):
+                 "voxforge/julius/acoustic_model_files/tiedlist",
+                 module_port=10500, adin_port=5530, timeout=10):
         self._logger = logging.getLogger(__name__)
         self._vocabulary = vocabulary
         self._hmmdefs = hmmdefs
         self._tiedlist = tiedlist
-        self._pattern = re.compile(r'sentence(\d+): <s> (.+) </s>')
+        self._proc = None
+        self._module_port = None
+        self._adin_port = None
+        self._module_port = self._claim_port(module_port)
+        self._adin_port = self._claim_port(adin_port)
+        self._timeout = timeout
+        self._logfile = None
+        self._module_sock = None
+        self._module_file = None
+        self._adin_sock = None
+
+        # Start the server right away, so that the first transcription
+        # doesn't have to wait for the acoustic model
+        try:
+            self._start_server()
+        except (OSError, IOError, socket.error):
+            self._logger.error("Couldn't start Julius server, will retry " +
+                               "on first transcription", exc_info=True)
+            self._stop_server()
 
-        # Inital test run: we run this command once to log errors/warnings
-        cmd = ['julius',
-               '-input', 'stdin',
-               '-dfa', self._vocabulary.dfa_file,
-               '-v', self._vocabulary.dict_file,
-               '-h', self._hmmdefs,
-               '-hlist', self._tiedlist,
-               '-forcedict']
-        cmd = [str(x) for x in cmd]
-        self._logger.debug('Executing: %r', cmd)
-        with tempfile.SpooledTemporaryFile() as out_f:
-            with tempfile.SpooledTemporaryFile() as f:
-                with tempfile.SpooledTemporaryFile() as err_f:
-                    subprocess.call(cmd, stdin=f, stdout=out_f, stderr=err_f)
-            out_f.seek(0)
-            for line in out_f.read().splitlines():
-                line = line.strip()
-                if len(line) > 7 and line[:7].upper() == 'ERROR: ':
-                    if not line[7:].startswith('adin_'):
-                        self._logger.error(line[7:])
-                elif len(line) > 9 and line[:9].upper() == 'WARNING: ':
-                    self._logger.warning(line[9:])
-                elif len(line) > 6 and line[:6].upper() == 'STAT: ':
-                    self._logger.debug(line[6:])
+    def __del__(self):
+        self._stop_server()
+        with self._ports_lock:
+            self._claimed_ports.discard(self._module_port)
+            self._claimed_ports.discard(self._adin_port)
+
+    @classmethod
+    def _claim_port(cls, port):
+        """
+        Returns:
+            The first port from port upwards that isn't used by another
+            instance and can be bound
+        """
+        with cls._ports_lock:
+            while port in cls._claimed_ports or not cls._port_free(port):
+                port += 1
+            cls._claimed_ports.add(port)
+            return port
+
+    @staticmethod
+    def _port_free(port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind(('localhost', port))
+        except socket.error:
+            return False
+        finally:
+            sock.close()
+        return True
 
     @classmethod
     def get_config(cls):
@@ -257,13 +511,24 @@ class JuliusSTT(AbstractSTTEngine):
                         config['hmmdefs'] = profile['julius']['hmmdefs']
                     if 'tiedlist' in profile['julius']:
                         config['tiedlist'] = profile['julius']['tiedlist']
+                    if 'module_port' in profile['julius']:
+                        config['module_port'] = \
+                            int(profile['julius']['module_port'])
+                    if 'adin_port' in profile['julius']:
+                        config['adin_port'] = \
+                            int(profile['julius']['adin_port'])
         return config
 
-    def transcribe(self, fp, mode=None):
+    @property
+    def server_running(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def _start_server(self):
         cmd = ['julius',
-               '-quiet',
-               '-nolog',
-               '-input', 'stdin',
+               '-input', 'adinnet',
+               '-adport', self._adin_port,
+               '-module', self._module_port,
+               '-nocutsilence',
                '-dfa', self._vocabulary.dfa_file,
                '-v', self._vocabulary.dict_file,
                '-h', self._hmmdefs,
@@ -271,15 +536,118 @@ class JuliusSTT(AbstractSTTEngine):
                '-forcedict']
         cmd = [str(x) for x in cmd]
         self._logger.debug('Executing: %r', cmd)
-        with tempfile.SpooledTemporaryFile() as out_f:
-            with tempfile.SpooledTemporaryFile() as err_f:
-                subprocess.call(cmd, stdin=fp, stdout=out_f, stderr=err_f)
-            out_f.seek(0)
-            results = [(int(i), text) for i, text in
-                       self._pattern.findall(out_f.read())]
-        transcribed = [text for i, text in
-                       sorted(results, key=lambda x: x[0])
-                       if text]
+        self._logfile = tempfile.TemporaryFile()
+        self._proc = subprocess.Popen(cmd, stdout=self._logfile,
+                                      stderr=subprocess.STDOUT)
+        # Julius waits for the module client first, then for the adinnet
+        # client
+        self._module_sock = self._connect(self._module_port)
+        self._module_file = self._module_sock.makefile('r')
+        self._adin_sock = self._connect(self._adin_port)
+        self._logger.debug('Julius server started with pid %d',
+                           self._proc.pid)
+
+    def _connect(self, port):
+        deadline = time.time() + self._timeout
+        while True:
+            if not self.server_running:
+                self._log_output()
+                raise OSError("Julius exited with status %r" %
+                              self._proc.returncode)
+            try:
+                sock = socket.create_connection(('localhost', port),
+                                                self._timeout)
+            except socket.error:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+            else:
+                return sock
+
+    def _stop_server(self):
+        for obj in (self._module_file, self._module_sock, self._adin_sock):
+            if obj is not None:
+                try:
+                    obj.close()
+                except (IOError, socket.error):
+                    pass
+        self._module_file = self._module_sock = self._adin_sock = None
+        if self._proc is not None:
+            if self._proc.poll() is None:
+                self._proc.terminate()
+                self._proc.wait()
+            self._log_output()
+            self._proc = None
+
+    def _log_output(self):
+        if self._logfile is None:
+            return
+        self._logfile.seek(0)
+        for line in self._logfile.read().splitlines():
+            line = line.strip()
+            if len(line) > 7 and line[:7].upper() == 'ERROR: ':
+                if not line[7:].startswith('adin_'):
+                    self._logger.error(line[7:])
+            elif len(line) > 9 and line[:9].upper() == 'WARNING: ':
+                self._logger.warning(line[9:])
+            elif len(line) > 6 and line[:6].upper() == 'STAT: ':
+                self._logger.debug(line[6:])
+        self._logfile.close()
+        self._logfile = None
+
+    def _send_audio(self, data):
+        # adinnet packets consist of the payload size as 32 bit integer,
+        # followed by the payload. An empty packet ends the utterance.
+        for i in range(0, len(data), self.ADINNET_CHUNK):
+            chunk = data[i:i + self.ADINNET_CHUNK]
+            self._adin_sock.sendall(struct.pack('<i', len(chunk)) + chunk)
+        self._adin_sock.sendall(struct.pack('<i', 0))
+
+    def _receive_result(self):
+        lines = []
+        for line in iter(self._module_file.readline, ''):
+            if line.strip() != '.':
+                lines.append(line)
+                continue
+            message = ''.join(lines)
+            lines = []
+            if '<RECOGOUT>' in message:
+                return self.parse_result(message)
+            elif '<RECOGFAIL' in message or '<REJECTED' in message:
+                return []
+        raise IOError('Julius closed the module connection')
+
+    @classmethod
+    def parse_result(cls, message):
+        """
+        Parses a RECOGOUT message of the Julius module protocol.
+
+        Returns:
+            A list of the recognized sentences, ordered by rank
+        """
+        results = []
+        for rank, shypo in cls.SHYPO_PATTERN.findall(message):
+            words = [word for word in cls.WHYPO_PATTERN.findall(shypo)
+                     if word not in ('<s>', '</s>')]
+            results.append((int(rank), ' '.join(words)))
+        return [text for rank, text in sorted(results) if text]
+
+    def transcribe(self, fp, mode=None):
+        data = audiosegment.get_segment(fp).raw_data
+        transcribed = []
+        for attempt in range(2):
+            try:
+                if not self.server_running:
+                    self._stop_server()
+                    self._start_server()
+                self._send_audio(data)
+                transcribed = self._receive_result()
+            except (OSError, IOError, socket.error):
+                self._logger.warning('Julius server failed, restarting it',
+                                     exc_info=True)
+                self._stop_server()
+            else:
+                break
         if not transcribed:
             transcribed.append('')
         self._logger.info('Transcribed: %r', transcribed)
@@ -392,7 +760,7 @@ class GoogleSTT(AbstractSTTEngine):
         returning an English string.
 
         Arguments:
-        audio_file_path -- the path to the .wav file to be transcribed
+        fp -- an AudioSegment or a file object containing WAV data
         """
 
         if not self.api_key:
@@ -404,12 +772,10 @@ class GoogleSTT(AbstractSTTEngine):
                                   'request aborted.')
             return []
 
-        wav = wave.open(fp, 'rb')
-        frame_rate = wav.getframerate()
-        wav.close()
-        data = fp.read()
+        audio = audiosegment.get_segment(fp)
+        data = audio.raw_data
 
-        headers = {'content-type': 'audio/l16; rate=%s' % frame_rate}
+        headers = {'content-type': 'audio/l16; rate=%s' % audio.rate}
         r = self._http.post(self.request_url, data=data, headers=headers)
         try:
             r.raise_for_status()
@@ -503,7 +869,7 @@ class AttSTT(AbstractSTTEngine):
         return self._token
 
     def transcribe(self, fp):
-        data = fp.read()
+        data = self._get_wav_data(fp)
         r = self._get_response(data)
         if r.status_code == requests.codes['unauthorized']:
             # Request token invalid, retry once with a new token
@@ -607,7 +973,7 @@ class WitAiSTT(AbstractSTTEngine):
         return self._headers
 
     def transcribe(self, fp):
-        data = fp.read()
+        data = self._get_wav_data(fp)
         r = requests.post('https://api.wit.ai/speech?v=20150101',
                           data=data,
                           headers=self.headers)
@@ -642,6 +1008,146 @@ class WitAiSTT(AbstractSTTEngine):
         return diagnose.check_network_connection()
 
 
+class EnsembleSTT(AbstractSTTEngine):
+    """
+    Composite Speech-To-Text engine that runs several engines concurrently
+    on the same audio.
+
+    With the 'first' strategy, the first non-empty result of any engine is
+    returned, so latency is bounded by the fastest engine that understood
+    something. With the 'merge' strategy, the n-best lists of all engines
+    that answered within the timeout are merged, ranking transcriptions
+    that several engines agree on first.
+
+    Excerpt from sample profile.yml:
+
+        ...
+        stt_engine: ensemble
+        ensemble:
+          engines:
+            - sphinx
+            - google
+          strategy: first
+          timeout: 5
+    """
+
+    SLUG = 'ensemble'
+
+    def __init__(self, engines, strategy='first', timeout=10):
+        """
+        Arguments:
+            engines -- a list of STT engine instances
+            strategy -- (optional) 'first' or 'merge' (Default: 'first')
+            timeout -- (optional) seconds to wait for the engines
+                       (Default: 10)
+        """
+        self._logger = logging.getLogger(__name__)
+        if strategy not in ('first', 'merge'):
+            raise ValueError("Unknown ensemble strategy '%s'" % strategy)
+        if not engines:
+            raise ValueError("Ensemble needs at least one STT engine")
+        self.engines = engines
+        self.strategy = strategy
+        self.timeout = timeout
+        self._executor = futures.ThreadPoolExecutor(max_workers=len(engines))
+        # The last job of every engine. Engines that are still busy with an
+        # earlier transcription are skipped, so that a hanging engine can't
+        # occupy more than one worker thread.
+        self._jobs = {}
+
+    @classmethod
+    def get_config(cls):
+        # FIXME: Replace this as soon as we have a config module
+        config = {}
+        profile_path = jasperpath.config('profile.yml')
+        if os.path.exists(profile_path):
+            with open(profile_path, 'r') as f:
+                profile = yaml.safe_load(f)
+                if 'ensemble' in profile:
+                    if 'engines' in profile['ensemble']:
+                        config['engines'] = profile['ensemble']['engines']
+                    if 'strategy' in profile['ensemble']:
+                        config['strategy'] = profile['ensemble']['strategy']
+                    if 'timeout' in profile['ensemble']:
+                        config['timeout'] = \
+                            float(profile['ensemble']['timeout'])
+        return config
+
+    @classmethod
+    def get_instance(cls, vocabulary_name, phrases):
+        config = cls.get_config()
+        slugs = [slug for slug in config.pop('engines', [])
+                 if slug != cls.SLUG]
+        engines = [get_engine_by_slug(slug).get_instance(vocabulary_name,
+                                                         phrases)
+                   for slug in slugs]
+        return cls(engines, **config)
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    @staticmethod
+    def merge_results(results):
+        """
+        Merges n-best lists. Every transcription scores 1/rank for every
+        list it appears in, ties keep the order of the lists.
+
+        Arguments:
+            results -- a list of transcription lists
+
+        Returns:
+            A single list of transcriptions, best first
+        """
+        scores = {}
+        order = []
+        for result in results:
+            for rank, text in enumerate(filter(None, result), start=1):
+                if text not in scores:
+                    scores[text] = 0.0
+                    order.append(text)
+                scores[text] += 1.0 / rank
+        return sorted(order, key=lambda text: scores[text], reverse=True)
+
+    def _transcribe(self, engine, audio):
+        try:
+            # Some engines (e.g. Julius) return [''] if they didn't
+            # understand anything
+            return [text for text in engine.transcribe(audio) if text]
+        except Exception:
+            self._logger.error("STT engine '%s' failed", engine.SLUG,
+                               exc_info=True)
+            return []
+
+    def transcribe(self, fp):
+        audio = audiosegment.get_segment(fp)
+        jobs = []
+        for engine in self.engines:
+            job = self._jobs.get(engine)
+            if job is not None and not job.done():
+                self._logger.warning("STT engine '%s' is still busy, " +
+                                     "skipping it", engine.SLUG)
+                continue
+            job = self._executor.submit(self._transcribe, engine, audio)
+            self._jobs[engine] = job
+            jobs.append(job)
+        results = []
+        try:
+            for job in futures.as_completed(jobs, timeout=self.timeout):
+                result = job.result()
+                if result and self.strategy == 'first':
+                    self._logger.info('Transcribed: %r', result)
+                    return result
+                results.append((jobs.index(job), result))
+        except futures.TimeoutError:
+            self._logger.warning('Not all STT engines answered within %s ' +
+                                 'seconds', self.timeout)
+        transcribed = self.merge_results(result for i, result in
+                                         sorted(results))
+        self._logger.info('Transcribed: %r', transcribed)
+        return transcribed
+
+
 def get_engine_by_slug(slug=None):
     """
     Returns:
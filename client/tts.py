@@ -4,17 +4,22 @@ A Speaker handles audio output from Jasper to the user
 
 Speaker methods:
     say - output 'phrase' as speech
+    get_speech - synthesize 'phrase' into an audio file
     play - play the audio in 'filename'
     is_available - returns True if the platform supports this implementation
 """
 import os
+import io
+import sys
 import platform
 import re
 import tempfile
+import threading
+import Queue
 import subprocess
 import pipes
+import shutil
 import logging
-import wave
 import urllib
 import urlparse
 import requests
@@ -40,6 +45,41 @@ except ImportError:
 
 import diagnose
 import jasperpath
+import ttscache
+
+# Sentences end with punctuation (and maybe a closing quote) that is
+# followed by the next sentence's capital letter or number
+SENTENCE_BOUNDARY = re.compile(r'(?:(?<=[.!?])|(?<=[.!?]["\')]))\s+' +
+                               r'(?=["\'(]?[A-Z0-9])')
+
+# Periods after single letters (initials, e.g., p.m.) and common
+# abbreviations don't end a sentence
+ABBREVIATION = re.compile(r'(?:^|[\s.(])' +
+                          r'(?:[a-z]|mrs?|ms|dr|prof|[sj]r|st|mt|vs)\.$',
+                          re.IGNORECASE)
+
+
+def split_sentences(text):
+    """
+    Splits a text into sentences, which are synthesized one at a time when
+    the engine is pipelined.
+
+    Arguments:
+        text -- the text to split
+
+    Returns:
+        A list of non-empty sentences
+    """
+    text = text.strip()
+    sentences = []
+    start = 0
+    for boundary in SENTENCE_BOUNDARY.finditer(text):
+        candidate = text[start:boundary.start()]
+        if not ABBREVIATION.search(candidate):
+            sentences.append(candidate)
+            start = boundary.end()
+    sentences.append(text[start:])
+    return [sentence for sentence in sentences if sentence]
 
 
 class AbstractTTSEngine(object):
@@ -48,6 +88,10 @@ class AbstractTTSEngine(object):
     """
     __metaclass__ = ABCMeta
 
+    # The audioplayer.PyAudioPlayer used for playback. If None, audio is
+    # played with aplay.
+    player = None
+
     @classmethod
     def get_config(cls):
         return {}
@@ -71,6 +115,14 @@ class AbstractTTSEngine(object):
         pass
 
     def play(self, filename):
+        if self.player is not None:
+            self._logger.debug("Playing '%s'", filename)
+            try:
+                self.player.play(filename)
+                return
+            except IOError:
+                self._logger.warning("Playback through PyAudio failed, " +
+                                     "falling back to aplay", exc_info=True)
         # FIXME: Use platform-independent audio-output here
         # See issue jasperproject/jasper-client#188
         cmd = ['aplay', '-D', 'plughw:1,0', str(filename)]
@@ -84,29 +136,219 @@ class AbstractTTSEngine(object):
                 self._logger.debug("Output was: '%s'", output)
 
 
-class AbstractMp3TTSEngine(AbstractTTSEngine):
+class AbstractSynthesizingTTSEngine(AbstractTTSEngine):
     """
-    Generic class that implements the 'play' method for mp3 files
+    Generic class for speakers that synthesize phrases into audio files
+    with get_speech(). Synthesized phrases are cached, and long phrases are
+    synthesized sentence by sentence.
+    """
+
+    # The TTSCache synthesized phrases are stored in, if any
+    cache = None
+
+    # Synthesize long phrases sentence by sentence while the previous
+    # sentence is playing
+    pipelined = True
+
+    @classmethod
+    def get_instance(cls):
+        instance = super(AbstractSynthesizingTTSEngine, cls).get_instance()
+        instance.cache = ttscache.TTSCache.get_instance()
+        return instance
+
+    @property
+    def voice_settings(self):
+        """
+        Returns:
+            A dict of all settings that affect the synthesized audio. Used
+            as part of the cache key.
+        """
+        return dict((name, value) for name, value in vars(self).items()
+                    if not name.startswith('_') and
+                    isinstance(value, (basestring, int, long, float, bool)))
+
+    @abstractmethod
+    def get_speech(self, phrase):
+        """
+        Synthesizes a phrase.
+
+        Arguments:
+            phrase -- the phrase to synthesize
+
+        Returns:
+            The path of a newly created audio file that the caller has to
+            remove
+        """
+        pass
+
+    def play_speech(self, filename):
+        """
+        Plays an audio file returned by get_speech().
+        """
+        self.play(filename)
+
+    def say(self, phrase):
+        self._logger.debug("Saying '%s' with '%s'", phrase, self.SLUG)
+        sentences = split_sentences(phrase) if self.pipelined else []
+        if len(sentences) > 1:
+            self._say_pipelined(sentences)
+        else:
+            self._play_synthesized(*self._synthesize(phrase))
+
+    def _synthesize(self, phrase):
+        """
+        Returns:
+            A tuple (speech, temporary), where speech is passed to
+            play_speech(). If temporary is True, speech is a file that has
+            to be removed after playback.
+        """
+        if self.cache is None:
+            return (self.get_speech(phrase), True)
+        key = self.cache.get_key(self.SLUG, self.voice_settings, phrase)
+        filename = self.cache.get(key)
+        if filename is None:
+            filename = self.cache.put(key, self.get_speech(phrase))
+        else:
+            self._logger.debug("Using cached speech for '%s'", phrase)
+        return (filename, False)
+
+    def _play_synthesized(self, speech, temporary):
+        try:
+            self.play_speech(speech)
+        finally:
+            if temporary:
+                os.remove(speech)
+
+    def _say_pipelined(self, sentences):
+        """
+        Plays the sentences in order while a worker thread synthesizes the
+        following sentence.
+        """
+        results = Queue.Queue(maxsize=1)
+        stop = threading.Event()
+
+        def discard(speech):
+            if speech is not None and speech[1]:
+                os.remove(speech[0])
+
+        def synthesize():
+            for sentence in sentences:
+                try:
+                    item = (self._synthesize(sentence), None)
+                except Exception:
+                    item = (None, sys.exc_info())
+                while not stop.is_set():
+                    try:
+                        results.put(item, timeout=0.1)
+                        break
+                    except Queue.Full:
+                        pass
+                else:
+                    discard(item[0])
+                    return
+                if item[1] is not None:
+                    return
+
+        worker = threading.Thread(target=synthesize, name='TTSPipeline')
+        worker.daemon = True
+        worker.start()
+        try:
+            for sentence in sentences:
+                speech, exc_info = results.get()
+                if exc_info is not None:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                self._play_synthesized(*speech)
+        finally:
+            stop.set()
+            worker.join()
+            while not results.empty():
+                discard(results.get_nowait()[0])
+
+
+class AbstractMp3TTSEngine(AbstractSynthesizingTTSEngine):
+    """
+    Generic class that implements the 'play' method for mp3 files.
+
+    Subclasses implement get_mp3(). Without a cache, the MP3 data is kept in
+    memory and decoded frame by frame while it is played.
     """
     @classmethod
     def is_available(cls):
         return (super(AbstractMp3TTSEngine, cls).is_available() and
                 diagnose.check_python_import('mad'))
 
-    def play_mp3(self, filename):
-        mf = mad.MadFile(filename)
-        with tempfile.NamedTemporaryFile(suffix='.wav') as f:
-            wav = wave.open(f, mode='wb')
-            wav.setframerate(mf.samplerate())
-            wav.setnchannels(1 if mf.mode() == mad.MODE_SINGLE_CHANNEL else 2)
-            # 4L is the sample width of 32 bit audio
-            wav.setsampwidth(4L)
+    @abstractmethod
+    def get_mp3(self, phrase):
+        """
+        Synthesizes a phrase.
+
+        Returns:
+            A file object containing the MP3 data, positioned at its
+            beginning
+        """
+        pass
+
+    def get_speech(self, phrase):
+        with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as f:
+            shutil.copyfileobj(self.get_mp3(phrase), f)
+        return f.name
+
+    def _synthesize(self, phrase):
+        if self.cache is None:
+            return (self.get_mp3(phrase), False)
+        return super(AbstractMp3TTSEngine, self)._synthesize(phrase)
+
+    def play_speech(self, speech):
+        self.play_mp3(speech)
+
+    @staticmethod
+    def decode_mp3(mf):
+        """
+        Yields the decoded PCM frames of a mad.MadFile. libmad always
+        outputs 16 bit stereo audio.
+        """
+        frame = mf.read()
+        while frame is not None:
+            yield frame
             frame = mf.read()
-            while frame is not None:
-                wav.writeframes(frame)
-                frame = mf.read()
-            wav.close()
-            self.play(f.name)
+
+    def play_mp3(self, mp3):
+        """
+        Plays MP3 data while it is being decoded.
+
+        Arguments:
+            mp3 -- the name of an MP3 file or a file object
+        """
+        mf = mad.MadFile(mp3)
+        frames = self.decode_mp3(mf)
+        if self.player is not None:
+            try:
+                self.player.play_chunks(frames, 2, 2, mf.samplerate())
+                return
+            except IOError:
+                self._logger.warning("Playback through PyAudio failed, " +
+                                     "falling back to aplay", exc_info=True)
+            if hasattr(mp3, 'seek'):
+                mp3.seek(0)
+            mf = mad.MadFile(mp3)
+            frames = self.decode_mp3(mf)
+        cmd = ['aplay', '-D', 'plughw:1,0', '-t', 'raw', '-f', 'S16_LE',
+               '-c', '2', '-r', str(mf.samplerate()), '-']
+        self._logger.debug('Executing %s', ' '.join([pipes.quote(arg)
+                                                     for arg in cmd]))
+        with tempfile.TemporaryFile() as f:
+            proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=f,
+                                    stderr=f)
+            try:
+                for frame in frames:
+                    proc.stdin.write(frame)
+            finally:
+                proc.stdin.close()
+                proc.wait()
+            f.seek(0)
+            output = f.read()
+            if output:
+                self._logger.debug("Output was: '%s'", output)
 
 
 class DummyTTS(AbstractTTSEngine):
@@ -129,7 +371,7 @@ class DummyTTS(AbstractTTSEngine):
         pass
 
 
-class EspeakTTS(AbstractTTSEngine):
+class EspeakTTS(AbstractSynthesizingTTSEngine):
     """
     Uses the eSpeak speech synthesizer included in the Jasper disk image
     Requires espeak to be available
@@ -170,8 +412,7 @@ class EspeakTTS(AbstractTTSEngine):
         return (super(cls, cls).is_available() and
                 diagnose.check_executable('espeak'))
 
-    def say(self, phrase):
-        self._logger.debug("Saying '%s' with '%s'", phrase, self.SLUG)
+    def get_speech(self, phrase):
         with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as f:
             fname = f.name
         cmd = ['espeak', '-v', self.voice,
@@ -188,11 +429,10 @@ class EspeakTTS(AbstractTTSEngine):
             output = f.read()
             if output:
                 self._logger.debug("Output was: '%s'", output)
-        self.play(fname)
-        os.remove(fname)
+        return fname
 
 
-class FestivalTTS(AbstractTTSEngine):
+class FestivalTTS(AbstractSynthesizingTTSEngine):
     """
     Uses the festival speech synthesizer
     Requires festival (text2wave) to be available
@@ -221,10 +461,10 @@ class FestivalTTS(AbstractTTSEngine):
                     return ('No default voice found' not in output)
         return False
 
-    def say(self, phrase):
-        self._logger.debug("Saying '%s' with '%s'", phrase, self.SLUG)
+    def get_speech(self, phrase):
         cmd = ['text2wave']
-        with tempfile.NamedTemporaryFile(suffix='.wav') as out_f:
+        with tempfile.NamedTemporaryFile(suffix='.wav',
+                                         delete=False) as out_f:
             with tempfile.SpooledTemporaryFile() as in_f:
                 in_f.write(phrase)
                 in_f.seek(0)
@@ -238,10 +478,10 @@ class FestivalTTS(AbstractTTSEngine):
                     output = err_f.read()
                     if output:
                         self._logger.debug("Output was: '%s'", output)
-            self.play(out_f.name)
+        return out_f.name
 
 
-class FliteTTS(AbstractTTSEngine):
+class FliteTTS(AbstractSynthesizingTTSEngine):
     """
     Uses the flite speech synthesizer
     Requires flite to be available
@@ -287,8 +527,7 @@ class FliteTTS(AbstractTTSEngine):
                 diagnose.check_executable('flite') and
                 len(cls.get_voices()) > 0)
 
-    def say(self, phrase):
-        self._logger.debug("Saying '%s' with '%s'", phrase, self.SLUG)
+    def get_speech(self, phrase):
         cmd = ['flite']
         if self.voice:
             cmd.extend(['-voice', self.voice])
@@ -305,8 +544,7 @@ class FliteTTS(AbstractTTSEngine):
             output = out_f.read().strip()
         if output:
             self._logger.debug("Output was: '%s'", output)
-        self.play(fname)
-        os.remove(fname)
+        return fname
 
 
 class MacOSXTTS(AbstractTTSEngine):
@@ -346,7 +584,7 @@ class MacOSXTTS(AbstractTTSEngine):
                 self._logger.debug("Output was: '%s'", output)
 
 
-class PicoTTS(AbstractTTSEngine):
+class PicoTTS(AbstractSynthesizingTTSEngine):
     """
     Uses the svox-pico-tts speech synthesizer
     Requires pico2wave to be available
@@ -395,14 +633,13 @@ class PicoTTS(AbstractTTSEngine):
         langs = matchobj.group(1).split()
         return langs
 
-    def say(self, phrase):
-        self._logger.debug("Saying '%s' with '%s'", phrase, self.SLUG)
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as f:
-            fname = f.name
-        cmd = ['pico2wave', '--wave', fname]
+    def get_speech(self, phrase):
         if self.language not in self.languages:
                 raise ValueError("Language '%s' not supported by '%s'",
                                  self.language, self.SLUG)
+        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as f:
+            fname = f.name
+        cmd = ['pico2wave', '--wave', fname]
         cmd.extend(['-l', self.language])
         cmd.append(phrase)
         self._logger.debug('Executing %s', ' '.join([pipes.quote(arg)
@@ -413,8 +650,7 @@ class PicoTTS(AbstractTTSEngine):
             output = f.read()
             if output:
                 self._logger.debug("Output was: '%s'", output)
-        self.play(fname)
-        os.remove(fname)
+        return fname
 
 
 class GoogleTTS(AbstractMp3TTSEngine):
@@ -460,20 +696,18 @@ class GoogleTTS(AbstractMp3TTSEngine):
                  'th', 'tr', 'vi', 'cy']
         return langs
 
-    def say(self, phrase):
-        self._logger.debug("Saying '%s' with '%s'", phrase, self.SLUG)
+    def get_mp3(self, phrase):
         if self.language not in self.languages:
             raise ValueError("Language '%s' not supported by '%s'",
                              self.language, self.SLUG)
         tts = gtts.gTTS(text=phrase, lang=self.language)
-        with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as f:
-            tmpfile = f.name
-        tts.save(tmpfile)
-        self.play_mp3(tmpfile)
-        os.remove(tmpfile)
+        f = io.BytesIO()
+        tts.write_to_fp(f)
+        f.seek(0)
+        return f
 
 
-class MaryTTS(AbstractTTSEngine):
+class MaryTTS(AbstractSynthesizingTTSEngine):
     """
     Uses the MARY Text-to-Speech System (MaryTTS)
     MaryTTS is an open-source, multilingual Text-to-Speech Synthesis platform
@@ -544,8 +778,7 @@ class MaryTTS(AbstractTTSEngine):
         urlparts = ('http', self.netloc, path, query_s, '')
         return urlparse.urlunsplit(urlparts)
 
-    def say(self, phrase):
-        self._logger.debug("Saying '%s' with '%s'", phrase, self.SLUG)
+    def get_speech(self, phrase):
         if self.language not in self.languages:
             raise ValueError("Language '%s' not supported by '%s'"
                              % (self.language, self.SLUG))
@@ -561,11 +794,11 @@ class MaryTTS(AbstractTTSEngine):
                  'VOICE': self.voice}
 
         r = self.session.get(self._makeurl('/process', query=query))
+        r.raise_for_status()
         with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as f:
             f.write(r.content)
             tmpfile = f.name
-        self.play(tmpfile)
-        os.remove(tmpfile)
+        return tmpfile
 
 
 class IvonaTTS(AbstractMp3TTSEngine):
@@ -626,13 +859,20 @@ class IvonaTTS(AbstractMp3TTSEngine):
                 diagnose.check_python_import('pyvona') and
                 diagnose.check_network_connection())
 
-    def say(self, phrase):
-        self._logger.debug("Saying '%s' with '%s'", phrase, self.SLUG)
-        with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as f:
-            tmpfile = f.name
-        self._pyvonavoice.fetch_voice(phrase, tmpfile)
-        self.play_mp3(tmpfile)
-        os.remove(tmpfile)
+    @property
+    def voice_settings(self):
+        voice = self._pyvonavoice
+        return {'region': voice.region,
+                'voice_name': voice.voice_name,
+                'speech_rate': voice.speech_rate,
+                'sentence_break': voice.sentence_break,
+                'codec': voice.codec}
+
+    def get_mp3(self, phrase):
+        f = io.BytesIO()
+        self._pyvonavoice.fetch_voice_fp(phrase, f)
+        f.seek(0)
+        return f
 
 
 def get_default_engine_slug():
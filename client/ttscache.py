@@ -0,0 +1,186 @@
+# -*- coding: utf-8-*-
+"""
+Content-addressed on-disk cache for synthesized speech.
+
+Every cached file is named after the SHA-1 hash of the TTS engine slug, its
+voice settings and the phrase, so the same phrase spoken with the same voice
+is only synthesized once. When the total size of the cache exceeds its
+limit, the least recently used files are removed.
+"""
+import os
+import shutil
+import hashlib
+import logging
+import threading
+import collections
+
+import yaml
+
+import jasperpath
+
+
+class TTSCache(object):
+    """
+    Size-bounded LRU cache of audio files.
+    """
+
+    def __init__(self, directory=None, max_size=50 * 1024 * 1024):
+        """
+        Arguments:
+            directory -- (optional) the cache directory
+                         (Default: <config dir>/tts-cache)
+            max_size -- (optional) the maximum total size of all cached
+                        files in bytes (Default: 50 MB)
+        """
+        self._logger = logging.getLogger(__name__)
+        self.directory = (directory if directory is not None
+                          else jasperpath.config('tts-cache'))
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # Maps keys to (filename, size), least recently used first
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._load()
+
+    @classmethod
+    def get_config(cls):
+        # FIXME: Replace this as soon as we have a config module
+        config = {}
+        profile_path = jasperpath.config('profile.yml')
+        if os.path.exists(profile_path):
+            with open(profile_path, 'r') as f:
+                profile = yaml.safe_load(f)
+                if 'tts-cache' in profile:
+                    if 'enabled' in profile['tts-cache']:
+                        config['enabled'] = profile['tts-cache']['enabled']
+                    if 'max_size' in profile['tts-cache']:
+                        # The profile specifies the size in megabytes
+                        config['max_size'] = int(
+                            profile['tts-cache']['max_size'] * 1024 * 1024)
+        return config
+
+    @classmethod
+    def get_instance(cls):
+        """
+        Returns:
+            A TTSCache configured by the profile, or None if the cache has
+            been disabled
+        """
+        config = cls.get_config()
+        if not config.pop('enabled', True):
+            return None
+        return cls(**config)
+
+    @staticmethod
+    def get_key(slug, settings, phrase):
+        """
+        Arguments:
+            slug -- the SLUG of the TTS engine
+            settings -- a dict of voice settings that affect the output
+            phrase -- the phrase after alteration.clean()
+
+        Returns:
+            The cache key for the phrase
+        """
+        if isinstance(phrase, unicode):
+            phrase = phrase.encode('utf-8')
+        h = hashlib.sha1()
+        h.update(slug)
+        for name, value in sorted(settings.items()):
+            h.update('\0%s=%r' % (name, value))
+        h.update('\0\0')
+        h.update(phrase)
+        return h.hexdigest()
+
+    @property
+    def size(self):
+        with self._lock:
+            return self._size
+
+    def _load(self):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        files = []
+        for fname in os.listdir(self.directory):
+            path = os.path.join(self.directory, fname)
+            key, ext = os.path.splitext(fname)
+            if ext == '.tmp' or not os.path.isfile(path):
+                continue
+            st = os.stat(path)
+            files.append((st.st_mtime, key, path, st.st_size))
+        for mtime, key, path, size in sorted(files):
+            self._entries[key] = (path, size)
+            self._size += size
+        self._logger.debug("Loaded %d cached phrases (%d bytes) from '%s'",
+                           len(self._entries), self._size, self.directory)
+
+    def get(self, key):
+        """
+        Looks up a cached file and marks it as recently used.
+
+        Returns:
+            The path of the cached file, or None if it isn't cached
+        """
+        with self._lock:
+            if key not in self._entries:
+                return None
+            path, size = self._entries.pop(key)
+            if not os.path.exists(path):
+                self._size -= size
+                return None
+            self._entries[key] = (path, size)
+        try:
+            # Keep the LRU order across restarts
+            os.utime(path, None)
+        except OSError:
+            pass
+        return path
+
+    def put(self, key, filename):
+        """
+        Moves a synthesized file into the cache and evicts the least
+        recently used files if the cache has grown too large.
+
+        Arguments:
+            key -- the cache key, see get_key()
+            filename -- the file to move into the cache
+
+        Returns:
+            The path of the cached file
+        """
+        path = os.path.join(self.directory,
+                            key + os.path.splitext(filename)[1])
+        shutil.move(filename, path + '.tmp')
+        os.rename(path + '.tmp', path)
+        size = os.path.getsize(path)
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            self._entries[key] = (path, size)
+            self._size += size
+            evicted = []
+            while self._size > self.max_size and len(self._entries) > 1:
+                old_path, old_size = self._entries.popitem(last=False)[1]
+                self._size -= old_size
+                evicted.append(old_path)
+        for old_path in evicted:
+            self._logger.debug("Evicting '%s' from TTS cache", old_path)
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+        return path
+
+    def clear(self):
+        """
+        Removes all cached files.
+        """
+        with self._lock:
+            paths = [path for path, size in self._entries.values()]
+            self._entries.clear()
+            self._size = 0
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,202 @@
+# -*- coding: utf-8-*-
+"""
+Frame-level voice activity detection for captured audio.
+
+All functions work on NumPy int16 views of the raw 16 bit mono chunks, so
+no per-sample Python code runs for a chunk.
+"""
+import numpy
+
+# Highest zero-crossing rate (crossings per sample) that still counts as
+# speech. White noise is at about 0.5, speech usually stays well below.
+MAX_ZERO_CROSSING_RATE = 0.5
+
+
+def samples(data):
+    """
+    Returns a NumPy int16 view of a chunk of raw audio data without copying
+    it.
+    """
+    return numpy.frombuffer(data, dtype=numpy.int16)
+
+
+def score(data):
+    """
+    Calculates the loudness score (a third of the RMS) of a chunk of 16 bit
+    mono audio data.
+
+    Arguments:
+        data -- a chunk of raw audio data
+
+    Returns:
+        The score of the chunk
+    """
+    values = samples(data).astype(numpy.float64)
+    if not len(values):
+        return 0.0
+    return numpy.sqrt(numpy.dot(values, values) / len(values)) / 3
+
+
+def zero_crossing_rate(data):
+    """
+    Calculates the zero-crossing rate of a chunk of 16 bit mono audio data.
+
+    Arguments:
+        data -- a chunk of raw audio data
+
+    Returns:
+        The number of sign changes per sample
+    """
+    signs = numpy.signbit(samples(data))
+    if len(signs) < 2:
+        return 0.0
+    return numpy.count_nonzero(signs[1:] != signs[:-1]) / float(len(signs))
+
+
+class SlidingAverage(object):
+    """
+    Average over the last values, updated in constant time per value.
+    """
+
+    def __init__(self, size, initial=0.0):
+        """
+        Arguments:
+            size -- the number of values to average over
+            initial -- (optional) the value the window is filled with
+                       initially (Default: 0.0)
+        """
+        self._values = numpy.empty(size, dtype=numpy.float64)
+        self._values.fill(initial)
+        self._sum = float(initial) * size
+        self._index = 0
+
+    @property
+    def value(self):
+        return self._sum / len(self._values)
+
+    def update(self, value):
+        """
+        Adds a value to the window, replacing the oldest one.
+
+        Returns:
+            The new average
+        """
+        self._sum += value - self._values[self._index]
+        self._values[self._index] = value
+        self._index = (self._index + 1) % len(self._values)
+        return self.value
+
+
+class VoiceActivityDetector(object):
+    """
+    Decides for every chunk whether speech starts or has ended, relative to
+    a disturbance threshold.
+    """
+
+    def __init__(self, threshold, window=30, end_factor=0.8,
+                 initial_factor=1.2, max_zcr=MAX_ZERO_CROSSING_RATE):
+        """
+        Arguments:
+            threshold -- the score above which a chunk is a disturbance
+            window -- (optional) number of chunks the end-of-speech average
+                      is calculated over. Increasing it results in a longer
+                      pause after a command (Default: 30)
+            end_factor -- (optional) speech has ended when the average score
+                          falls below threshold * end_factor (Default: 0.8)
+            initial_factor -- (optional) the average window is initially
+                              filled with threshold * initial_factor
+                              (Default: 1.2)
+            max_zcr -- (optional) chunks with a higher zero-crossing rate
+                       are considered noise (Default: 0.5)
+        """
+        self.threshold = threshold
+        self.end_factor = end_factor
+        self.max_zcr = max_zcr
+        self._average = SlidingAverage(window, threshold * initial_factor)
+
+    def is_speech(self, data):
+        """
+        Returns:
+            True if the chunk is loud enough and sounds like speech
+        """
+        return (score(data) > self.threshold and
+                zero_crossing_rate(data) <= self.max_zcr)
+
+    def is_silence(self, data):
+        """
+        Adds the chunk to the sliding window.
+
+        Returns:
+            True if the average score over the window indicates that the
+            speaker has stopped talking
+        """
+        average = self._average.update(score(data))
+        return average < self.threshold * self.end_factor
+
+
+class NoiseFloor(object):
+    """
+    Continuously updated estimate of the background noise level.
+
+    The estimate is an exponential moving average of chunk scores that
+    follows quiet chunks quickly and loud chunks slowly, so that speech
+    doesn't drag the noise floor up while it still adapts to permanent
+    changes of the background noise.
+    """
+
+    def __init__(self, multiplier=1.8, fall_rate=0.1, rise_rate=0.01,
+                 speech_rate=0.001, warmup=15):
+        """
+        Arguments:
+            multiplier -- (optional) factor between noise floor and the
+                          threshold for a disturbance (Default: 1.8)
+            fall_rate -- (optional) smoothing factor for chunks below the
+                         current level (Default: 0.1)
+            rise_rate -- (optional) smoothing factor for chunks above the
+                         current level but below the threshold
+                         (Default: 0.01)
+            speech_rate -- (optional) smoothing factor for chunks above the
+                           threshold (Default: 0.001)
+            warmup -- (optional) number of chunks that are simply averaged
+                      before the estimate is considered ready (Default: 15)
+        """
+        self.multiplier = multiplier
+        self.fall_rate = fall_rate
+        self.rise_rate = rise_rate
+        self.speech_rate = speech_rate
+        self.warmup = warmup
+        self.level = 0.0
+        self.count = 0
+
+    @property
+    def ready(self):
+        """
+        Returns:
+            True if enough chunks have been seen to use the estimate
+        """
+        return self.count >= self.warmup
+
+    @property
+    def threshold(self):
+        """
+        Returns:
+            The score above which a chunk counts as a disturbance
+        """
+        return self.level * self.multiplier
+
+    def update(self, value):
+        """
+        Updates the estimate with the score of a new chunk.
+
+        Arguments:
+            value -- the score of the chunk
+        """
+        if self.count < self.warmup:
+            self.level += (value - self.level) / (self.count + 1)
+        elif value < self.level:
+            self.level += self.fall_rate * (value - self.level)
+        elif value < self.threshold:
+            self.level += self.rise_rate * (value - self.level)
+        else:
+            self.level += self.speech_rate * (value - self.level)
+        self.count += 1
@@ -13,19 +13,19 @@ import tarfile
 import re
 import contextlib
 import shutil
+import struct
+import mmap
+import fcntl
+import time
+import multiprocessing
 from abc import ABCMeta, abstractmethod, abstractproperty
 import yaml
 
 import brain
 import jasperpath
+import languagemodel
 
-from g2p import PhonetisaurusG2P
-try:
-    import cmuclmtk
-except ImportError:
-    logging.getLogger(__name__).error("Error importing CMUCLMTK module. " +
-                                      "PocketsphinxVocabulary will not work " +
-                                      "correctly.", exc_info=True)
+from g2p import PhonetisaurusG2P, PronunciationCache
 
 
 class AbstractVocabulary(object):
@@ -75,6 +75,28 @@ class AbstractVocabulary(object):
         """
         return os.path.join(self.path, 'revision')
 
+    @property
+    def lock_file(self):
+        """
+        Returns:
+            The path of the the lock file as string
+        """
+        return os.path.join(self.path, 'compile.lock')
+
+    @contextlib.contextmanager
+    def lock(self):
+        """
+        Context manager that holds an exclusive lock on this vocabulary, so
+        that it isn't compiled by several processes at the same time. The
+        vocabulary directory has to exist.
+        """
+        with open(self.lock_file, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
     @abstractproperty
     def is_compiled(self):
         """
@@ -150,6 +172,15 @@ class AbstractVocabulary(object):
                 self._logger.error("Couldn't create vocabulary dir '%s'",
                                    self.path, exc_info=True)
                 raise
+        with self.lock():
+            if not force and self.compiled_revision == revision:
+                self._logger.debug('Compilation not neccessary, vocabulary ' +
+                                   'has been compiled by another process.')
+                return revision
+            self._compile_locked(phrases, revision)
+        return revision
+
+    def _compile_locked(self, phrases, revision):
         try:
             with open(self.revision_file, 'w') as f:
                 f.write(revision)
@@ -171,7 +202,6 @@ class AbstractVocabulary(object):
                 raise e
             else:
                 self._logger.info('Compilation done.')
-        return revision
 
     @abstractmethod
     def _compile_vocabulary(self, phrases):
@@ -256,6 +286,15 @@ class PocketsphinxVocabulary(AbstractVocabulary):
         """
         return {'lm': self.languagemodel_file, 'dict': self.dictionary_file}
 
+    @property
+    def pronunciation_cache_dir(self):
+        """
+        Returns:
+            The path of the directory that contains the pronunciation caches
+            shared by all pocketsphinx vocabularies
+        """
+        return os.path.join(os.path.dirname(self.path), '.pronunciations')
+
     def _compile_vocabulary(self, phrases):
         """
         Compiles the vocabulary to the Pocketsphinx format by creating a
@@ -264,47 +303,26 @@ class PocketsphinxVocabulary(AbstractVocabulary):
         Arguments:
             phrases -- a list of phrases that this vocabulary will contain
         """
-        text = " ".join([("<s> %s </s>" % phrase) for phrase in phrases])
         self._logger.debug('Compiling languagemodel...')
-        vocabulary = self._compile_languagemodel(text, self.languagemodel_file)
+        vocabulary = self._compile_languagemodel(phrases,
+                                                 self.languagemodel_file)
         self._logger.debug('Starting dictionary...')
         self._compile_dictionary(vocabulary, self.dictionary_file)
 
-    def _compile_languagemodel(self, text, output_file):
+    def _compile_languagemodel(self, phrases, output_file):
         """
-        Compiles the languagemodel from a text.
+        Compiles the languagemodel from a list of phrases.
 
         Arguments:
-            text -- the text the languagemodel will be generated from
+            phrases -- the phrases the languagemodel will be generated from
             output_file -- the path of the file this languagemodel will
                            be written to
 
         Returns:
             A list of all unique words this vocabulary contains.
         """
-        with tempfile.NamedTemporaryFile(suffix='.vocab', delete=False) as f:
-            vocab_file = f.name
-
-        # Create vocab file from text
-        self._logger.debug("Creating vocab file: '%s'", vocab_file)
-        cmuclmtk.text2vocab(text, vocab_file)
-
-        # Create language model from text
         self._logger.debug("Creating languagemodel file: '%s'", output_file)
-        cmuclmtk.text2lm(text, output_file, vocab_file=vocab_file)
-
-        # Get words from vocab file
-        self._logger.debug("Getting words from vocab file and removing it " +
-                           "afterwards...")
-        words = []
-        with open(vocab_file, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if not line.startswith('#') and line not in ('<s>', '</s>'):
-                    words.append(line)
-        os.remove(vocab_file)
-
-        return words
+        return languagemodel.compile_languagemodel(phrases, output_file)
 
     def _compile_dictionary(self, words, output_file):
         """
@@ -316,9 +334,18 @@ class PocketsphinxVocabulary(AbstractVocabulary):
                            be written to
         """
         # create the dictionary
-        self._logger.debug("Getting phonemes for %d words...", len(words))
         g2pconverter = PhonetisaurusG2P(**PhonetisaurusG2P.get_config())
-        phonemes = g2pconverter.translate(words)
+        cache = PronunciationCache(self.pronunciation_cache_dir,
+                                   g2pconverter.model_checksum)
+        phonemes, missing = cache.lookup(words)
+        self._logger.debug("Found cached phonemes for %d of %d words",
+                           len(phonemes), len(words))
+        if missing:
+            self._logger.debug("Getting phonemes for %d words...",
+                               len(missing))
+            new_phonemes = g2pconverter.translate(missing)
+            cache.update(new_phonemes)
+            phonemes.update(new_phonemes)
 
         self._logger.debug("Creating dict file: '%s'", output_file)
         with open(output_file, "w") as f:
@@ -331,11 +358,145 @@ class PocketsphinxVocabulary(AbstractVocabulary):
                     f.write(line)
 
 
+class LexiconIndex(object):
+    """
+    Sorted, memory-mapped on-disk index of a pronunciation lexicon.
+
+    The file consists of a header, a table of N + 1 offsets and a blob of N
+    entries sorted by word. Each entry is the word followed by its
+    pronunciations, separated by tabs. Lookups are done by binary search on
+    the memory-mapped file, so opening the index doesn't read it.
+    """
+    MAGIC = 'JLEXIDX1'
+    HEADER = struct.Struct('<8sdqI')
+    OFFSET = struct.Struct('<I')
+
+    def __init__(self, fname):
+        """
+        Opens an existing index.
+
+        Arguments:
+            fname -- the path of the index file
+        """
+        self.fname = fname
+        with open(fname, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.source_mtime, self.source_size,
+         self._count) = self.HEADER.unpack_from(self._mmap, 0)
+        if magic != self.MAGIC:
+            self.close()
+            raise ValueError("'%s' is not a lexicon index" % fname)
+        self._blob_start = self.HEADER.size + (self._count + 1) * \
+            self.OFFSET.size
+
+    @classmethod
+    def build(cls, fname, lexicon, source_mtime=0.0, source_size=0):
+        """
+        Writes a new index file.
+
+        Arguments:
+            fname -- the path of the index file
+            lexicon -- a dict mapping words to lists of pronunciations
+            source_mtime -- (optional) the mtime of the source lexicon
+            source_size -- (optional) the size of the source lexicon
+        """
+        words = sorted(lexicon.keys())
+        offsets = []
+        blob = []
+        position = 0
+        for word in words:
+            entry = '\t'.join([word] + lexicon[word])
+            offsets.append(position)
+            blob.append(entry)
+            position += len(entry)
+        offsets.append(position)
+        tmp_fname = '%s.%d.tmp' % (fname, os.getpid())
+        with open(tmp_fname, 'wb') as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, source_mtime, source_size,
+                                    len(words)))
+            f.write(struct.pack('<%dI' % len(offsets), *offsets))
+            f.write(''.join(blob))
+        os.rename(tmp_fname, fname)
+
+    def __len__(self):
+        return self._count
+
+    def _offset(self, i):
+        return self.OFFSET.unpack_from(
+            self._mmap, self.HEADER.size + i * self.OFFSET.size)[0]
+
+    def _entry(self, i):
+        return self._mmap[self._blob_start + self._offset(i):
+                          self._blob_start + self._offset(i + 1)]
+
+    def lookup(self, word):
+        """
+        Returns:
+            A list of pronunciations of word (empty if it is unknown)
+        """
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry = self._entry(mid)
+            entry_word = entry.split('\t', 1)[0]
+            if entry_word < word:
+                lo = mid + 1
+            elif entry_word > word:
+                hi = mid
+            else:
+                return entry.split('\t')[1:]
+        return []
+
+    def close(self):
+        self._mmap.close()
+
+
 class JuliusVocabulary(AbstractVocabulary):
     class VoxForgeLexicon(object):
-        def __init__(self, fname, membername=None):
+        def __init__(self, fname, membername=None, index_fname=None):
+            """
+            Arguments:
+                fname -- the path of the lexicon (plain text or tar archive)
+                membername -- (optional) the lexicon file inside the archive
+                index_fname -- (optional) the path of a LexiconIndex for
+                               this lexicon. It is built on first use and
+                               rebuilt whenever the lexicon changes. If not
+                               given, the lexicon is parsed into memory.
+            """
             self._dict = {}
+            self._index = None
+            if index_fname is None:
+                self.parse(fname, membername)
+            else:
+                self._index = self.open_index(fname, membername, index_fname)
+
+        def open_index(self, fname, membername, index_fname):
+            logger = logging.getLogger(__name__)
+            st = os.stat(fname)
+            if os.path.exists(index_fname):
+                try:
+                    index = LexiconIndex(index_fname)
+                except (ValueError, struct.error, mmap.error):
+                    logger.warning("Lexicon index '%s' is corrupt",
+                                   index_fname, exc_info=True)
+                else:
+                    if (index.source_mtime == st.st_mtime and
+                            index.source_size == st.st_size):
+                        return index
+                    index.close()
+            logger.debug("Building lexicon index '%s' from '%s'",
+                         index_fname, fname)
             self.parse(fname, membername)
+            LexiconIndex.build(index_fname, self._dict,
+                               source_mtime=st.st_mtime,
+                               source_size=st.st_size)
+            self._dict = {}
+            return LexiconIndex(index_fname)
+
+        def close(self):
+            if self._index is not None:
+                self._index.close()
+                self._index = None
 
         @contextlib.contextmanager
         def open_dict(self, fname, membername=None):
@@ -364,6 +525,8 @@ class JuliusVocabulary(AbstractVocabulary):
                             self._dict[word] = [phoneme]
 
         def translate_word(self, word):
+            if self._index is not None:
+                return self._index.lookup(word)
             if word in self._dict:
                 return self._dict[word]
             else:
@@ -393,6 +556,17 @@ class JuliusVocabulary(AbstractVocabulary):
                 os.access(self.dfa_file, os.R_OK) and
                 os.access(self.dict_file, os.R_OK))
 
+    def get_lexicon_index_file(self, lexicon_file, membername):
+        """
+        Returns:
+            The path of the lexicon index shared by all julius vocabularies
+            that use the same lexicon
+        """
+        key = hashlib.sha1('%s\0%s' % (os.path.abspath(lexicon_file),
+                                       membername)).hexdigest()
+        return os.path.join(os.path.dirname(self.path),
+                            '.lexicon-%s.idx' % key[:16])
+
     def _get_grammar(self, phrases):
         return {'S': [['NS_B', 'WORD_LOOP', 'NS_E']],
                 'WORD_LOOP': [['WORD_LOOP', 'WORD'], ['WORD']]}
@@ -432,8 +606,10 @@ class JuliusVocabulary(AbstractVocabulary):
                         lexicon_archive_member = \
                             profile['julius']['lexicon_archive_member']
 
-        lexicon = JuliusVocabulary.VoxForgeLexicon(lexicon_file,
-                                                   lexicon_archive_member)
+        lexicon = JuliusVocabulary.VoxForgeLexicon(
+            lexicon_file, lexicon_archive_member,
+            index_fname=self.get_lexicon_index_file(lexicon_file,
+                                                    lexicon_archive_member))
 
         # Create grammar file
         tmp_grammar_file = os.path.join(tmpdir,
@@ -454,6 +630,7 @@ class JuliusVocabulary(AbstractVocabulary):
                 f.write("%% %s\n" % category)
                 for word, phoneme in words:
                     f.write("%s\t\t\t%s\n" % (word, phoneme))
+        lexicon.close()
 
         # mkdfa.pl
         olddir = os.getcwd()
@@ -476,6 +653,71 @@ class JuliusVocabulary(AbstractVocabulary):
         shutil.rmtree(tmpdir)
 
 
+def _compile_job(job):
+    """
+    Compiles a single vocabulary. Runs in a worker process of
+    compile_vocabularies().
+
+    Arguments:
+        job -- a tuple (vocabulary_class, name, path, phrases)
+
+    Returns:
+        A tuple (name, revision, seconds)
+    """
+    vocabulary_class, name, path, phrases = job
+    start = time.time()
+    vocabulary = vocabulary_class(name, path=path)
+    revision = vocabulary.compile(phrases)
+    return (name, revision, time.time() - start)
+
+
+def compile_vocabularies(jobs, path, processes=None):
+    """
+    Compiles several vocabularies concurrently in a process pool. Each
+    vocabulary is locked while it is compiled, and vocabularies that match
+    their phrases already are skipped.
+
+    Arguments:
+        jobs -- a list of tuples (vocabulary_class, name, phrases)
+        path -- the path in which the vocabularies exist or will be created
+        processes -- (optional) the number of worker processes
+                     (Default: one per vocabulary, at most one per CPU)
+
+    Returns:
+        A dict mapping vocabulary names to compiled revisions
+    """
+    logger = logging.getLogger(__name__)
+    pending = [(vocabulary_class, name, path, phrases)
+               for vocabulary_class, name, phrases in jobs
+               if not vocabulary_class(name, path=path).matches_phrases(
+                   phrases)]
+    revisions = {}
+    for vocabulary_class, name, phrases in jobs:
+        revisions[name] = vocabulary_class.phrases_to_revision(phrases)
+    if not pending:
+        return revisions
+    logger.info("Compiling %d vocabularies: %s", len(pending),
+                ', '.join(job[1] for job in pending))
+    if processes is None:
+        processes = min(len(pending), multiprocessing.cpu_count())
+    if len(pending) == 1 or processes < 2:
+        results = (_compile_job(job) for job in pending)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(_compile_job, pending)
+    try:
+        for i, (name, revision, seconds) in enumerate(results, start=1):
+            logger.info("Compiled vocabulary '%s' in %.1f seconds (%d/%d)",
+                        name, seconds, i, len(pending))
+            revisions[name] = revision
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return revisions
+
+
 def get_phrases_from_module(module):
     """
     Gets phrases from a module.
@@ -509,7 +751,8 @@ def get_keyword_phrases():
 
 def get_all_phrases():
     """
-    Gets phrases from all modules.
+    Gets phrases from all modules. The modules are only imported if the
+    plugin manifest is outdated.
 
     Returns:
         A list of phrases in all modules plus additional phrases passed to this
@@ -517,9 +760,8 @@ def get_all_phrases():
     """
     phrases = []
 
-    modules = brain.Brain.get_modules()
-    for module in modules:
-        phrases.extend(get_phrases_from_module(module))
+    for description in brain.Brain.get_module_descriptions():
+        phrases.extend(description['words'])
 
     return sorted(list(set(phrases)))
 
@@ -0,0 +1,123 @@
+# -*- coding: utf-8-*-
+"""
+Background compilation of vocabularies whose phrases change at runtime,
+e.g. the playlists and songs of a music library.
+
+A VocabularyService thread asks a phrase source for the current phrases of
+its vocabularies, compiles the ones that changed and keeps ready STT engine
+instances for them. Afterwards it blocks until the source reports a change.
+Modules can then get an engine for such a vocabulary without waiting for
+the compilation.
+"""
+import logging
+import threading
+from abc import ABCMeta, abstractmethod
+
+import vocabcompiler
+
+
+class VocabularySource(object):
+    """
+    Interface of the phrase sources used by a VocabularyService.
+    """
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def get_phrases(self):
+        """
+        Returns:
+            A dict mapping vocabulary names to lists of phrases
+        """
+        pass
+
+    @abstractmethod
+    def wait_for_change(self):
+        """
+        Blocks until the phrases may have changed.
+        """
+        pass
+
+
+class VocabularyService(threading.Thread):
+    """
+    Daemon thread that keeps the vocabularies of a VocabularySource compiled.
+    """
+
+    def __init__(self, stt_engine_class, source, retry_interval=60):
+        """
+        Arguments:
+            stt_engine_class -- the STT engine class to create instances of
+            source -- the VocabularySource
+            retry_interval -- (optional) seconds to wait after an error
+                              (Default: 60)
+        """
+        super(VocabularyService, self).__init__(name='VocabularyService')
+        self.daemon = True
+        self._logger = logging.getLogger(__name__)
+        self.stt_engine_class = stt_engine_class
+        self.source = source
+        self.retry_interval = retry_interval
+        self._stop_event = threading.Event()
+        self._cond = threading.Condition()
+        # Maps vocabulary names to (revision, STT engine instance)
+        self._instances = {}
+
+    def get_instance(self, vocabulary_name, timeout=None):
+        """
+        Returns an STT engine instance for a vocabulary.
+
+        Arguments:
+            vocabulary_name -- the name of the vocabulary
+            timeout -- (optional) seconds to wait for the vocabulary to
+                       become ready. If None, don't wait (Default: None)
+
+        Returns:
+            The STT engine instance, or None if the vocabulary isn't ready
+        """
+        with self._cond:
+            if vocabulary_name not in self._instances and timeout:
+                self._cond.wait(timeout)
+            if vocabulary_name in self._instances:
+                return self._instances[vocabulary_name][1]
+        return None
+
+    def is_ready(self, vocabulary_name):
+        with self._cond:
+            return vocabulary_name in self._instances
+
+    def update(self):
+        """
+        Compiles all vocabularies whose phrases have changed.
+        """
+        phrases_by_name = self.source.get_phrases()
+        # Compile small vocabularies first, so that they become ready
+        # earlier
+        for name, phrases in sorted(phrases_by_name.items(),
+                                    key=lambda item: len(item[1])):
+            revision = vocabcompiler.AbstractVocabulary.phrases_to_revision(
+                phrases)
+            with self._cond:
+                if (name in self._instances and
+                        self._instances[name][0] == revision):
+                    continue
+            self._logger.info("Compiling vocabulary '%s' with %d phrases " +
+                              "in the background", name, len(phrases))
+            instance = self.stt_engine_class.get_instance(name, phrases)
+            with self._cond:
+                self._instances[name] = (revision, instance)
+                self._cond.notify_all()
+            self._logger.info("Vocabulary '%s' is ready", name)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.update()
+                self.source.wait_for_change()
+            except Exception:
+                self._logger.warning("Updating vocabularies failed, " +
+                                     "retrying in %d seconds",
+                                     self.retry_interval, exc_info=True)
+                self._stop_event.wait(self.retry_interval)
+
+    def stop(self):
+        self._stop_event.set()
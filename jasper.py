@@ -101,6 +101,9 @@ class Jasper(object):
                            "to '%s'", tts_engine_slug)
         tts_engine_class = tts.get_engine_by_slug(tts_engine_slug)
 
+        # Compile the passive and active vocabularies concurrently
+        stt_engine_class.compile_vocabularies(stt_passive_engine_class)
+
         # Initialize Mic
         self.mic = Mic(tts_engine_class.get_instance(),
                        stt_passive_engine_class.get_passive_instance(),
@@ -0,0 +1,85 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import unittest
+from client import audiocapture
+
+
+class TestRingBuffer(unittest.TestCase):
+
+    def testReadInOrder(self):
+        buf = audiocapture.RingBuffer(4)
+        for chunk in ('a', 'b', 'c'):
+            buf.append(chunk)
+        position = 0
+        chunks = []
+        for i in range(3):
+            chunk, position = buf.read(position)
+            chunks.append(chunk)
+        self.assertEqual(chunks, ['a', 'b', 'c'])
+        self.assertEqual(position, buf.position)
+
+    def testOverrunSkipsToOldestChunk(self):
+        buf = audiocapture.RingBuffer(2)
+        for chunk in ('a', 'b', 'c', 'd'):
+            buf.append(chunk)
+        self.assertEqual(buf.start, 2)
+        self.assertEqual(buf.read(0), ('c', 3))
+
+    def testReadTimeout(self):
+        buf = audiocapture.RingBuffer(2)
+        self.assertEqual(buf.read(0, timeout=0.01), (None, 0))
+
+
+class TestAudioCapture(unittest.TestCase):
+
+    class DummyStream(object):
+        def __init__(self, chunks):
+            self.chunks = list(chunks)
+            self.closed = False
+
+        def read(self, size):
+            if self.chunks:
+                return self.chunks.pop(0)
+            raise IOError('Input overflowed')
+
+        def stop_stream(self):
+            pass
+
+        def close(self):
+            self.closed = True
+
+    class DummyAudio(object):
+        def __init__(self, stream):
+            self.stream = stream
+            self.opened = 0
+
+        def get_format_from_width(self, width):
+            return width
+
+        def open(self, *args, **kwargs):
+            self.opened += 1
+            return self.stream
+
+    def testReadersShareOneStream(self):
+        stream = self.DummyStream(['aa', 'bb', 'cc'])
+        audio = self.DummyAudio(stream)
+        capture = audiocapture.AudioCapture(audio, timeout=1)
+        first = capture.reader(0)
+        second = capture.reader(0)
+        capture.start()
+        try:
+            self.assertEqual([first.read() for i in range(3)],
+                             ['aa', 'bb', 'cc'])
+            self.assertEqual(second.read(), 'aa')
+            self.assertEqual(capture.reader(second.position).read(), 'bb')
+        finally:
+            capture.stop()
+            capture.join()
+        self.assertEqual(audio.opened, 1)
+        self.assertEqual(capture.noise_floor.count, 3)
+        self.assertTrue(stream.closed)
+
+    def testReaderTimeout(self):
+        capture = audiocapture.AudioCapture(None, timeout=0.01)
+        with self.assertRaises(IOError):
+            capture.reader().read()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import unittest
+import mock
+from client import audioplayer, audiosegment, jasperpath
+
+
+class TestPyAudioPlayer(unittest.TestCase):
+
+    class DummyStream(object):
+        def __init__(self, **kwargs):
+            self.kwargs = kwargs
+            self.written = []
+            self.closed = False
+
+        def write(self, data):
+            self.written.append(data)
+
+        def stop_stream(self):
+            pass
+
+        def close(self):
+            self.closed = True
+
+    class DummyAudio(object):
+        def __init__(self):
+            self.streams = []
+
+        def get_format_from_width(self, width):
+            return width
+
+        def open(self, **kwargs):
+            stream = TestPyAudioPlayer.DummyStream(**kwargs)
+            self.streams.append(stream)
+            return stream
+
+    def setUp(self):
+        self.audio = self.DummyAudio()
+        self.player = audioplayer.PyAudioPlayer(self.audio, chunk=4)
+
+    def testPlaySegment(self):
+        segment = audiosegment.AudioSegment('\x01\x00' * 10, rate=8000)
+        self.player.play_segment(segment)
+        self.player.play_segment(segment)
+        self.assertEqual(len(self.audio.streams), 1)
+        stream = self.audio.streams[0]
+        self.assertEqual(stream.kwargs['rate'], 8000)
+        self.assertEqual(stream.kwargs['channels'], 1)
+        self.assertTrue(stream.kwargs['output'])
+        self.assertEqual([len(data) for data in stream.written],
+                         [8, 8, 4] * 2)
+        self.player.close()
+        self.assertTrue(stream.closed)
+
+    def testPreload(self):
+        filename = jasperpath.data('audio', 'beep_hi.wav')
+        self.player.preload(filename)
+        with mock.patch('client.audioplayer.open', create=True) as mock_open:
+            self.player.play(filename)
+            self.assertFalse(mock_open.called)
+        with open(filename, 'rb') as f:
+            segment = audiosegment.AudioSegment.from_wav(f)
+        self.assertEqual(''.join(self.audio.streams[0].written),
+                         segment.raw_data)
+
+    def testRetryAfterOpenFailure(self):
+        self.player.play_segment(audiosegment.AudioSegment('\x00\x00'))
+        first = self.audio.streams[0]
+        with mock.patch.object(self.audio, 'open',
+                               side_effect=[IOError('Device busy'),
+                                            self.DummyStream()]):
+            self.player.play_segment(
+                audiosegment.AudioSegment('\x00\x00', rate=8000))
+        self.assertTrue(first.closed)
+
+    def testOutputDevice(self):
+        devices = [{'name': 'Built-in Microphone', 'maxOutputChannels': 0},
+                   {'name': 'bcm2835 ALSA', 'maxOutputChannels': 2},
+                   {'name': 'USB Audio Device', 'maxOutputChannels': 2}]
+        self.audio.get_device_count = lambda: len(devices)
+        self.audio.get_device_info_by_index = lambda index: devices[index]
+        find = audioplayer.find_output_device
+        self.assertIsNone(find(self.audio, None))
+        self.assertEqual(find(self.audio, 1), 1)
+        self.assertEqual(find(self.audio, '2'), 2)
+        self.assertEqual(find(self.audio, 'usb audio'), 2)
+        self.assertIsNone(find(self.audio, 'default'))
+        self.assertRaises(LookupError, find, self.audio, 'Microphone')
+
+        with mock.patch.object(audioplayer.PyAudioPlayer, 'get_config',
+                               return_value={'output_device': 'USB'}):
+            player = audioplayer.PyAudioPlayer.get_instance(self.audio)
+        player.play_segment(audiosegment.AudioSegment('\x00\x00'))
+        self.assertEqual(
+            self.audio.streams[0].kwargs['output_device_index'], 2)
+
+        # Unknown devices make the speaker fall back to aplay
+        with mock.patch.object(audioplayer.PyAudioPlayer, 'get_config',
+                               return_value={'output_device': 'HDMI'}):
+            self.assertIsNone(
+                audioplayer.PyAudioPlayer.get_instance(self.audio))
+
+    def testIdleTimeout(self):
+        self.player.idle_timeout = 0.01
+        self.player.play_segment(audiosegment.AudioSegment('\x00\x00'))
+        stream = self.audio.streams[0]
+        self.player._idle_timer.join(5)
+        self.assertTrue(stream.closed)
+        self.assertEqual(self.player._streams, {})
@@ -0,0 +1,32 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import unittest
+from client import audiosegment, jasperpath
+
+
+class TestAudioSegment(unittest.TestCase):
+
+    def setUp(self):
+        self.segment = audiosegment.AudioSegment.from_frames(
+            ['\x01\x00' * 8000, '\x02\x00' * 8000], rate=16000)
+
+    def testFromFrames(self):
+        self.assertEqual(len(self.segment), 32000)
+        self.assertEqual(self.segment.duration, 1.0)
+        self.assertEqual(self.segment.raw_data[:2], '\x01\x00')
+
+    def testWavRoundTrip(self):
+        f = self.segment.wav_file()
+        self.assertEqual(f.read(4), 'RIFF')
+        segment = audiosegment.get_segment(f)
+        self.assertEqual(segment.raw_data, self.segment.raw_data)
+        self.assertEqual(segment.rate, 16000)
+        self.assertEqual(segment.width, 2)
+        self.assertEqual(segment.channels, 1)
+        self.assertEqual(len(self.segment.wav_data()), 44 + 32000)
+
+    def testGetSegment(self):
+        self.assertIs(audiosegment.get_segment(self.segment), self.segment)
+        with open(jasperpath.data('audio', 'jasper.wav'), 'rb') as f:
+            segment = audiosegment.get_segment(f)
+        self.assertGreater(segment.duration, 0)
@@ -1,8 +1,9 @@
 #!/usr/bin/env python2
 # -*- coding: utf-8-*-
+import threading
 import unittest
 import mock
-from client import brain, test_mic
+from client import brain, pluginmanifest, test_mic
 
 
 DEFAULT_PROFILE = {
@@ -31,6 +32,22 @@ class TestBrain(unittest.TestCase):
                 my_brain.query("zzz gibberish zzz")
                 self.assertTrue(mocked_log.called)
 
+    def testSetupModules(self):
+        """Does Brain call the optional setup hooks of modules?"""
+        module = mock.Mock(WORDS=['MOCK'])
+        failing_module = mock.Mock(WORDS=['FAIL'])
+        failing_module.__name__ = 'failing'
+        failing_module.setup.side_effect = RuntimeError('test')
+        without_setup = mock.Mock(WORDS=['OTHER'], spec=['WORDS', 'isValid',
+                                                         'handle'])
+        modules = [failing_module, module, without_setup]
+        with mock.patch.object(brain.Brain, 'get_modules',
+                               classmethod(lambda cls: modules)):
+            with mock.patch('logging.Logger.warning') as mocked_log:
+                my_brain = TestBrain._emptyBrain()
+                self.assertTrue(mocked_log.called)
+        module.setup.assert_called_once_with(my_brain.mic, my_brain.profile)
+
     def testSortByPriority(self):
         """Does Brain sort modules by priority?"""
         my_brain = TestBrain._emptyBrain()
@@ -47,3 +64,111 @@ class TestBrain(unittest.TestCase):
         with mock.patch.object(hn, 'handle') as mocked_handle:
             my_brain.query(["hacker news"])
             self.assertTrue(mocked_handle.called)
+
+    def testKeywordIndex(self):
+        """Does Brain only check modules whose WORDS match the input?"""
+        indexed = mock.Mock(WORDS=['KNOCK KNOCK', 'JOKE'], KEYWORD_INDEX=True)
+        other = mock.Mock(WORDS=['TIME'], KEYWORD_INDEX=True)
+        unindexed = mock.Mock(WORDS=['WEATHER'], KEYWORD_INDEX=False)
+        fallback = mock.Mock(WORDS=[], KEYWORD_INDEX=True)
+        for module in (indexed, other, unindexed, fallback):
+            module.__name__ = 'mock'
+            module.isValid.return_value = False
+        modules = [indexed, other, unindexed, fallback]
+        with mock.patch.object(brain.Brain, 'get_modules',
+                               classmethod(lambda cls: modules)):
+            my_brain = TestBrain._emptyBrain()
+        self.assertEqual(my_brain.get_candidates(["knock, knock"]),
+                         [indexed, unindexed, fallback])
+        self.assertEqual(my_brain.get_candidates(["what", "time is it"]),
+                         [other, unindexed, fallback])
+
+        my_brain.query(["what time is it"])
+        self.assertFalse(indexed.isValid.called)
+        other.isValid.assert_called_once_with("what time is it")
+        self.assertTrue(unindexed.isValid.called)
+        self.assertFalse(fallback.handle.called)
+        fallback.isValid.assert_called_once_with("what time is it")
+
+    def testLazyModules(self):
+        """Does Brain defer imports if the plugin manifest is up to date?"""
+        descriptions = [{'name': 'Mock', 'file': 'Mock.py', 'location': '.',
+                         'words': ['MOCK'], 'priority': 0,
+                         'keyword_index': True, 'has_setup': False}]
+        with mock.patch.object(brain.Brain, '_modules', None):
+            with mock.patch('client.pluginmanifest.PluginManifest.load',
+                            return_value=descriptions):
+                with mock.patch.object(brain.Brain,
+                                       '_load_modules') as load_modules:
+                    my_brain = TestBrain._emptyBrain()
+                    self.assertFalse(load_modules.called)
+        module = my_brain.modules[0]
+        self.assertIsInstance(module, pluginmanifest.LazyModule)
+        self.assertEqual(module.WORDS, ['MOCK'])
+        self.assertFalse(module.is_loaded)
+
+    def testManifestNotSavedOnImportError(self):
+        """Are modules that failed to import retried on the next start?"""
+        module = mock.Mock(WORDS=['MOCK'])
+        for failed, saved in ((['Broken'], False), ([], True)):
+            with mock.patch.object(brain.Brain, '_modules', None):
+                with mock.patch('client.pluginmanifest.PluginManifest.load',
+                                return_value=None), \
+                        mock.patch('client.pluginmanifest.PluginManifest.' +
+                                   'save') as save, \
+                        mock.patch('client.brain.os.path.isdir',
+                                   return_value=True), \
+                        mock.patch.object(brain.Brain, '_load_modules',
+                                          return_value=([module], failed)):
+                    self.assertEqual(brain.Brain.get_modules(), [module])
+            self.assertEqual(save.called, saved)
+
+    def testDispatch(self):
+        """Does Brain run modules in the background and cancel them?"""
+        module = mock.Mock(WORDS=['MOCK'], TIMEOUT=None)
+        module.__name__ = 'mock'
+        started = threading.Event()
+        proceed = threading.Event()
+
+        def handle(text, mic, profile):
+            started.set()
+            proceed.wait(5)
+            mic.say(text)
+        module.handle.side_effect = handle
+        with mock.patch.object(brain.Brain, 'get_modules',
+                               classmethod(lambda cls: [module])):
+            my_brain = TestBrain._emptyBrain()
+        try:
+            self.assertIsNone(my_brain.dispatch(["nothing"]))
+            module.isValid.return_value = True
+            task = my_brain.dispatch(["mock"])
+            self.assertTrue(started.wait(5))
+            self.assertEqual(my_brain.dispatcher.tasks, [task])
+            my_brain.interrupt()
+            proceed.set()
+            self.assertTrue(task.wait(5))
+            self.assertTrue(task.cancelled)
+            self.assertEqual(my_brain.mic.outputs, [])
+        finally:
+            my_brain.dispatcher.shutdown()
+
+    def testDispatchExclusive(self):
+        """Does the profile's timeout spare modules that own the mic?"""
+        module = mock.Mock(WORDS=['MOCK'], TIMEOUT=None, EXCLUSIVE_MIC=True)
+        module.__name__ = 'mock'
+        module.isValid.return_value = True
+        with mock.patch.object(brain.Brain, 'get_modules',
+                               classmethod(lambda cls: [module])):
+            my_brain = TestBrain._emptyBrain()
+        try:
+            task = my_brain.dispatch(["mock"])
+            self.assertTrue(task.wait(5))
+            self.assertTrue(task.exclusive)
+            self.assertIsNone(task.timeout)
+            module.EXCLUSIVE_MIC = False
+            task = my_brain.dispatch(["mock"])
+            self.assertTrue(task.wait(5))
+            self.assertFalse(task.exclusive)
+            self.assertEqual(task.timeout, my_brain.timeout)
+        finally:
+            my_brain.dispatcher.shutdown()
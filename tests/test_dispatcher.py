@@ -0,0 +1,112 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import time
+import threading
+import unittest
+import mock
+from client import dispatcher, test_mic
+
+
+class TestDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.mic = test_mic.Mic(['yes'])
+        self.dispatcher = dispatcher.Dispatcher()
+        self.module = mock.Mock()
+        self.module.__name__ = 'mock'
+
+    def tearDown(self):
+        self.dispatcher.shutdown()
+
+    def testSubmit(self):
+        task = dispatcher.ModuleTask(self.module, 'text')
+
+        def func(mic):
+            mic.say('question')
+            mic.say(mic.activeListen())
+        self.dispatcher.submit(func, task, self.mic)
+        self.assertTrue(task.wait(5))
+        self.assertIsNone(task.future.exception())
+        self.assertEqual(self.mic.outputs, ['question', 'yes'])
+        self.assertEqual(self.dispatcher.tasks, [])
+
+    def testTimeout(self):
+        task = dispatcher.ModuleTask(self.module, 'text', timeout=0.05)
+        proceed = threading.Event()
+
+        def func(mic):
+            proceed.wait(5)
+            mic.say('too late')
+        self.dispatcher.submit(func, task, self.mic)
+        for i in range(100):
+            if task.cancelled:
+                break
+            time.sleep(0.01)
+        self.assertTrue(task.cancelled)
+        self.assertFalse(task.done())
+        proceed.set()
+        self.assertTrue(task.wait(5))
+        self.assertIsInstance(task.future.exception(),
+                              dispatcher.TaskCancelled)
+        self.assertEqual(self.mic.outputs, [])
+
+    def testInputArbitration(self):
+        arbiter = self.dispatcher.arbiter
+        task = dispatcher.ModuleTask(self.module, 'text')
+        # The listen loop holds the microphone
+        arbiter.acquire_input()
+        self.dispatcher.submit(lambda mic: mic.activeListen(), task,
+                               self.mic)
+        for i in range(100):
+            if arbiter.input_requested:
+                break
+            task.wait(0.01)
+        self.assertTrue(arbiter.input_requested)
+        self.assertFalse(task.done())
+        arbiter.release_input()
+        self.assertTrue(task.wait(5))
+        self.assertEqual(task.future.result(), 'yes')
+
+    def testCancelWhileWaitingForInput(self):
+        arbiter = self.dispatcher.arbiter
+        task = dispatcher.ModuleTask(self.module, 'text')
+        arbiter.acquire_input()
+        try:
+            self.dispatcher.submit(lambda mic: mic.activeListen(), task,
+                                   self.mic)
+            for i in range(100):
+                if arbiter.input_requested:
+                    break
+                task.wait(0.01)
+            task.cancel()
+            self.assertTrue(task.wait(5))
+        finally:
+            arbiter.release_input()
+        self.assertIsInstance(task.future.exception(),
+                              dispatcher.TaskCancelled)
+        self.assertEqual(self.mic.idx, 0)
+
+    def testCancelPassiveListen(self):
+        task = dispatcher.ModuleTask(self.module, 'text', exclusive=True)
+        listening = threading.Event()
+        other_mic = test_mic.Mic([])
+
+        def passiveListen(PERSONA, interrupt=None):
+            listening.set()
+            while not interrupt():
+                time.sleep(0.01)
+            return (None, None)
+        other_mic.passiveListen = passiveListen
+
+        def func(mic):
+            # e.g. a mode with its own keyword loop and STT engine
+            mic = mic.wrap(other_mic)
+            while True:
+                mic.passiveListen('JASPER')
+        self.dispatcher.submit(func, task, self.mic)
+        self.assertTrue(listening.wait(5))
+        self.assertFalse(task.done())
+        task.cancel()
+        self.assertTrue(task.wait(5))
+        self.assertIsInstance(task.future.exception(),
+                              dispatcher.TaskCancelled)
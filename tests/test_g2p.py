@@ -1,5 +1,7 @@
 #!/usr/bin/env python2
 # -*- coding: utf-8-*-
+import os
+import shutil
 import unittest
 import tempfile
 import mock
@@ -75,3 +77,135 @@ class TestPatchedG2P(unittest.TestCase):
                 results = self.g2pconv.translate(WORDS).keys()
                 for word in WORDS:
                     self.assertIn(word, results)
+
+    def testFlavourDetectedOnce(self):
+        with mock.patch.object(g2p.PhonetisaurusG2P, '_flavour', None):
+            with mock.patch('subprocess.Popen',
+                            return_value=TestPatchedG2P.DummyProc()
+                            ) as mocked_popen:
+                self.g2pconv.translate(WORDS)
+                self.g2pconv.translate(WORDS)
+                self.assertEqual(g2p.PhonetisaurusG2P._flavour, 'words')
+        # One run to detect the flavour, one run per translation
+        self.assertEqual(mocked_popen.call_count, 3)
+
+
+class TestG2PBindings(unittest.TestCase):
+
+    class DummyModel(object):
+        SYMBOLS = {1: 'G', 2: 'UH', 3: 'D', 4: 'UW'}
+
+        def __init__(self, fst_model):
+            self.fst_model = fst_model
+
+        def Phoneticize(self, word, nbest, *args):
+            paths = [mock.Mock(Uniques=[1, 2, 3]),
+                     mock.Mock(Uniques=[1, 4, 3])]
+            return paths[:nbest]
+
+        def FindOsym(self, symbol):
+            return self.SYMBOLS[symbol]
+
+    def setUp(self):
+        self.bindings = mock.Mock()
+        self.bindings.PhonetisaurusScript.side_effect = self.DummyModel
+        self.patches = [
+            mock.patch.object(g2p.PhonetisaurusG2P, '_models', {}),
+            mock.patch.object(g2p.PhonetisaurusG2P, 'has_bindings',
+                              return_value=True),
+            mock.patch.object(g2p, 'Phonetisaurus', self.bindings,
+                              create=True)]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def testTranslate(self):
+        with tempfile.NamedTemporaryFile() as f:
+            for i in range(2):
+                g2pconv = g2p.PhonetisaurusG2P(f.name, nbest=2,
+                                               use_bindings=True)
+                self.assertEqual(g2pconv.translate('GOOD'),
+                                 {'GOOD': ['G UH D', 'G UW D']})
+        # The model is only loaded once
+        self.bindings.PhonetisaurusScript.assert_called_once_with(f.name)
+
+    def testFallback(self):
+        self.bindings.PhonetisaurusScript.side_effect = RuntimeError
+        with tempfile.NamedTemporaryFile() as f:
+            g2pconv = g2p.PhonetisaurusG2P(f.name, use_bindings=True)
+            with mock.patch.object(g2p.PhonetisaurusG2P, 'execute',
+                                   return_value={'GOOD': ['G UH D']}
+                                   ) as execute:
+                self.assertEqual(g2pconv.translate('GOOD'),
+                                 {'GOOD': ['G UH D']})
+        self.assertTrue(execute.called)
+        self.assertFalse(g2pconv.use_bindings)
+
+    def testOptIn(self):
+        with tempfile.NamedTemporaryFile() as f:
+            with mock.patch('client.g2p.diagnose.check_executable',
+                            return_value=True):
+                g2pconv = g2p.PhonetisaurusG2P(f.name)
+        self.assertFalse(g2pconv.use_bindings)
+
+
+class TestPronunciationCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testLookupAndUpdate(self):
+        cache = g2p.PronunciationCache(self.tempdir, 'abc')
+        self.assertEqual(cache.lookup(WORDS), ({}, WORDS))
+        cache.update({'GOOD': ['G UH D', 'G UW D'], 'BAD': ['B AE D']})
+        self.assertEqual(cache.lookup(WORDS),
+                         ({'GOOD': ['G UH D', 'G UW D'], 'BAD': ['B AE D']},
+                          ['UGLY']))
+
+        # The cache persists and is bound to the model checksum
+        cache = g2p.PronunciationCache(self.tempdir, 'abc')
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.lookup(['GOOD'])[0],
+                         {'GOOD': ['G UH D', 'G UW D']})
+        cache = g2p.PronunciationCache(self.tempdir, 'def')
+        self.assertEqual(len(cache), 0)
+
+    def testCreateDirectory(self):
+        directory = os.path.join(self.tempdir, 'g2p')
+        first = g2p.PronunciationCache(directory, 'abc')
+        second = g2p.PronunciationCache(directory, 'abc')
+        first.update({'GOOD': ['G UH D']})
+        second.update({'BAD': ['B AE D']})
+        self.assertEqual(len(g2p.PronunciationCache(directory, 'abc')), 2)
+
+    def testConcurrentUpdates(self):
+        first = g2p.PronunciationCache(self.tempdir, 'abc')
+        second = g2p.PronunciationCache(self.tempdir, 'abc')
+        first.update({'GOOD': ['G UH D']})
+        second.update({'GOOD': ['G UH D'], 'BAD': ['B AE D']})
+        with open(first.filename, 'r') as f:
+            self.assertEqual(sorted(f.readlines()),
+                             ['BAD\tB AE D\n', 'GOOD\tG UH D\n'])
+
+        # Duplicates written by older versions are skipped when loading
+        with open(first.filename, 'a') as f:
+            f.write('GOOD\tG UH D\n')
+        cache = g2p.PronunciationCache(self.tempdir, 'abc')
+        self.assertEqual(cache.lookup(['GOOD'])[0], {'GOOD': ['G UH D']})
+
+    def testModelChecksum(self):
+        fst_model = os.path.join(self.tempdir, 'model.fst')
+        with open(fst_model, 'w') as f:
+            f.write('FST')
+        with mock.patch('client.g2p.diagnose.check_executable',
+                        return_value=True):
+            checksums = set(g2p.PhonetisaurusG2P(fst_model,
+                                                 nbest=nbest).model_checksum
+                            for nbest in (None, None, 3))
+        self.assertEqual(len(checksums), 2)
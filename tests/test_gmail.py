@@ -0,0 +1,280 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import os
+import re
+import shutil
+import imaplib
+import time
+import tempfile
+import threading
+import unittest
+import SocketServer
+import mock
+from client import imapsession
+from client.notifiers import GmailNotifier
+
+
+class IMAPStubHandler(SocketServer.StreamRequestHandler):
+    """
+    Speaks just enough IMAP4rev1 for IMAPSession.
+    """
+
+    def send(self, line):
+        self.wfile.write(line + '\r\n')
+        self.wfile.flush()
+
+    def handle(self):
+        mailbox = self.server.mailbox
+        self.send('* OK IMAP stub ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            tag, command = line.strip().split(' ', 1)
+            name, _, args = command.partition(' ')
+            name = name.upper()
+            mailbox.commands.append(command)
+            if name == 'CAPABILITY':
+                self.send('* CAPABILITY IMAP4rev1 IDLE')
+            elif name in ('SELECT', 'EXAMINE'):
+                with mailbox.cond:
+                    self.send('* %d EXISTS' % len(mailbox.messages))
+                    self.send('* OK [UIDVALIDITY %d] UIDs valid' %
+                              mailbox.uidvalidity)
+            elif name == 'UID':
+                self.handle_uid(mailbox, args)
+            elif name == 'IDLE':
+                self.handle_idle(mailbox, tag)
+                continue
+            elif name == 'LOGOUT':
+                self.send('* BYE')
+                self.send('%s OK LOGOUT completed' % tag)
+                return
+            elif name not in ('LOGIN', 'NOOP'):
+                self.send('%s BAD unknown command' % tag)
+                continue
+            self.send('%s OK %s completed' % (tag, name))
+
+    def handle_uid(self, mailbox, args):
+        command, args = args.split(' ', 1)
+        command = command.upper()
+        with mailbox.cond:
+            uids = sorted(mailbox.messages)
+            if command == 'SEARCH':
+                m = re.search(r'UID (\d+):\*', args)
+                if m:
+                    start = int(m.group(1))
+                    matched = [uid for uid in uids if uid >= start]
+                    if not matched and uids:
+                        matched = uids[-1:]
+                else:
+                    matched = uids
+                if 'UNSEEN' in args:
+                    matched = [uid for uid in matched
+                               if not mailbox.messages[uid][1]]
+                self.send('* SEARCH ' + ' '.join(str(uid)
+                                                 for uid in matched))
+            elif command == 'FETCH':
+                wanted = set(int(uid) for uid in args.split(' ')[0].split(','))
+                for seq, uid in enumerate(uids, start=1):
+                    if uid not in wanted:
+                        continue
+                    headers, seen = mailbox.messages[uid]
+                    self.send('* %d FETCH (UID %d BODY[HEADER.FIELDS ' %
+                              (seq, uid) + '(FROM DATE)] {%d}' % len(headers))
+                    self.wfile.write(headers)
+                    self.send(')')
+            elif command == 'STORE':
+                for uid in args.split(' ')[0].split(','):
+                    mailbox.messages[int(uid)][1] = True
+
+    def handle_idle(self, mailbox, tag):
+        with mailbox.cond:
+            known = len(mailbox.messages)
+            mailbox.idle_done = False
+        if mailbox.burst:
+            # Send the continuation and an update in the same segment
+            self.wfile.write('+ idling\r\n* %d EXISTS\r\n' % known)
+            self.wfile.flush()
+        else:
+            self.send('+ idling')
+        waiter = threading.Thread(target=self.wait_for_mail,
+                                  args=(mailbox, known))
+        waiter.daemon = True
+        waiter.start()
+        line = self.rfile.readline()
+        with mailbox.cond:
+            mailbox.idle_done = True
+            mailbox.cond.notify_all()
+        waiter.join()
+        if line.strip().upper() == 'DONE':
+            self.send('%s OK IDLE terminated' % tag)
+
+    def wait_for_mail(self, mailbox, known):
+        with mailbox.cond:
+            mailbox.idling.set()
+            while len(mailbox.messages) == known and not mailbox.idle_done:
+                mailbox.cond.wait()
+            mailbox.idling.clear()
+            if len(mailbox.messages) != known:
+                self.send('* %d EXISTS' % len(mailbox.messages))
+
+
+class IMAPStub(SocketServer.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        SocketServer.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0),
+                                                 IMAPStubHandler)
+        self.mailbox = self
+        self.cond = threading.Condition()
+        self.idling = threading.Event()
+        self.idle_done = False
+        self.burst = False
+        self.uidvalidity = 1
+        self.messages = {}
+        self.commands = []
+
+    def add_message(self, uid, sender, seen=False):
+        headers = ('From: %s\r\nDate: Mon, 5 Oct 2015 10:%02d:00 +0000' +
+                   '\r\n\r\n') % (sender, uid)
+        with self.cond:
+            self.messages[uid] = [headers, seen]
+            self.cond.notify_all()
+
+
+class TestIMAPSession(unittest.TestCase):
+
+    def setUp(self):
+        self.server = IMAPStub()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.session = imapsession.IMAPSession(
+            'jasper@example.com', 'secret', host='127.0.0.1',
+            port=self.server.server_address[1], imap_class=imaplib.IMAP4,
+            timeout=5)
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        self.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def testFetchUnseen(self):
+        self.server.add_message(3, 'Alice <alice@example.com>')
+        self.server.add_message(5, 'Bob <bob@example.com>', seen=True)
+        self.server.add_message(7, 'Carol <carol@example.com>')
+
+        msgs = self.session.fetch_unseen()
+        self.assertEqual([uid for uid, msg in msgs], [3, 7])
+        self.assertEqual(imapsession.getSender(msgs[0][1]), 'Alice')
+        self.assertEqual(self.session.uidvalidity, 1)
+
+        self.assertEqual(self.session.fetch_unseen(after=7), [])
+        self.server.add_message(8, 'Dave <dave@example.com>')
+        msgs = self.session.fetch_unseen(after=7)
+        self.assertEqual([uid for uid, msg in msgs], [8])
+        # Only headers are fetched and the connection is reused
+        self.assertFalse(any('RFC822' in command
+                             for command in self.server.commands))
+        self.assertEqual(sum(command.startswith('LOGIN')
+                             for command in self.server.commands), 1)
+
+    def testReconnect(self):
+        self.server.add_message(1, 'Alice <alice@example.com>')
+        self.assertEqual(self.session.search_unseen(), [1])
+        # Simulate a connection dropped by the server
+        self.session._conn.sock.close()
+        self.assertEqual(self.session.search_unseen(), [1])
+        self.assertEqual(sum(command.startswith('LOGIN')
+                             for command in self.server.commands), 2)
+
+    def testIdle(self):
+        self.assertFalse(self.session.idle(timeout=0.1))
+
+        def deliver():
+            self.server.idling.wait(5)
+            self.server.add_message(1, 'Alice <alice@example.com>')
+        t = threading.Thread(target=deliver)
+        t.start()
+        self.assertTrue(self.session.idle(timeout=5))
+        t.join()
+        self.assertEqual(self.session.search_unseen(), [1])
+
+    def testIdleBuffered(self):
+        self.server.add_message(1, 'Alice <alice@example.com>')
+        self.server.burst = True
+        started = time.time()
+        self.assertTrue(self.session.idle(timeout=5))
+        # The update was already buffered, so don't wait for the socket
+        self.assertLess(time.time() - started, 2)
+
+    def testIdleUnknownBuffer(self):
+        with mock.patch.object(imapsession.IMAPSession, '_has_buffered_data',
+                               return_value=None):
+            self.assertFalse(self.session.idle(timeout=0.1))
+            self.server.add_message(1, 'Alice <alice@example.com>')
+            self.server.burst = True
+            self.assertTrue(self.session.idle(timeout=5))
+        self.assertEqual(self.session.search_unseen(), [1])
+
+    def testBufferedData(self):
+        has_buffered_data = imapsession.IMAPSession._has_buffered_data
+        conn = mock.Mock(spec=['file', 'sslobj'])
+        conn.file._rbuf.getvalue.return_value = ''
+        conn.sslobj.pending.return_value = 0
+        self.assertFalse(has_buffered_data(conn))
+        # Records that the SSL object has already decrypted
+        conn.sslobj.pending.return_value = 10
+        self.assertTrue(has_buffered_data(conn))
+        conn.sslobj.pending.return_value = 0
+        conn.file._rbuf.getvalue.return_value = '* 1 EXISTS\r\n'
+        self.assertTrue(has_buffered_data(conn))
+        conn.file = object()
+        self.assertIsNone(has_buffered_data(conn))
+
+    def _notifier(self):
+        return GmailNotifier.GmailNotifier(
+            {'gmail_address': 'jasper@example.com'}, session=self.session,
+            state_file=os.path.join(self.tempdir, 'gmail-state.json'))
+
+    def testNotifier(self):
+        n = self._notifier()
+        self.assertIsNone(n.last_uid)
+        self.server.add_message(1, 'Alice <alice@example.com>')
+        self.assertEqual(n.get_notifications(), ["New email from Alice."])
+        self.assertEqual(n.last_uid, (1, 1))
+
+        self.assertEqual(n.get_notifications(), [])
+        self.assertEqual(n.last_uid, (1, 1))
+
+        self.server.add_message(2, 'Bob <bob@example.com>')
+        self.assertEqual(n.get_notifications(), ["New email from Bob."])
+        self.assertEqual(n.last_uid, (1, 2))
+
+    def testNotifierState(self):
+        n = self._notifier()
+        self.assertIsNone(n.load_state())
+        self.server.add_message(4, 'Alice <alice@example.com>')
+        n.get_notifications()
+
+        # A restarted notifier doesn't announce the same email again
+        n = self._notifier()
+        self.assertEqual(n.last_uid, (1, 4))
+        self.server.add_message(5, 'Bob <bob@example.com>')
+        self.assertEqual(n.get_notifications(), ["New email from Bob."])
+        self.assertEqual(n.load_state(), (1, 5))
+        self.assertIn('UID SEARCH UNSEEN UID 5:*', self.server.commands)
+
+        # After a UIDVALIDITY change, all unread emails are new
+        self.session.close()
+        self.server.uidvalidity = 2
+        self.assertEqual(len(n.get_notifications()), 2)
+        self.assertEqual(n.last_uid, (2, 5))
+
+        # State of another account is ignored
+        n.profile['gmail_address'] = 'other@example.com'
+        self.assertIsNone(n.load_state())
@@ -0,0 +1,97 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from client import languagemodel
+
+PHRASES = ['WHAT TIME IS IT', 'WHAT IS THE WEATHER', 'PLAY MUSIC',
+           'PLAY THE PLAYLIST', 'WHAT IS ON MY CALENDAR', 'TIME']
+
+
+class TestNgramLanguageModel(unittest.TestCase):
+
+    def setUp(self):
+        self.lm = languagemodel.NgramLanguageModel(order=3)
+        for phrase in PHRASES:
+            self.lm.add_sentence(phrase.split())
+        self.predictable = self.lm.vocabulary + [languagemodel.SENTENCE_END]
+
+    def testVocabulary(self):
+        self.assertEqual(self.lm.vocabulary,
+                         ['CALENDAR', 'IS', 'IT', 'MUSIC', 'MY', 'ON', 'PLAY',
+                          'PLAYLIST', 'THE', 'TIME', 'WEATHER', 'WHAT'])
+
+    def testProbabilitiesSumToOne(self):
+        contexts = [()]
+        contexts.extend(ngram[:n] for ngrams in self.lm._counts[1:]
+                        for ngram in ngrams for n in (1, 2))
+        contexts.append(('MY', 'TIME'))
+        for context in set(contexts):
+            if context and context[-1] == languagemodel.SENTENCE_END:
+                continue
+            total = sum(self.lm.prob(word, context)
+                        for word in self.predictable)
+            self.assertAlmostEqual(total, 1.0, places=6,
+                                   msg="Context %r sums to %f" %
+                                       (context, total))
+
+    def testSeenNgramsArePreferred(self):
+        self.assertGreater(self.lm.prob('IS', ('WHAT',)),
+                           self.lm.prob('MUSIC', ('WHAT',)))
+        self.assertGreater(self.lm.prob('MUSIC', ('PLAY',)), 0.0)
+        self.assertEqual(self.lm.prob(languagemodel.SENTENCE_START), 0.0)
+
+
+class TestArpaOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.output_file = os.path.join(self.tempdir, 'languagemodel')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def parse_arpa(self):
+        counts = {}
+        ngrams = {}
+        section = None
+        with open(self.output_file, 'r') as f:
+            lines = [line.strip() for line in f]
+        self.assertEqual(lines[0], '\\data\\')
+        self.assertEqual(lines[-1], '\\end\\')
+        for line in lines[1:-1]:
+            if not line:
+                continue
+            match = re.match(r'ngram (\d+)=(\d+)$', line)
+            if match:
+                counts[int(match.group(1))] = int(match.group(2))
+                continue
+            match = re.match(r'\\(\d+)-grams:$', line)
+            if match:
+                section = int(match.group(1))
+                ngrams[section] = {}
+                continue
+            fields = line.split()
+            self.assertIn(len(fields), (section + 1, section + 2))
+            prob = float(fields[0])
+            self.assertLessEqual(prob, 0.0)
+            ngrams[section][tuple(fields[1:section + 1])] = prob
+        return counts, ngrams
+
+    def testCompile(self):
+        words = languagemodel.compile_languagemodel(PHRASES, self.output_file)
+        self.assertIn('WEATHER', words)
+        counts, ngrams = self.parse_arpa()
+        self.assertEqual(sorted(counts.keys()), [1, 2, 3])
+        for n, count in counts.items():
+            self.assertEqual(len(ngrams[n]), count)
+        self.assertEqual(ngrams[1][('<s>',)], languagemodel.LOG10_ZERO)
+        # Decoders require every n-gram's prefix to be present
+        for n in (2, 3):
+            for ngram in ngrams[n]:
+                self.assertIn(ngram[:-1], ngrams[n - 1])
+        self.assertEqual(set(word for (word,) in ngrams[1]),
+                         set(words + ['<s>', '</s>']))
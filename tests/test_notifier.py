@@ -0,0 +1,80 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import Queue
+import threading
+import unittest
+import mock
+from client import notifier
+
+
+class DummySource(notifier.NotificationSource):
+    SLUG = 'dummy'
+    INTERVAL = 0.01
+
+    def __init__(self, profile, notifications, failures=0):
+        super(DummySource, self).__init__(profile)
+        self.notifications = list(notifications)
+        self.failures = failures
+        self.calls = 0
+        self.done = threading.Event()
+
+    def get_notifications(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise IOError('test')
+        if not self.notifications:
+            self.done.set()
+            return []
+        return [self.notifications.pop(0)]
+
+
+class BlockingSource(notifier.NotificationSource):
+    SLUG = 'blocking'
+
+    def __init__(self, profile):
+        super(BlockingSource, self).__init__(profile)
+        self.release = threading.Event()
+
+    def get_notifications(self):
+        self.release.wait(5)
+        return []
+
+
+class TestNotifier(unittest.TestCase):
+
+    def testGetSources(self):
+        sources = notifier.Notifier.get_sources()
+        self.assertIn('gmail', [source.SLUG for source in sources])
+        for source in sources:
+            self.assertTrue(issubclass(source, notifier.NotificationSource))
+
+    def testSourceRunner(self):
+        queue = Queue.Queue()
+        source = DummySource({}, ['first', 'second'], failures=2)
+        runner = notifier.SourceRunner(source, queue, max_backoff=0.05)
+        with mock.patch.object(runner._logger, 'warning') as mocked_log:
+            runner.start()
+            self.assertTrue(source.done.wait(5))
+            runner.stop()
+            runner.join(5)
+            self.assertEqual(mocked_log.call_count, 2)
+        self.assertEqual([queue.get_nowait(), queue.get_nowait()],
+                         ['first', 'second'])
+
+    def testSourcesRunConcurrently(self):
+        blocking = BlockingSource({})
+        dummy = DummySource({}, ['hello'])
+        with mock.patch.object(notifier.Notifier, 'get_sources',
+                               classmethod(lambda cls: [])):
+            n = notifier.Notifier({})
+        n.sources = [blocking, dummy]
+        n.runners = [notifier.SourceRunner(source, n.q)
+                     for source in n.sources]
+        try:
+            for runner in n.runners:
+                runner.start()
+            self.assertTrue(dummy.done.wait(5))
+            self.assertEqual(n.getAllNotifications(), ['hello'])
+        finally:
+            n.stop()
+            blocking.release.set()
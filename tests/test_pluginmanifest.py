@@ -0,0 +1,138 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import os
+import shutil
+import tempfile
+import unittest
+import mock
+from client import pluginmanifest
+
+
+class TestPluginManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.plugin_dir = os.path.join(self.tempdir, 'modules')
+        os.mkdir(self.plugin_dir)
+        self._write_plugin('Foo', 'WORDS = ["FOO"]\nPRIORITY = 2\n')
+        self.manifest = pluginmanifest.PluginManifest(
+            os.path.join(self.tempdir, 'plugins.json'), [self.plugin_dir])
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _write_plugin(self, name, content):
+        with open(os.path.join(self.plugin_dir, name + '.py'), 'w') as f:
+            f.write(content)
+
+    def _save(self):
+        module = mock.Mock(WORDS=['FOO'], PRIORITY=2, spec=['WORDS',
+                                                            'PRIORITY'])
+        module.__name__ = 'Foo'
+        module.__file__ = os.path.join(self.plugin_dir, 'Foo.pyc')
+        files = self.manifest.get_plugin_files(self.manifest.locations)
+        self.manifest.save([module], files)
+
+    def testMissing(self):
+        self.assertIsNone(self.manifest.load())
+
+    def testRoundTrip(self):
+        self._save()
+        self.assertEqual(self.manifest.load(),
+                         [{'name': 'Foo',
+                           'file': os.path.join(self.plugin_dir, 'Foo.py'),
+                           'location': self.plugin_dir,
+                           'words': ['FOO'], 'priority': 2,
+                           'keyword_index': True, 'has_setup': False,
+                           'timeout': None, 'exclusive_mic': False,
+                           'valid_pattern': None, 'setup_requires': []}])
+
+    def testOutdated(self):
+        self._save()
+        self._write_plugin('Bar', 'WORDS = ["BAR"]\n')
+        self.assertIsNone(self.manifest.load())
+
+        self._save()
+        self.assertIsNotNone(self.manifest.load())
+        self._write_plugin('Foo', 'WORDS = ["FOO", "BAZ"]\n')
+        self.assertIsNone(self.manifest.load())
+
+    def testCorrupt(self):
+        with open(self.manifest.filename, 'w') as f:
+            f.write('{')
+        self.assertIsNone(self.manifest.load())
+
+
+class TestLazyModule(unittest.TestCase):
+
+    SOURCE = """
+import re
+import nonexistent_dependency
+
+WORDS = ["FOO", "BAR"]
+PRIORITY = 1
+
+
+def _normalize(text):
+    return text.upper()
+
+
+def handle(text, mic, profile):
+    nonexistent_dependency.handle(text)
+
+
+def isValid(text):
+    return any(re.search(r'\\b%s\\b' % word, _normalize(text))
+               for word in WORDS)
+"""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'LazyFoo.py')
+        with open(self.filename, 'w') as f:
+            f.write(self.SOURCE)
+        self.module = pluginmanifest.LazyModule(
+            {'name': 'LazyFoo', 'file': self.filename,
+             'location': self.tempdir, 'words': ['FOO', 'BAR'],
+             'priority': 1, 'keyword_index': True, 'has_setup': False})
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testImportOnIsValid(self):
+        self.assertEqual(self.module.WORDS, ['FOO', 'BAR'])
+        self.assertEqual(self.module.PRIORITY, 1)
+        self.assertFalse(self.module.is_loaded)
+        with self.assertRaises(ImportError):
+            self.module.isValid('foo')
+
+        with open(self.filename, 'w') as f:
+            f.write(self.SOURCE.replace('import nonexistent_dependency', ''))
+        self.assertTrue(self.module.isValid('bar'))
+        self.assertFalse(self.module.isValid('food'))
+        self.assertFalse(hasattr(self.module, 'setup'))
+        self.assertTrue(self.module.is_loaded)
+
+    def testImportOnHandle(self):
+        with self.assertRaises(ImportError):
+            self.module.handle('foo', None, None)
+
+        with open(self.filename, 'w') as f:
+            f.write(self.SOURCE.replace('import nonexistent_dependency', ''))
+        self.assertTrue(callable(self.module.handle))
+        self.assertTrue(self.module.is_loaded)
+
+    def testValidPattern(self):
+        module = pluginmanifest.LazyModule(
+            {'name': 'LazyFoo', 'file': self.filename,
+             'location': self.tempdir, 'words': ['FOO', 'BAR'],
+             'priority': 1, 'keyword_index': True, 'has_setup': True,
+             'valid_pattern': r'\b(foo|bar)\b',
+             'setup_requires': ['foo']})
+        self.assertTrue(module.isValid('some Foo'))
+        self.assertFalse(module.isValid('food'))
+        # Setup is skipped if the profile lacks a required section
+        self.assertIsNone(module.setup(None, {}))
+        self.assertFalse(module.is_loaded)
+        with self.assertRaises(ImportError):
+            module.setup(None, {'foo': {}})
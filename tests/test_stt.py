@@ -1,17 +1,15 @@
 #!/usr/bin/env python2
 # -*- coding: utf-8-*-
+import os
+import sys
 import unittest
 import imp
-from client import stt, jasperpath
-
-
-def cmuclmtk_installed():
-    try:
-        imp.find_module('cmuclmtk')
-    except ImportError:
-        return False
-    else:
-        return True
+import tempfile
+import shutil
+import time
+import threading
+import mock
+from client import stt, jasperpath, audiosegment
 
 
 def pocketsphinx_installed():
@@ -23,7 +21,6 @@ def pocketsphinx_installed():
         return True
 
 
-@unittest.skipUnless(cmuclmtk_installed(), "CMUCLMTK not present")
 @unittest.skipUnless(pocketsphinx_installed(), "Pocketsphinx not present")
 class TestSTT(unittest.TestCase):
 
@@ -49,3 +46,309 @@ class TestSTT(unittest.TestCase):
         with open(self.time_clip, mode="rb") as f:
             transcription = self.active_stt_engine.transcribe(f)
         self.assertIn("TIME", transcription)
+
+
+class TestStreaming(unittest.TestCase):
+
+    class BufferingSTT(stt.AbstractSTTEngine):
+        SLUG = 'buffering'
+
+        @classmethod
+        def is_available(cls):
+            return True
+
+        def transcribe(self, fp):
+            return [fp.raw_data]
+
+    def testDefaultStreaming(self):
+        engine = self.BufferingSTT()
+        self.assertFalse(engine.supports_streaming)
+        for i in range(2):
+            engine.start_stream()
+            self.assertEqual(engine.process_stream('\x01\x00'), [])
+            self.assertEqual(engine.process_stream('\x02\x00'), [])
+            self.assertEqual(engine.end_stream(), ['\x01\x00\x02\x00'])
+
+
+class TestPocketSphinxDecoderPool(unittest.TestCase):
+
+    class DummyConfig(dict):
+        def set_string(self, key, value):
+            self[key] = value
+
+    class DummyDecoder(object):
+        instances = 0
+
+        def __init__(self, config):
+            TestPocketSphinxDecoderPool.DummyDecoder.instances += 1
+            self.words = {}
+            self.searches = {'_default': config['-lm']}
+            self.search = '_default'
+
+        @classmethod
+        def default_config(cls):
+            return TestPocketSphinxDecoderPool.DummyConfig()
+
+        def get_search(self):
+            return self.search
+
+        def set_search(self, search):
+            self.search = search
+
+        def lookup_word(self, word):
+            return self.words.get(word)
+
+        def add_word(self, word, phones, update):
+            self.words[word] = phones
+
+        def set_lm_file(self, search, lm_path):
+            self.searches[search] = lm_path
+
+    def setUp(self):
+        self.hmm_dir = tempfile.mkdtemp()
+        self.DummyDecoder.instances = 0
+        self.ps = mock.Mock(Decoder=self.DummyDecoder)
+        self.patcher = mock.patch.object(stt.PocketSphinxSTT, '_decoders',
+                                         {})
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        shutil.rmtree(self.hmm_dir)
+
+    def _vocabulary(self, name, revision):
+        dict_path = '%s/%s.dict' % (self.hmm_dir, name)
+        with open(dict_path, 'w') as f:
+            f.write("%s\tF OW\n" % name.upper())
+        return mock.Mock(decoder_kwargs={'lm': '%s.lm' % name,
+                                         'dict': dict_path},
+                         compiled_revision=revision)
+
+    def testDecoderIsShared(self):
+        keyword = self._vocabulary('keyword', 'a')
+        music = self._vocabulary('music', 'b')
+        music.name = 'music'
+        get_decoder = stt.PocketSphinxSTT._get_decoder
+
+        pooled, search = get_decoder(self.ps, self.hmm_dir, keyword)
+        self.assertIs(get_decoder(self.ps, self.hmm_dir, keyword),
+                      get_decoder(self.ps, self.hmm_dir, keyword))
+
+        music_pooled, music_search = get_decoder(self.ps, self.hmm_dir,
+                                                 music)
+        self.assertIs(music_pooled, pooled)
+        self.assertEqual(music_search, 'music')
+        self.assertEqual(pooled.decoder.searches['music'], 'music.lm')
+        self.assertEqual(pooled.decoder.words, {'MUSIC': 'F OW'})
+        self.assertEqual(self.DummyDecoder.instances, 1)
+
+        other_dir = tempfile.mkdtemp()
+        try:
+            other_pooled, search = get_decoder(self.ps, other_dir, keyword)
+        finally:
+            shutil.rmtree(other_dir)
+        self.assertIsNot(other_pooled, pooled)
+        self.assertEqual(self.DummyDecoder.instances, 2)
+
+    def testNewRevision(self):
+        keyword = self._vocabulary('keyword', 'a')
+        music = self._vocabulary('music', 'b')
+        music.name = 'music'
+        get_decoder = stt.PocketSphinxSTT._get_decoder
+        pooled, search = get_decoder(self.ps, self.hmm_dir, keyword)
+        get_decoder(self.ps, self.hmm_dir, music)
+
+        # Recompiled vocabularies replace the searches of older revisions
+        for revision in ('c', 'd'):
+            music.compiled_revision = revision
+            self.assertEqual(get_decoder(self.ps, self.hmm_dir, music),
+                             (pooled, 'music'))
+            keyword.compiled_revision = revision
+            self.assertEqual(get_decoder(self.ps, self.hmm_dir, keyword),
+                             (pooled, search))
+        self.assertEqual(pooled.decoder.searches,
+                         {'_default': 'keyword.lm', 'music': 'music.lm'})
+        self.assertEqual(self.DummyDecoder.instances, 1)
+        self.assertEqual(len(stt.PocketSphinxSTT._decoders), 2)
+
+
+FAKE_JULIUS = """#!%s
+# Fake Julius server that handles a single utterance and exits
+import os
+import sys
+import socket
+import struct
+
+args = sys.argv[1:]
+with open(os.environ['FAKE_JULIUS_LOG'], 'a') as f:
+    f.write(' '.join(args) + '\\n')
+
+
+def listen(port):
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('localhost', port))
+    sock.listen(1)
+    return sock
+
+module_sock = listen(int(args[args.index('-module') + 1]))
+adin_sock = listen(int(args[args.index('-adport') + 1]))
+module_conn = module_sock.accept()[0]
+adin_file = adin_sock.accept()[0].makefile('rb')
+size = struct.unpack('<i', adin_file.read(4))[0]
+while size:
+    adin_file.read(size)
+    size = struct.unpack('<i', adin_file.read(4))[0]
+module_conn.sendall('<RECOGOUT>\\n<SHYPO RANK="1" SCORE="-1.0">\\n' +
+                    '<WHYPO WORD="TIME" CLASSID="1" PHONE="t ay m"/>\\n' +
+                    '</SHYPO>\\n</RECOGOUT>\\n.\\n')
+"""
+
+
+class TestJuliusSTT(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        executable = os.path.join(self.tempdir, 'julius')
+        with open(executable, 'w') as f:
+            f.write(FAKE_JULIUS % sys.executable)
+        os.chmod(executable, 0755)
+        self.log = os.path.join(self.tempdir, 'julius.log')
+        self.environ = mock.patch.dict(os.environ, {
+            'PATH': self.tempdir + os.pathsep + os.environ['PATH'],
+            'FAKE_JULIUS_LOG': self.log})
+        self.environ.start()
+        self.vocabulary = mock.Mock(dfa_file='dfa', dict_file='dict')
+
+    def tearDown(self):
+        self.environ.stop()
+        shutil.rmtree(self.tempdir)
+
+    def _starts(self):
+        with open(self.log, 'r') as f:
+            return f.read().splitlines()
+
+    def testRestart(self):
+        """Is a Julius server that died restarted on transcription?"""
+        engine = stt.JuliusSTT(vocabulary=self.vocabulary, timeout=5)
+        segment = audiosegment.AudioSegment('\0' * 3200)
+        try:
+            self.assertEqual(engine.transcribe(segment), ['TIME'])
+            # The fake server exits after one utterance
+            self.assertEqual(engine.transcribe(segment), ['TIME'])
+        finally:
+            engine._stop_server()
+        self.assertEqual(len(self._starts()), 2)
+
+    def testSeparatePorts(self):
+        """Does every instance get its own ports?"""
+        engines = [stt.JuliusSTT(vocabulary=self.vocabulary, timeout=5)
+                   for i in range(2)]
+        try:
+            ports = set()
+            for engine in engines:
+                self.assertTrue(engine.server_running)
+                ports.update([engine._module_port, engine._adin_port])
+            self.assertEqual(len(ports), 4)
+        finally:
+            for engine in engines:
+                engine.__del__()
+
+    def testParseResult(self):
+        message = ('<RECOGOUT>\n' +
+                   '  <SHYPO RANK="2" SCORE="-3000.0">\n' +
+                   '    <WHYPO WORD="<s>" CLASSID="0" PHONE="sil"/>\n' +
+                   '    <WHYPO WORD="DIME" CLASSID="1" PHONE="d ay m"/>\n' +
+                   '    <WHYPO WORD="</s>" CLASSID="2" PHONE="sil"/>\n' +
+                   '  </SHYPO>\n' +
+                   '  <SHYPO RANK="1" SCORE="-2000.0">\n' +
+                   '    <WHYPO WORD="<s>" CLASSID="0" PHONE="sil"/>\n' +
+                   '    <WHYPO WORD="WHAT" CLASSID="1" PHONE="w ah t"/>\n' +
+                   '    <WHYPO WORD="TIME" CLASSID="1" PHONE="t ay m"/>\n' +
+                   '    <WHYPO WORD="</s>" CLASSID="2" PHONE="sil"/>\n' +
+                   '  </SHYPO>\n' +
+                   '</RECOGOUT>\n')
+        self.assertEqual(stt.JuliusSTT.parse_result(message),
+                         ['WHAT TIME', 'DIME'])
+
+
+class TestEnsembleSTT(unittest.TestCase):
+
+    class DummyEngine(object):
+        SLUG = 'dummy'
+
+        def __init__(self, result, delay=0, error=None):
+            self.result = result
+            self.delay = delay
+            self.error = error
+            self.audio = None
+
+        def transcribe(self, fp):
+            time.sleep(self.delay)
+            self.audio = fp
+            if self.error:
+                raise self.error
+            return self.result
+
+    def setUp(self):
+        self.audio = stt.audiosegment.AudioSegment('\x00\x00' * 160)
+
+    def testFirstResult(self):
+        slow = self.DummyEngine(['SLOW'], delay=0.5)
+        fast = self.DummyEngine(['FAST'])
+        engine = stt.EnsembleSTT([slow, fast], strategy='first')
+        self.assertEqual(engine.transcribe(self.audio), ['FAST'])
+        self.assertIs(fast.audio, self.audio)
+
+    def testFirstSkipsEmptyAndFailingEngines(self):
+        engines = [self.DummyEngine([]),
+                   self.DummyEngine(['']),
+                   self.DummyEngine(None, error=ValueError('test')),
+                   self.DummyEngine(('TIME',), delay=0.05)]
+        engine = stt.EnsembleSTT(engines, strategy='first')
+        with mock.patch.object(engine._logger, 'error'):
+            self.assertEqual(engine.transcribe(self.audio), ['TIME'])
+
+    def testMerge(self):
+        engines = [self.DummyEngine(['WHAT TIME', 'WHAT DIME']),
+                   self.DummyEngine(['WHAT DIME', 'WHAT TIME'], delay=0.05),
+                   self.DummyEngine(['WHAT TIME']),
+                   self.DummyEngine([''])]
+        engine = stt.EnsembleSTT(engines, strategy='merge')
+        self.assertEqual(engine.transcribe(self.audio),
+                         ['WHAT TIME', 'WHAT DIME'])
+
+    def testTimeout(self):
+        engines = [self.DummyEngine(['LATE'], delay=0.5),
+                   self.DummyEngine(['ON TIME'])]
+        engine = stt.EnsembleSTT(engines, strategy='merge', timeout=0.1)
+        with mock.patch.object(engine._logger, 'warning') as mocked_log:
+            self.assertEqual(engine.transcribe(self.audio), ['ON TIME'])
+            self.assertTrue(mocked_log.called)
+
+    def testHangingEngine(self):
+        hanging = self.DummyEngine(['HUNG'])
+        release = threading.Event()
+        hanging.transcribe = lambda fp: release.wait(5)
+        self.addCleanup(release.set)
+        engines = [hanging, self.DummyEngine(['ON TIME'])]
+        engine = stt.EnsembleSTT(engines, strategy='merge', timeout=0.1)
+        with mock.patch.object(engine._logger, 'warning') as mocked_log:
+            # The hanging engine must not block the workers of later calls
+            for i in range(3):
+                self.assertEqual(engine.transcribe(self.audio), ['ON TIME'])
+            self.assertTrue(mocked_log.called)
+
+    def testGetInstance(self):
+        config = {'engines': ['dummy', 'ensemble'], 'strategy': 'merge'}
+        dummy = self.DummyEngine(['DUMMY'])
+        dummy_class = mock.Mock()
+        dummy_class.get_instance.return_value = dummy
+        with mock.patch.object(stt.EnsembleSTT, 'get_config',
+                               classmethod(lambda cls: dict(config))):
+            with mock.patch.object(stt, 'get_engine_by_slug',
+                                   return_value=dummy_class) as mocked_get:
+                engine = stt.EnsembleSTT.get_instance('default', ['DUMMY'])
+        mocked_get.assert_called_once_with('dummy')
+        self.assertEqual(engine.engines, [dummy])
+        self.assertEqual(engine.strategy, 'merge')
@@ -1,7 +1,13 @@
 #!/usr/bin/env python2
 # -*- coding: utf-8-*-
+import io
+import os
+import shutil
+import tempfile
+import time
 import unittest
-from client import tts
+import mock
+from client import tts, ttscache
 
 
 class TestTTS(unittest.TestCase):
@@ -9,3 +15,188 @@ class TestTTS(unittest.TestCase):
         tts_engine = tts.get_engine_by_slug('dummy-tts')
         tts_instance = tts_engine()
         tts_instance.say('This is a test.')
+
+
+class TestTTSCaching(unittest.TestCase):
+
+    class CountingTTS(tts.AbstractSynthesizingTTSEngine):
+        SLUG = 'counting-tts'
+
+        def __init__(self, voice='default'):
+            super(TestTTSCaching.CountingTTS, self).__init__()
+            self.voice = voice
+            self.synthesized = []
+            self.played = []
+
+        @classmethod
+        def is_available(cls):
+            return True
+
+        def get_speech(self, phrase):
+            self.synthesized.append(phrase)
+            with tempfile.NamedTemporaryFile(suffix='.wav',
+                                             delete=False) as f:
+                f.write(phrase)
+            return f.name
+
+        def play(self, filename):
+            with open(filename, 'rb') as f:
+                self.played.append(f.read())
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.engine = self.CountingTTS()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testWithoutCache(self):
+        self.engine.say('Pardon?')
+        self.engine.say('Pardon?')
+        self.assertEqual(self.engine.synthesized, ['Pardon?', 'Pardon?'])
+        self.assertEqual(self.engine.played, ['Pardon?', 'Pardon?'])
+
+    def testWithCache(self):
+        self.engine.cache = ttscache.TTSCache(self.tempdir)
+        self.engine.say('Pardon?')
+        self.engine.say('Pardon?')
+        self.engine.voice = 'other'
+        self.engine.say('Pardon?')
+        self.assertEqual(self.engine.synthesized, ['Pardon?', 'Pardon?'])
+        self.assertEqual(self.engine.played, ['Pardon?'] * 3)
+        self.assertEqual(len(os.listdir(self.tempdir)), 2)
+
+    def testVoiceSettings(self):
+        self.assertEqual(self.engine.voice_settings, {'voice': 'default'})
+
+    def testGetInstance(self):
+        cache = ttscache.TTSCache(self.tempdir)
+        with mock.patch.object(ttscache.TTSCache, 'get_instance',
+                               return_value=cache) as get_cache:
+            self.assertIs(self.CountingTTS.get_instance().cache, cache)
+            # Engines that don't synthesize audio files don't get a cache
+            engine = tts.get_engine_by_slug('dummy-tts').get_instance()
+            self.assertFalse(hasattr(engine, 'cache'))
+            self.assertEqual(get_cache.call_count, 1)
+
+
+class TestTTSPipelining(unittest.TestCase):
+
+    class SlowTTS(TestTTSCaching.CountingTTS):
+        SLUG = 'slow-tts'
+
+        def __init__(self, fail=None):
+            super(TestTTSPipelining.SlowTTS, self).__init__()
+            self.fail = fail
+            self.synthesized_while_playing = []
+
+        def get_speech(self, phrase):
+            if phrase == self.fail:
+                raise ValueError(phrase)
+            return super(TestTTSPipelining.SlowTTS, self).get_speech(phrase)
+
+        def play(self, filename):
+            # Give the worker thread time to synthesize ahead
+            time.sleep(0.05)
+            self.synthesized_while_playing.append(len(self.synthesized))
+            super(TestTTSPipelining.SlowTTS, self).play(filename)
+
+    def testSplitSentences(self):
+        self.assertEqual(tts.split_sentences('Hi. How are you?  Fine! 3.5'),
+                         ['Hi.', 'How are you?', 'Fine!', '3.5'])
+        self.assertEqual(tts.split_sentences(' Pardon? '), ['Pardon?'])
+        self.assertEqual(tts.split_sentences('Dr. Smith is late. Mr. Jones ' +
+                                             'and J. R. R. Tolkien are here.'),
+                         ['Dr. Smith is late.',
+                          'Mr. Jones and J. R. R. Tolkien are here.'])
+        self.assertEqual(tts.split_sentences('Lunch is at 1 p.m. today. ' +
+                                             'The weather is fine, e.g. ' +
+                                             'sunny. "Great!" Right.'),
+                         ['Lunch is at 1 p.m. today.',
+                          'The weather is fine, e.g. sunny.', '"Great!"',
+                          'Right.'])
+
+    def testPipelined(self):
+        engine = self.SlowTTS()
+        engine.say('One. Two. Three.')
+        self.assertEqual(engine.played, ['One.', 'Two.', 'Three.'])
+        self.assertGreaterEqual(engine.synthesized_while_playing[0], 2)
+
+    def testNotPipelined(self):
+        engine = self.SlowTTS()
+        engine.pipelined = False
+        engine.say('One. Two.')
+        self.assertEqual(engine.played, ['One. Two.'])
+
+    def testError(self):
+        engine = self.SlowTTS(fail='Two.')
+        self.assertRaises(ValueError, engine.say, 'One. Two. Three.')
+        self.assertEqual(engine.played, ['One.'])
+
+
+class TestMp3TTS(unittest.TestCase):
+
+    class DummyMp3TTS(tts.AbstractMp3TTSEngine):
+        SLUG = 'dummy-mp3-tts'
+
+        @classmethod
+        def is_available(cls):
+            return True
+
+        def get_mp3(self, phrase):
+            return io.BytesIO('MP3 ' + phrase)
+
+    class DummyMadFile(object):
+        def __init__(self, mp3):
+            self.mp3 = mp3
+            self.frames = ['\x01\x00\x01\x00', '\x02\x00\x02\x00']
+
+        def samplerate(self):
+            return 22050
+
+        def read(self):
+            return self.frames.pop(0) if self.frames else None
+
+    def setUp(self):
+        self.engine = self.DummyMp3TTS()
+        self.engine.player = mock.Mock()
+        self.engine.player.play_chunks.side_effect = (
+            lambda chunks, width, channels, rate: self.played.append(
+                (list(chunks), width, channels, rate)))
+        self.played = []
+        self.mad = mock.Mock()
+        self.mad.MadFile.side_effect = self.DummyMadFile
+
+    def testStreamFromMemory(self):
+        with mock.patch.object(tts, 'mad', self.mad, create=True):
+            self.engine.say('Hello')
+        mp3 = self.mad.MadFile.call_args[0][0]
+        self.assertEqual(mp3.getvalue(), 'MP3 Hello')
+        self.assertEqual(self.played, [(['\x01\x00\x01\x00',
+                                         '\x02\x00\x02\x00'], 2, 2, 22050)])
+
+    def testCachedFile(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            self.engine.cache = ttscache.TTSCache(tempdir)
+            with mock.patch.object(tts, 'mad', self.mad, create=True):
+                self.engine.say('Hello')
+            filename = self.mad.MadFile.call_args[0][0]
+            self.assertTrue(filename.startswith(tempdir))
+            with open(filename, 'rb') as f:
+                self.assertEqual(f.read(), 'MP3 Hello')
+            self.assertEqual(len(self.played), 1)
+        finally:
+            shutil.rmtree(tempdir)
+
+    def testFallbackToAplay(self):
+        self.engine.player.play_chunks.side_effect = IOError('Device busy')
+        with mock.patch.object(tts, 'mad', self.mad, create=True):
+            with mock.patch('subprocess.Popen') as popen:
+                popen.return_value.returncode = 0
+                self.engine.say('Hello')
+        self.assertEqual(self.mad.MadFile.call_count, 2)
+        self.assertEqual(self.mad.MadFile.call_args[0][0].tell(), 0)
+        popen.return_value.stdin.write.assert_has_calls(
+            [mock.call('\x01\x00\x01\x00'),
+             mock.call('\x02\x00\x02\x00')])
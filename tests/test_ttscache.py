@@ -0,0 +1,66 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import os
+import shutil
+import tempfile
+import unittest
+from client import ttscache
+
+
+class TestTTSCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache = ttscache.TTSCache(os.path.join(self.tempdir, 'cache'),
+                                       max_size=25)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _synthesize(self, content, suffix='.wav'):
+        fd, fname = tempfile.mkstemp(suffix=suffix, dir=self.tempdir)
+        os.write(fd, content)
+        os.close(fd)
+        return fname
+
+    def testGetKey(self):
+        key = self.cache.get_key('espeak-tts', {'voice': 'default+m3'},
+                                 'Pardon?')
+        self.assertEqual(key, self.cache.get_key(
+            'espeak-tts', {'voice': 'default+m3'}, u'Pardon?'))
+        self.assertNotEqual(key, self.cache.get_key(
+            'espeak-tts', {'voice': 'default+f2'}, 'Pardon?'))
+        self.assertNotEqual(key, self.cache.get_key(
+            'pico-tts', {'voice': 'default+m3'}, 'Pardon?'))
+        self.assertNotEqual(key, self.cache.get_key(
+            'espeak-tts', {'voice': 'default+m3'}, 'Pardon'))
+
+    def testPutAndGet(self):
+        self.assertIsNone(self.cache.get('a'))
+        path = self.cache.put('a', self._synthesize('0123456789'))
+        self.assertTrue(path.endswith('a.wav'))
+        self.assertEqual(self.cache.get('a'), path)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), '0123456789')
+        self.assertEqual(self.cache.size, 10)
+
+    def testEviction(self):
+        self.cache.put('a', self._synthesize('0123456789'))
+        self.cache.put('b', self._synthesize('0123456789', suffix='.mp3'))
+        # Use 'a', so that 'b' is the least recently used entry
+        self.cache.get('a')
+        self.cache.put('c', self._synthesize('0123456789'))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertIsNotNone(self.cache.get('c'))
+        self.assertEqual(self.cache.size, 20)
+        self.assertEqual(len(os.listdir(self.cache.directory)), 2)
+
+    def testReload(self):
+        path = self.cache.put('a', self._synthesize('0123456789'))
+        cache = ttscache.TTSCache(self.cache.directory, max_size=25)
+        self.assertEqual(cache.get('a'), path)
+        self.assertEqual(cache.size, 10)
+        cache.clear()
+        self.assertIsNone(cache.get('a'))
+        self.assertFalse(os.path.exists(path))
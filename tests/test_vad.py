@@ -0,0 +1,79 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import unittest
+import array
+import math
+from client import vad
+
+
+def make_chunk(values):
+    return array.array('h', values).tostring()
+
+
+class TestFrameFeatures(unittest.TestCase):
+
+    def testScore(self):
+        self.assertAlmostEqual(vad.score(make_chunk([300, -300] * 512)), 100)
+        self.assertEqual(vad.score(''), 0)
+
+    def testZeroCrossingRate(self):
+        self.assertEqual(vad.zero_crossing_rate(make_chunk([100] * 64)), 0)
+        self.assertAlmostEqual(
+            vad.zero_crossing_rate(make_chunk([100, -100] * 32)), 63 / 64.0)
+
+    def testSlidingAverage(self):
+        average = vad.SlidingAverage(3, initial=3)
+        self.assertEqual(average.value, 3)
+        self.assertEqual(average.update(6), 4)
+        average.update(6)
+        self.assertEqual(average.update(6), 6)
+        self.assertEqual(average.update(0), 4)
+
+
+class TestVoiceActivityDetector(unittest.TestCase):
+
+    def setUp(self):
+        self.detector = vad.VoiceActivityDetector(100, window=3)
+        self.speech = make_chunk([int(600 * math.sin(i / 8.0))
+                                  for i in range(1024)])
+        self.silence = make_chunk([0] * 1024)
+
+    def testStartOfSpeech(self):
+        self.assertTrue(self.detector.is_speech(self.speech))
+        self.assertFalse(self.detector.is_speech(self.silence))
+        hiss = make_chunk([600, -600] * 512)
+        self.assertFalse(self.detector.is_speech(hiss))
+
+    def testEndOfSpeech(self):
+        self.assertFalse(self.detector.is_silence(self.speech))
+        self.assertFalse(self.detector.is_silence(self.silence))
+        self.assertTrue(self.detector.is_silence(self.silence))
+
+
+class TestNoiseFloor(unittest.TestCase):
+
+    def setUp(self):
+        self.noise_floor = vad.NoiseFloor(warmup=5)
+
+    def testWarmup(self):
+        for value in (10, 20, 30, 40):
+            self.noise_floor.update(value)
+        self.assertFalse(self.noise_floor.ready)
+        self.noise_floor.update(50)
+        self.assertTrue(self.noise_floor.ready)
+        self.assertAlmostEqual(self.noise_floor.level, 30)
+        self.assertAlmostEqual(self.noise_floor.threshold, 54)
+
+    def testSpeechBarelyRaisesLevel(self):
+        for i in range(5):
+            self.noise_floor.update(100)
+        for i in range(50):
+            self.noise_floor.update(1000)
+        self.assertLess(self.noise_floor.level, 150)
+
+    def testAdaptsToQuieterBackground(self):
+        for i in range(5):
+            self.noise_floor.update(100)
+        for i in range(50):
+            self.noise_floor.update(10)
+        self.assertLess(self.noise_floor.level, 15)
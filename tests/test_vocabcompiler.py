@@ -1,12 +1,24 @@
 #!/usr/bin/env python2
 # -*- coding: utf-8-*-
+import os
 import unittest
 import tempfile
 import contextlib
 import logging
 import shutil
+import tarfile
+import fcntl
 import mock
-from client import vocabcompiler
+from client import vocabcompiler, g2p
+
+
+def phonetisaurus_installed():
+    try:
+        g2p.PhonetisaurusG2P(**g2p.PhonetisaurusG2P.get_config())
+    except OSError:
+        return False
+    else:
+        return True
 
 
 class TestVocabCompiler(unittest.TestCase):
@@ -14,12 +26,27 @@ class TestVocabCompiler(unittest.TestCase):
     def testPhraseExtraction(self):
         expected_phrases = ['MOCK']
 
-        mock_module = mock.Mock()
+        mock_module = mock.Mock(spec=['WORDS', 'isValid', 'handle'])
+        mock_module.__name__ = 'mock'
         mock_module.WORDS = ['MOCK']
 
-        with mock.patch('client.brain.Brain.get_modules',
-                        classmethod(lambda cls: [mock_module])):
-            extracted_phrases = vocabcompiler.get_all_phrases()
+        with mock.patch('client.pluginmanifest.PluginManifest.load',
+                        return_value=None):
+            with mock.patch('client.brain.Brain.get_modules',
+                            classmethod(lambda cls: [mock_module])):
+                extracted_phrases = vocabcompiler.get_all_phrases()
+        self.assertEqual(expected_phrases, extracted_phrases)
+
+    def testPhraseExtractionFromManifest(self):
+        expected_phrases = ['MOCK', 'OTHER']
+
+        descriptions = [{'name': 'mock', 'words': ['OTHER', 'MOCK'],
+                         'priority': 0, 'keyword_index': True}]
+        with mock.patch('client.pluginmanifest.PluginManifest.load',
+                        return_value=descriptions):
+            with mock.patch('client.brain.Brain.get_modules') as get_modules:
+                extracted_phrases = vocabcompiler.get_all_phrases()
+                self.assertFalse(get_modules.called)
         self.assertEqual(expected_phrases, extracted_phrases)
 
     def testKeywordPhraseExtraction(self):
@@ -94,26 +121,23 @@ class TestPocketsphinxVocabulary(TestVocabulary):
 
     VOCABULARY = vocabcompiler.PocketsphinxVocabulary
 
-    @unittest.skipUnless(hasattr(vocabcompiler, 'cmuclmtk'),
-                         "CMUCLMTK not present")
+    @unittest.skipUnless(phonetisaurus_installed(),
+                         "Phonetisaurus or fst_model not present")
     def testVocabulary(self):
+        self._testVocabulary()
+
+    def _testVocabulary(self):
         super(TestPocketsphinxVocabulary, self).testVocabulary()
         self.assertIsInstance(self.vocab.decoder_kwargs, dict)
         self.assertIn('lm', self.vocab.decoder_kwargs)
         self.assertIn('dict', self.vocab.decoder_kwargs)
 
     def testPatchedVocabulary(self):
-
-        def write_test_vocab(text, output_file):
-            with open(output_file, "w") as f:
-                for word in text.split(' '):
-                    f.write("%s\n" % word)
-
-        def write_test_lm(text, output_file, **kwargs):
-            with open(output_file, "w") as f:
-                f.write("TEST")
+        translated = []
 
         class DummyG2P(object):
+            model_checksum = 'dummy'
+
             def __init__(self, *args, **kwargs):
                 pass
 
@@ -121,15 +145,139 @@ class TestPocketsphinxVocabulary(TestVocabulary):
             def get_config(self, *args, **kwargs):
                 return {}
 
-            def translate(self, *args, **kwargs):
+            def translate(self, words, *args, **kwargs):
+                translated.extend(words)
                 return {'GOOD': ['G UH D',
                                  'G UW D'],
                         'BAD': ['B AE D'],
                         'UGLY': ['AH G L IY']}
 
-        with mock.patch('client.vocabcompiler.cmuclmtk',
-                        create=True) as mocked_cmuclmtk:
-            mocked_cmuclmtk.text2vocab = write_test_vocab
-            mocked_cmuclmtk.text2lm = write_test_lm
-            with mock.patch('client.vocabcompiler.PhonetisaurusG2P', DummyG2P):
-                self.testVocabulary()
+        with mock.patch('client.vocabcompiler.PhonetisaurusG2P', DummyG2P):
+            self._testVocabulary()
+        # Forced recompilation reuses the cached pronunciations
+        self.assertEqual(sorted(translated), ['BAD', 'GOOD', 'UGLY'])
+
+
+class TestVoxForgeLexicon(unittest.TestCase):
+
+    LEXICON = ("GOOD            [GOOD]          g uh d\n" +
+               "BAD             [BAD]           b ae d\n" +
+               "GOOD(2)         [GOOD]          g uw d\n" +
+               "UGLY            [UGLY]          ah g l iy\n")
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.lexicon_file = os.path.join(self.tempdir, 'VoxForgeDict')
+        with open(self.lexicon_file, 'w') as f:
+            f.write(self.LEXICON)
+        self.index_file = os.path.join(self.tempdir, 'lexicon.idx')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def assertTranslations(self, lexicon):
+        self.assertEqual(lexicon.translate_word('GOOD'),
+                         ['g uh d', 'g uw d'])
+        self.assertEqual(lexicon.translate_word('BAD'), ['b ae d'])
+        self.assertEqual(lexicon.translate_word('UGLY'), ['ah g l iy'])
+        self.assertEqual(lexicon.translate_word('MISSING'), [])
+        self.assertEqual(lexicon.translate_word('A'), [])
+        self.assertEqual(lexicon.translate_word('ZZZ'), [])
+
+    def testParse(self):
+        lexicon = vocabcompiler.JuliusVocabulary.VoxForgeLexicon(
+            self.lexicon_file)
+        self.assertTranslations(lexicon)
+
+    def testIndex(self):
+        Lexicon = vocabcompiler.JuliusVocabulary.VoxForgeLexicon
+        lexicon = Lexicon(self.lexicon_file, index_fname=self.index_file)
+        self.assertTranslations(lexicon)
+        lexicon.close()
+        self.assertTrue(os.path.exists(self.index_file))
+
+        # An up-to-date index is used without parsing the lexicon again
+        with mock.patch.object(Lexicon, 'parse') as mocked_parse:
+            lexicon = Lexicon(self.lexicon_file, index_fname=self.index_file)
+            self.assertTranslations(lexicon)
+            lexicon.close()
+            self.assertFalse(mocked_parse.called)
+
+        # The index is rebuilt when the lexicon changes
+        with open(self.lexicon_file, 'a') as f:
+            f.write("ZZZ             [ZZZ]           z z z\n")
+        lexicon = Lexicon(self.lexicon_file, index_fname=self.index_file)
+        self.assertEqual(lexicon.translate_word('ZZZ'), ['z z z'])
+        lexicon.close()
+
+    def testIndexFromArchive(self):
+        archive = os.path.join(self.tempdir, 'VoxForge.tgz')
+        with contextlib.closing(tarfile.open(archive, 'w:gz')) as tf:
+            tf.add(self.lexicon_file, arcname='VoxForge/VoxForgeDict')
+        lexicon = vocabcompiler.JuliusVocabulary.VoxForgeLexicon(
+            archive, 'VoxForge/VoxForgeDict', index_fname=self.index_file)
+        self.assertTranslations(lexicon)
+        lexicon.close()
+
+    def testCorruptIndex(self):
+        with open(self.index_file, 'w') as f:
+            f.write('X' * 64)
+        logging.disable(logging.WARNING)
+        try:
+            lexicon = vocabcompiler.JuliusVocabulary.VoxForgeLexicon(
+                self.lexicon_file, index_fname=self.index_file)
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertTranslations(lexicon)
+        lexicon.close()
+
+
+class TestCompileVocabularies(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testCompileVocabularies(self):
+        jobs = [(vocabcompiler.DummyVocabulary, 'keyword', ['JASPER']),
+                (vocabcompiler.DummyVocabulary, 'default', ['GOOD', 'BAD'])]
+        revisions = vocabcompiler.compile_vocabularies(jobs, self.tempdir,
+                                                       processes=2)
+        for vocabulary_class, name, phrases in jobs:
+            vocab = vocabulary_class(name, path=self.tempdir)
+            self.assertTrue(vocab.matches_phrases(phrases))
+            self.assertEqual(revisions[name], vocab.compiled_revision)
+
+        # Compiled vocabularies are skipped
+        with mock.patch('multiprocessing.Pool') as mocked_pool:
+            with mock.patch.object(vocabcompiler.DummyVocabulary,
+                                   'compile') as mocked_compile:
+                vocabcompiler.compile_vocabularies(jobs, self.tempdir)
+        self.assertFalse(mocked_pool.called)
+        self.assertFalse(mocked_compile.called)
+
+    def testLock(self):
+        vocab = vocabcompiler.DummyVocabulary(path=self.tempdir)
+        vocab.compile(['GOOD'])
+        with vocab.lock():
+            with open(vocab.lock_file, 'a') as f:
+                with self.assertRaises(IOError):
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        with open(vocab.lock_file, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def testRecheckAfterLock(self):
+        vocab = vocabcompiler.DummyVocabulary(path=self.tempdir)
+        vocab.compile(['GOOD'])
+        other = vocabcompiler.DummyVocabulary(path=self.tempdir)
+        # Another process finished compiling while we waited for the lock
+        with mock.patch.object(other, '_compile_vocabulary') as mocked:
+            with mock.patch.object(vocabcompiler.DummyVocabulary,
+                                   'compiled_revision',
+                                   new_callable=mock.PropertyMock,
+                                   side_effect=[None,
+                                                vocab.compiled_revision]):
+                other.compile(['GOOD'])
+        self.assertFalse(mocked.called)
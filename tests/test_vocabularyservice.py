@@ -0,0 +1,77 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import threading
+import unittest
+from client import vocabularyservice
+
+
+class TestVocabularyService(unittest.TestCase):
+
+    class DummySource(vocabularyservice.VocabularySource):
+        def __init__(self, phrases):
+            self.phrases = phrases
+            self.changed = threading.Event()
+
+        def get_phrases(self):
+            return dict(self.phrases)
+
+        def wait_for_change(self):
+            self.changed.wait()
+            self.changed.clear()
+
+    class DummyEngine(object):
+        VOCABULARY_TYPE = None
+        instances = []
+
+        def __init__(self, vocabulary_name, phrases):
+            self.vocabulary_name = vocabulary_name
+            self.phrases = phrases
+
+        @classmethod
+        def get_instance(cls, vocabulary_name, phrases):
+            instance = cls(vocabulary_name, phrases)
+            cls.instances.append(instance)
+            return instance
+
+    def setUp(self):
+        self.DummyEngine.instances = []
+        self.source = self.DummySource({'music': ['PLAY', 'STOP'],
+                                        'music-songs': ['PLAY', 'STOP',
+                                                        'YESTERDAY']})
+        self.service = vocabularyservice.VocabularyService(self.DummyEngine,
+                                                           self.source)
+
+    def testUpdate(self):
+        self.assertIsNone(self.service.get_instance('music'))
+        self.service.update()
+        self.assertTrue(self.service.is_ready('music'))
+        self.assertEqual(self.service.get_instance('music-songs').phrases,
+                         ['PLAY', 'STOP', 'YESTERDAY'])
+        # The smaller vocabulary is compiled first
+        self.assertEqual([x.vocabulary_name for x in
+                          self.DummyEngine.instances],
+                         ['music', 'music-songs'])
+
+        # Only changed vocabularies are recompiled
+        self.source.phrases['music-songs'] = ['PLAY', 'STOP', 'HELP']
+        self.service.update()
+        self.assertEqual(len(self.DummyEngine.instances), 3)
+        self.assertEqual(self.service.get_instance('music-songs').phrases,
+                         ['PLAY', 'STOP', 'HELP'])
+
+    def testThread(self):
+        self.service.start()
+        instance = self.service.get_instance('music-songs', timeout=5)
+        self.assertIsNotNone(instance)
+        self.source.phrases['music'] = ['PLAY']
+        self.source.changed.set()
+        for i in range(50):
+            if self.service.get_instance('music').phrases == ['PLAY']:
+                break
+            self.service._stop_event.wait(0.1)
+        self.assertEqual(self.service.get_instance('music').phrases,
+                         ['PLAY'])
+        self.service.stop()
+        self.source.changed.set()
+        self.service.join(5)
+        self.assertFalse(self.service.is_alive())